@@ -6,7 +6,7 @@ import configparser
 import yaml
 
 from icube.target_ref.guis.Main_gui import *
-from icube.target_ref.data_handlers.data_collector import Datacollector
+from icube.target_ref.src.data_handlers.data_collector import Datacollector
 
 from icube.target_ref.src.icube_interface import ICubeInterfaceV3
 from icube.target_ref.src.device_commands import ICubeVersion
@@ -90,6 +90,15 @@ def parse_args():
     parser.add_argument("-t", "--grab-tolerance", type=float, default=1.0,
                         help="tolerance on detecting grab actions, lower = more sensible")
 
+    parser.add_argument("--persistence", choices=["csv", "npz"], default="csv",
+                        help="how to store the cube data: csv text or npz binary columnar chunks")
+
+    parser.add_argument("--durable", action="store_true",
+                        help="sync the data files to disk after each phase, slower but safe on crashes")
+
+    parser.add_argument("--target-rate", type=float, default=None,
+                        help="minimum sample rate of each cube in Hz, a warning is logged when a cube is slower")
+
     parser.add_argument("-i", "--init", action="store_true",
                         help="Init the current folder with assets and a trials boilerplate")
 
@@ -128,9 +137,9 @@ def main():
         shutil.copytree(f"{DEFAULT_PATH}/trials.yaml")
         sys.exit(0)
 
-    controller = GuiController(resource_path=params.resource_path)
+    controller = GuiController(resource_path=params.resource_path, target_rate=params.target_rate)
 
-    controller.init_data_collector(storage_path="./data")
+    controller.init_data_collector(storage_path="./data", persistence=params.persistence, durable=params.durable)
 
     if params.detect_grabbing:
         controller.init_handling_classifier(grab_tolerance=params.grab_tolerance)
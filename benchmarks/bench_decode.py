@@ -0,0 +1,87 @@
+"""
+Decode of the replies: the parsers of the device classes and the whole read paths over the DeviceSimulator
+"""
+
+import pytest
+
+from icube.target_ref.src.device_commands import ICubeVersion
+from icube.target_ref.src.device_simulator import DeviceSimulator
+from icube.target_ref.src.icube_device import ICubeV3, ICubeV4
+from icube.target_ref.src.icube_interface import ICubeInterfaceV3
+from icube.target_ref.src.tactile.common.touch_frame import TouchFrame
+
+from sample_data import SEED
+
+
+@pytest.fixture(scope="module")
+def icube_v3():
+    return ICubeV3()
+
+
+def bench_parse_quaternion_string(benchmark, icube_v3, simulated_v3_replies):
+    quaternion_reply, _, _ = simulated_v3_replies
+    quaternions = benchmark(icube_v3.parse_quaternion_string, quaternion_reply)
+    assert len(quaternions) == 4
+
+
+def bench_parse_accelerometer_message(benchmark, icube_v3, simulated_v3_replies):
+    _, _, accelerometer_reply = simulated_v3_replies
+    accelerometer = benchmark(icube_v3.parse_accelerometer_message, list(accelerometer_reply))
+    assert len(accelerometer) == 3
+
+
+def bench_v3_touch_unpacking(benchmark, icube_v3, simulated_v3_replies, samples):
+    """
+    The touch reply to the face strings stored in the CSV, as read_touch and the CSV dump do
+    """
+    _, touch_reply, _ = simulated_v3_replies
+
+    def unpack():
+        return icube_v3.parse_touch_message(list(touch_reply)).to_strings()
+
+    assert benchmark(unpack) == samples[0][1].to_strings()
+
+
+def bench_v4_facets_decode(benchmark, samples):
+    touches = samples[0][1]
+    facets = [[100 if pad else 0 for pad in face] for face in touches.to_array()]
+    assert benchmark(TouchFrame.from_pads, facets) == touches
+
+
+@pytest.fixture
+def simulated_v4(samples):
+    simulator = DeviceSimulator(ICubeVersion.V4, latency=0, seed=SEED)
+    simulator.set_state(touches=samples[0][1].faces)
+    device = ICubeV4()
+    device.serial_communication.attach_serial(simulator.open_serial())
+    yield device
+    simulator.stop()
+
+
+def bench_v4_read_all_touches(benchmark, simulated_v4, samples):
+    """
+    The whole read: register the facets, request them and decode the six frames
+    """
+    _, touch_frame = benchmark.pedantic(simulated_v4.read_all_touches, kwargs={"timeout": 0.2}, rounds=20,
+                                        warmup_rounds=1)
+    assert touch_frame == samples[0][1]
+
+
+@pytest.fixture(params=[False, True], ids=["sequential", "pipelined"])
+def simulated_interface(request, samples):
+    interface = ICubeInterfaceV3(reader_mode=True, pipelined=request.param)
+    assert interface.start_simulated("benchmark", timeout=2, latency=0, seed=SEED)
+    quaternions, touches, accelerometer = samples[0]
+    interface.simulator.set_state(quaternion=quaternions, acceleration=accelerometer, touches=touches.faces)
+    yield interface
+    interface.device.command_executor.stop()
+    interface.device.stop_reader()
+    interface.simulator.stop()
+
+
+def bench_grab(benchmark, simulated_interface):
+    """
+    Sample throughput of the POLL mode: requests, replies, parse and rotation of a whole sample
+    """
+    quaternions, touches, accelerometer, _ = benchmark(simulated_interface.grab, 0.2)
+    assert quaternions and touches is not None and accelerometer
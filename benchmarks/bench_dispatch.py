@@ -0,0 +1,60 @@
+"""
+Dispatch of the samples to the handlers, a batch of 1000 samples for each round
+"""
+
+import numpy as np
+import pytest
+
+from icube.target_ref.src.data_handlers.aggregator import AggregateMode, CallbackAggregator
+from icube.target_ref.src.data_handlers.icube_movements_classifier import GraspDetector
+from icube.target_ref.src.tactile.communication.sample_bus import SampleBus
+
+
+def handle_all(handle, samples):
+    for sample in samples:
+        handle(*sample)
+
+
+def bench_grasp_detector_handle(benchmark, samples):
+    detector = GraspDetector(grab_tolerance=1)
+    detector.set_on_grab_callback(lambda timestamp: None)
+    detector.set_on_pose_callback(lambda timestamp: None)
+    benchmark(handle_all, detector.handle, samples)
+
+
+def bench_grasp_detector_handle_batch(benchmark, samples):
+    accelerometer = np.array([sample[2] for sample in samples])
+    touches = np.array([sample[1].faces for sample in samples])
+    timestamps = np.arange(len(samples)) * 10_000_000
+    detector = GraspDetector(grab_tolerance=1)
+    benchmark(detector.handle_batch, accelerometer, touches, timestamps)
+
+
+@pytest.mark.parametrize("aggr_mode", [AggregateMode.SYNC, AggregateMode.ASYNC], ids=["sync", "async"])
+@pytest.mark.parametrize("n_callbacks", [1, 4])
+def bench_callback_aggregator_handle(benchmark, samples, n_callbacks, aggr_mode):
+    """
+    The cost of handle for the caller (the grabber loop): in ASYNC mode only the queueing of the samples
+    """
+    aggregator = CallbackAggregator(aggr_mode=aggr_mode)
+    for _ in range(n_callbacks):
+        aggregator.add_callback(lambda quaternions, touches, accelerometer, timestamp=None: None)
+    benchmark(handle_all, aggregator.handle, samples)
+    aggregator.quit()
+
+
+@pytest.mark.parametrize("n_subscribers", [0, 4])
+def bench_sample_bus_publish(benchmark, samples, n_subscribers):
+    """
+    The cost of publish for the grabber loop, whatever the number of subscribers reading the bus
+    """
+    bus = SampleBus(capacity=len(samples))
+    subscriptions = [bus.subscribe(f"subscriber_{i}") for i in range(n_subscribers)]
+
+    def publish_all():
+        for i, (quaternions, touches, accelerometer) in enumerate(samples):
+            bus.publish("REFERENCE", i, quaternions, touches, accelerometer)
+
+    benchmark(publish_all)
+    assert all(len(subscription.poll()) == len(samples) for subscription in subscriptions)
+    bus.close()
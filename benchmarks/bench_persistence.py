@@ -0,0 +1,73 @@
+"""
+Persistence of the recordings and orientation derived from them, for recordings of different lengths
+"""
+
+import time
+
+import pytest
+
+from icube.target_ref.src.data_handlers.base import BaseDumper
+from icube.target_ref.src.data_handlers.CSVgenerator import CSVFile
+from icube.target_ref.src.data_handlers.data_collector import Datacollector
+from icube.target_ref.src.data_handlers.NPZgenerator import NPZFile
+from icube.target_ref.src.data_handlers.sample_store import SampleStore
+
+from sample_data import RECORDING_LENGTHS, make_samples
+
+
+@pytest.fixture(scope="module", params=RECORDING_LENGTHS, ids=lambda length: f"{length}_samples")
+def recording(request):
+    return make_samples(request.param)
+
+
+@pytest.fixture
+def data_collector():
+    # the dumps do nothing: only the buffering of the samples is measured
+    collector = Datacollector(persistence=BaseDumper())
+    collector.add_subject(subject_id="S1")
+    collector.add_trial(trial_id="T1")
+    return collector
+
+
+def bench_datacollector_push_data(benchmark, data_collector, recording):
+    def new_phase():
+        if data_collector.recording:
+            data_collector.stop_memo()
+        data_collector.start_memo("T1")
+
+    def push_all():
+        # the samples of the phase, stamped after its start and before they are pushed: the collector drops the
+        # ones before the start and keeps the recent ones for the next phase
+        timestamp = time.perf_counter_ns()
+        for i, sample in enumerate(recording):
+            data_collector.push_data(*sample, timestamp=timestamp + i * 1_000)
+
+    benchmark.pedantic(push_all, setup=new_phase, rounds=10, warmup_rounds=1)
+    assert data_collector.cube_data_id == len(recording)
+
+
+@pytest.fixture(scope="module")
+def phase_data(recording):
+    store = SampleStore(subject_id="S1", trial_id="T1", phase="MEMO")
+    timestamp = time.perf_counter_ns()
+    for i, sample in enumerate(recording):
+        store.append(timestamp + i * 10_000_000, *sample)
+    return store
+
+
+@pytest.mark.parametrize("dumper_class", [CSVFile, NPZFile], ids=["csv", "npz"])
+def bench_dump_cube_data(benchmark, tmp_path, phase_data, dumper_class):
+    dumper = dumper_class(storage_path=str(tmp_path))
+    benchmark.pedantic(dumper.dump_cube_data, args=(phase_data,), rounds=10, warmup_rounds=1)
+    dumper.quit()
+
+
+def bench_phase_orientation(benchmark, phase_data):
+    """
+    The orientation of a whole phase, derived from the stored quaternions
+    """
+    def derive():
+        return phase_data.rotation_matrices(), phase_data.euler_angles(), phase_data.angular_velocity()
+
+    rotation_matrices, _, _ = benchmark(derive)
+    assert rotation_matrices.shape == (len(phase_data), 3, 3)
@@ -0,0 +1,52 @@
+"""
+Benchmarks of the hot paths of the sample pipeline: decode of the device replies, dispatch of the samples to the
+handlers and persistence of the recordings. The data is generated with a fixed seed and the serial paths run
+against the DeviceSimulator, so the numbers are comparable between runs on the same machine.
+
+Run them from this folder, with the root of the repository importable (conftest.py adds it to sys.path):
+    pytest                                                        # print the results
+    pytest --benchmark-save=baseline                              # save them as the JSON baseline, in baselines/
+    pytest --benchmark-compare --benchmark-compare-fail=median:20%   # fail on a regression against the last save
+The log and the handshake timings of the run are written to a temporary folder, not to the working folder.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from icube.target_ref.src.device_commands import ICubeVersion
+from icube.target_ref.src.device_simulator import DeviceSimulator
+from icube.target_ref.src.tactile.common.paths import File, Paths
+
+from sample_data import SEED, make_samples
+
+
+@pytest.fixture(scope="session", autouse=True)
+def working_files(tmp_path_factory):
+    """
+    The log and the handshake timings go to a temporary folder
+    """
+    folder = tmp_path_factory.mktemp("icube")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(Paths, "logs", str(folder / "logs"))
+        patch.setattr(Paths, "handshake_timings_file", str(folder / File.handshake_timings))
+        yield folder
+
+
+@pytest.fixture(scope="session")
+def samples():
+    return make_samples(1000)
+
+
+@pytest.fixture(scope="session")
+def simulated_v3_replies(samples):
+    """
+    The replies of an iCube V3 for the first sample: quaternions, touches and accelerometer, as bytes
+    """
+    quaternions, touches, accelerometer = samples[0]
+    simulator = DeviceSimulator(ICubeVersion.V3, seed=SEED)
+    simulator.set_state(quaternion=quaternions, acceleration=accelerometer, touches=touches.faces)
+    return simulator.quaternion_reply(), simulator.touch_reply(), simulator.accelerometer_reply()
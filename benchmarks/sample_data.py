@@ -0,0 +1,29 @@
+"""
+Reproducible data of the benchmarks
+"""
+
+import numpy as np
+
+from icube.target_ref.src.tactile.common.touch_frame import TouchFrame
+
+SEED = 1234
+RECORDING_LENGTHS = [100, 1000, 10000]  # samples: 1 s, 10 s and 100 s of recording at 100 Hz
+N_FACETS = 6
+
+
+def make_samples(n_samples, n_facets=N_FACETS, seed=SEED):
+    """
+    @fn make_samples
+    @brief It generates random samples as they come out of the interface
+    @param n_samples the number of samples
+    @param n_facets the number of facets of the device
+    @param seed the seed of the random generator
+    @return list of (quaternions, TouchFrame, accelerometer)
+    """
+    rng = np.random.default_rng(seed)
+    quaternions = rng.normal(size=(n_samples, 4))
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    faces = rng.integers(0, 1 << 16, size=(n_samples, n_facets), dtype=np.uint16)
+    accelerations = rng.normal([0.0, 0.0, 9.81], 0.5, size=(n_samples, 3))
+    return [(q.tolist(), TouchFrame(f), a.tolist())
+            for q, f, a in zip(quaternions.round(4), faces, accelerations.round(2))]
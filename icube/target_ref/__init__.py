@@ -1,3 +1,3 @@
 from .src.icube_interface import *
-from .data_handlers import *
+from .src.data_handlers import *
 from .guis import *
@@ -1,24 +1,31 @@
+import os
 import sys
 import collections
 import time
 import random
 
 from PyQt5.QtGui import *
-from PyQt5.QtCore import QSize, Qt, pyqtSlot, QEvent, QObject
+from PyQt5.QtCore import QSize, Qt, pyqtSlot, QEvent, QObject, QTimer
 from PyQt5.QtGui import QPixmap, QIntValidator
 from PyQt5.QtWidgets import *
 
 from qt_material import apply_stylesheet
 
-from icube.target_ref.data_handlers.CSVgenerator import CSVFile
-from icube.target_ref.data_handlers.data_collector import Datacollector
-from icube.target_ref.data_handlers.constants import *
+from icube.target_ref.src.data_handlers.CSVgenerator import CSVFile
+from icube.target_ref.src.data_handlers.NPZgenerator import NPZFile
+from icube.target_ref.src.data_handlers.async_dumper import AsyncDumper
+from icube.target_ref.src.data_handlers.data_collector import Datacollector
+from icube.target_ref.src.data_handlers.constants import *
+from icube.target_ref.guis.image_cache import ImageCache
 
 from icube.target_ref.src.icube_interface import ICubeInterfaceV3 as ICubeInterface
+from icube.target_ref.src.device_startup import start_devices
 from icube.target_ref.src.tactile.tactile_device import TactileDevice
 from icube.target_ref.src.device_commands import ICubeVersion
-from icube.target_ref.src.data_handlers.aggregator import CallbackAggregator, AggregateMode
-from icube.target_ref.src.data_handlers.icube_movements_classifier import GraspDetector
+from icube.target_ref.src.data_handlers.grasp_events import GraspEventChannel
+from icube.target_ref.src.data_handlers.icube_movements_classifier import GraspDetector, GraspState
+from icube.target_ref.src.tactile.common import instrumentation
+from icube.target_ref.src.tactile.communication.sample_bus import SampleBus
 from icube.target_ref.src.tactile.common import tactile_logging as log
 
 from tobiipg2.TobiiInterface import Tobii
@@ -100,49 +107,81 @@ class DemographicsDialog(QDialog):
         return self.edit_id.text(), self.edit_age.text(), self.combo_hand.currentText()
 
 
+class ImageSlot(QWidget):
+    # a single image view: the image and its label
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image = QLabel(self)
+        self.image.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
+
+        self.text = QLabel(self)
+        self.text.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
+        self.text.setStyleSheet("font-size: 20pt; font-weight: bold;")
+
+        vl = QVBoxLayout(self)
+        vl.setContentsMargins(0, 0, 0, 0)
+        vl.addWidget(self.image, 9)
+        vl.addWidget(self.text, 1)
+
+    def set_image(self, pixmap, label=""):
+        self.image.setPixmap(pixmap)
+        self.text.setText(label)
+
+
 class MultiImageH(QWidget):
-    def __init__(self):
+    """
+    A row of images. The ImageSlot are created the first time they are needed and then reused: clear() hides
+    them and add_image fills the first hidden one, so the widgets are never deleted nor allocated again.
+    """
+    def __init__(self, cache=None):
         super().__init__()
         self.h_layout = QHBoxLayout(self)
+        self.slots = []
+        self.used_slots = 0
+        # the images are decoded and scaled once, possibly in advance, see prefetch_images
+        self.cache = cache if cache is not None else ImageCache()
+
+    def __next_slot(self):
+        if self.used_slots == len(self.slots):
+            slot = ImageSlot(self)
+            slot.hide()
+            self.h_layout.addWidget(slot)
+            self.slots.append(slot)
+        slot = self.slots[self.used_slots]
+        self.used_slots += 1
+        return slot
 
     def add_image(self, path, label="", w=50, h=50):
-        # Single image view
-        single_image = QLabel(self)
-        single_image.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
-        single_image.setPixmap(QPixmap(path).scaled(
-            QSize(w, h), aspectRatioMode=Qt.KeepAspectRatio, transformMode=Qt.SmoothTransformation
-        ))
-
-        text = QLabel(label)
-        text.setAlignment(Qt.AlignCenter | Qt.AlignVCenter)
-        text.setStyleSheet("font-size: 20pt; font-weight: bold;")
+        slot = self.__next_slot()
+        slot.set_image(self.cache.get(path, w, h), label)
+        slot.show()
 
-        vl = QVBoxLayout()
-        vl.addWidget(single_image, 9)
-        vl.addWidget(text, 1)
-
-        self.h_layout.addLayout(vl)
+    @staticmethod
+    def image_size(images, w=50, h=50):
+        """
+        @return: the size of the images in a row, a single image is larger
+        """
+        if len(images) == 1:
+            return 500, 500
+        return w, h
 
     def add_images(self, images, w=50, h=50):
-        wi = w
-        hi = h
-        if len(images) == 1:
-            wi = 500
-            hi = 500
+        wi, hi = self.image_size(images, w, h)
         for lbl, image_path in images.items():
             self.add_image(image_path, lbl, wi, hi)
 
+    def prefetch_images(self, images, w=50, h=50):
+        """
+        Load the images of a later add_images in the background
+        """
+        wi, hi = self.image_size(images, w, h)
+        for image_path in images.values():
+            self.cache.prefetch(image_path, wi, hi)
+
     def clear(self):
-        self.__clear_layout(self.h_layout)
-
-    def __clear_layout(self, layout):
-        while layout.count():
-            item = layout.takeAt(0)
-            widget = item.widget()
-            if widget is not None:
-                widget.deleteLater()
-            else:
-                self.__clear_layout(item.layout())
+        for slot in self.slots[:self.used_slots]:
+            slot.hide()
+        self.used_slots = 0
 
 
 class LineSep(QFrame):
@@ -208,15 +247,22 @@ class GoodbyeDialog(QDialog):
 
 class GuiController:
 
-    def __init__(self, resource_path=""):
+    def __init__(self, resource_path="", target_rate=None):
+        """
+        @param resource_path: where to look for assets and trials
+        @param target_rate: minimum sample rate of each cube in Hz, a warning is logged when a cube is slower
+        """
 
         self.app = QApplication(sys.argv)
         apply_stylesheet(self.app, theme='light_blue.xml', invert_secondary=True, extra=extra)
 
         self.gui = TRICubeGui(resource_path=resource_path)
 
-        self.callbacks_aggregator = CallbackAggregator(aggr_mode=AggregateMode.SYNC)
+        # the cubes publish their samples on the bus, the data collector and the grasp detectors subscribe to it
+        self.sample_bus = SampleBus()
         self.data_collector = None
+        self.storage_path = None
+        self.target_rate = target_rate
         self.randomizer = random.Random(time.time())
         self.tobii = Tobii()
         self.cube_reference = None
@@ -230,7 +276,10 @@ class GuiController:
         self.trials_groups = []
         self.used_groups = []
         self.trial_sequence = []
-        self.handling_classifier = None
+        self.handling_classifiers = {}
+        # the grasps detected on the sample threads, handled in the Qt event loop
+        self.grasp_events = GraspEventChannel()
+        self.grasp_timer = None
         self.next_trial_id = 0
 
         self.start_t_time = None
@@ -248,11 +297,6 @@ class GuiController:
         self.gui.ext_calibrate_tar_button_callback = self.calibration_cube
         self.gui.ext_init_tobii_button_callback = self.init_connect_tobii
 
-        self.gui.ext_start_ref_button_callback = self.start_streaming_cube
-        self.gui.ext_stop_ref_button_callback = self.stop_streaming_cube
-        self.gui.ext_start_tar_button_callback = self.start_streaming_cube
-        self.gui.ext_stop_tar_button_callback = self.stop_streaming_cube
-
         self.gui.ext_start_memo_button_callback = self.start_memo
         self.gui.ext_stop_memo_button_callback = self.stop_memo
         self.gui.ext_start_recall_button_callback = self.start_recall
@@ -265,31 +309,36 @@ class GuiController:
         self.gui.ext_annotate_tobii_callback = self.tobii.send_event
         self.gui.ext_disconnect_tobii_callback = self.tobii.disconnect
 
-    def init_cubes(self, serial_port_reference="", serial_port_target="", fake_it=False):
+    def init_cubes(self, serial_port_reference="", serial_port_target="", fake_it=False, deadline=15):
 
         """
         @A brief code to initialize the cubes, check the connection, if not connected it quits the app
         @and then renders randomly the first trial
+        @The cubes stream from now until close: the phases only record their samples, so a grasp of a cube can
+        @start a phase
         @param serial_port_reference: Reference cube connection port
         @param serial_port_target: Target cube connection port
         @param fake_it
+        @param deadline: max time to start up both the cubes, they are started in parallel when both the ports are
+        @given, one after the other otherwise
         @return:
         """
 
         self.cube_reference = ICubeInterface(is_mocked=fake_it)
         self.cube_target = ICubeInterface(is_mocked=fake_it)
 
-        self.cube_reference.init(name="REFERENCE", serial_port=serial_port_reference)
-        self.cube_target.init(name="TARGET", serial_port=serial_port_target)
+        startup = start_devices([(self.cube_reference, "REFERENCE", serial_port_reference),
+                                 (self.cube_target, "TARGET", serial_port_target)], deadline=deadline)
 
-        ref_ok = self.cube_reference.device.is_device_connected(timeout=2)
-        target_ok = self.cube_target.device.is_device_connected(timeout=2)
-
-        if not (ref_ok and target_ok):
+        if not all(result.ok for result in startup.values()):
+            log.error("The cubes are not ready: %s", list(startup.values()))
             self.app.quit()
+            return
 
-        self.cube_reference.bind_callback(self.data_collector.push_data)
-        self.cube_target.bind_callback(self.data_collector.push_data)
+        self.cube_reference.bind_bus(self.sample_bus, cube=Icubetype.REFERENCE.name)
+        self.cube_target.bind_bus(self.sample_bus, cube=Icubetype.TARGET.name)
+        self.start_streaming_cube(Icubetype.REFERENCE)
+        self.start_streaming_cube(Icubetype.TARGET)
 
         if not self.trial_sequence:
             self.next_trial_sequence()
@@ -312,6 +361,7 @@ class GuiController:
         # Render the first trial
         trial_id = self.next_trial_id
         self.gui.render_trial(trial=self.trials[trial_id])
+        self.prefetch_trials()
 
     def calibration_cube(self, cube_type=Icubetype, calibration_time=10):
         """
@@ -334,33 +384,57 @@ class GuiController:
         self.tobii.connect(connection=connection.lower(), frequency=frequency)
         return self.tobii.get_rtsp_url()
 
-    def init_data_collector(self, storage_path="data"):
+    def init_data_collector(self, storage_path="data", persistence="csv", write_behind=True, durable=False):
         """
-        Initialize the CSV data dumper and binds the callback
+        Initialize the data dumper and binds the callback
         @param storage_path:
+        @param persistence: csv = CSVFile, npz = binary columnar NPZFile
+        @param write_behind: True to store the data in a background thread, the phase changes do not wait for it
+        @param durable: True to sync the files to disk after each write
         @return:
         """
-        data_dumper = CSVFile(storage_path=storage_path)
+        if persistence == "npz":
+            data_dumper = NPZFile(storage_path=storage_path)
+        else:
+            data_dumper = CSVFile(storage_path=storage_path)
+        if write_behind:
+            data_dumper = AsyncDumper(data_dumper, durable=durable)
+        self.storage_path = storage_path
         self.data_collector = Datacollector(persistence=data_dumper)
-        # self.callbacks_aggregator.add_callback(self.data_collector.push_data)
+        self.data_collector.attach(self.sample_bus, {Phase.MEMO: Icubetype.REFERENCE.name,
+                                                     Phase.RECALL: Icubetype.TARGET.name})
 
-    def init_handling_classifier(self, grab_tolerance=1):
+    def init_handling_classifier(self, grab_tolerance=1, poll_interval=10):
         """
-        Init the detection of grasp from the participants
+        Init the detection of grasp from the participants: the grasp and the pose of the reference cube start and
+        stop the memorization, the ones of the target cube the recall. The phases take the timestamp of the sample
+        where the grasp or the pose started.
         @param grab_tolerance: How much be tolerant on accelerations
+        @param poll_interval: how often the detected grasps are handled, in ms
         @return:
         """
-        self.handling_classifier = GraspDetector(grab_tolerance=grab_tolerance)
-        self.handling_classifier.set_on_grab_callback(self.__fake_spacebar)
-        self.handling_classifier.set_on_pose_callback(self.__fake_spacebar)
-        self.callbacks_aggregator.add_callback(self.handling_classifier.handle)
+        for cube_type in (Icubetype.REFERENCE, Icubetype.TARGET):
+            detector = GraspDetector(grab_tolerance=grab_tolerance)
+            self.grasp_events.connect(detector, cube_type)
+            self.sample_bus.attach(detector.handle, name="grasp_" + cube_type.name.lower(), cube=cube_type.name)
+            self.handling_classifiers[cube_type] = detector
+
+        self.grasp_timer = QTimer()
+        self.grasp_timer.timeout.connect(self.__handle_grasp_events)
+        self.grasp_timer.start(poll_interval)
 
-    def __fake_spacebar(self):
+    def __handle_grasp_events(self):
         """
-        Fake a SPACEBAR press, to start and stop the data collection
+        Start or stop the phase of the cube grasped or posed, as the START / STOP buttons do
         @return:
         """
-        press("space")
+        for event in self.grasp_events.poll():
+            grabbed = event.state == GraspState.GRABBED
+            if event.cube == Icubetype.REFERENCE:
+                if grabbed != self.gui.memo_started and self.gui.memo_start_stop_btn.isEnabled():
+                    self.gui.memo_start_stop(timestamp=event.timestamp)
+            elif grabbed != self.gui.recall_started and self.gui.recall_start_stop_btn.isEnabled():
+                self.gui.recall_start_stop(timestamp=event.timestamp)
 
     def start_streaming_cube(self, cube_type=Icubetype.REFERENCE, streaming_timeout=0.4):
         """
@@ -370,9 +444,9 @@ class GuiController:
         """
 
         if cube_type == Icubetype.REFERENCE:
-            self.cube_reference.start_streaming(timeout=streaming_timeout)
+            self.cube_reference.start_streaming(timeout=streaming_timeout, target_rate=self.target_rate)
         else:
-            self.cube_target.start_streaming(timeout=streaming_timeout)
+            self.cube_target.start_streaming(timeout=streaming_timeout, target_rate=self.target_rate)
 
     def stop_streaming_cube(self, cube_type=Icubetype.REFERENCE):
         """
@@ -434,10 +508,20 @@ class GuiController:
         next_group_id = self.randomizer.randrange(len(self.trials_groups))
         self.trial_sequence = self.trials_groups.pop(next_group_id)
         self.used_groups.append(self.trial_sequence)
+        self.prefetch_trials()
 
-    def start_memo(self):
+    def prefetch_trials(self):
+        """
+        Load the images of the trials left in the sequence, any of them can be the next one
+        @return:
+        """
+        self.gui.prefetch_trials([self.trials[trial_id] for trial_id in self.trial_sequence
+                                  if trial_id in self.trials])
+
+    def start_memo(self, timestamp=None):
         """
         Start next memorization phase
+        @param timestamp: time.perf_counter_ns when the phase started, None for now
         """
 
         # for trial, value in self.trials.items():
@@ -448,25 +532,26 @@ class GuiController:
         #         break
 
         trial_id = self.next_trial_id
-        self.data_collector.start_memo(trial_id)
+        self.data_collector.start_memo(trial_id, timestamp=timestamp)
         self.gui.phase_render(self.data_collector)
 
-    def start_recall(self):
+    def start_recall(self, timestamp=None):
         """
         Start next recall phase
+        @param timestamp: time.perf_counter_ns when the phase started, None for now
         """
 
         # trial_id = self.trial_sequence[self.next_trial_id]
-        self.data_collector.start_recall(self.next_trial_id)
+        self.data_collector.start_recall(self.next_trial_id, timestamp=timestamp)
         self.gui.phase_render(self.data_collector)
 
-    def stop_memo(self):
+    def stop_memo(self, timestamp=None):
 
-        self.data_collector.stop_memo()
+        self.data_collector.stop_memo(timestamp=timestamp)
 
-    def stop_recall(self):
+    def stop_recall(self, timestamp=None):
 
-        self.data_collector.stop_recall()
+        self.data_collector.stop_recall(timestamp=timestamp)
 
     def load_answer(self, answer):
         """
@@ -480,6 +565,7 @@ class GuiController:
 
         # trial_id = self.trial_sequence[self.next_trial_id]
         self.gui.render_trial(trial=self.trials[self.next_trial_id])
+        self.prefetch_trials()
 
     def skip_condition(self):
 
@@ -493,19 +579,45 @@ class GuiController:
         self.randomizer.shuffle(self.trial_sequence)
         self.next_trial_id = self.trial_sequence.pop(0)
         self.gui.render_trial(trial=self.trials[self.next_trial_id])
+        self.prefetch_trials()
 
     def close(self):
         """
         Gracefully close the communication
         @return:
         """
+        if self.grasp_timer is not None:
+            self.grasp_timer.stop()
+        self.gui.multi_images.cache.quit()
+        self.sample_bus.close()
         self.data_collector.quit()
         self.tobii.disconnect()
+        for cube in (self.cube_reference, self.cube_target):
+            if cube is not None:
+                cube.close()
+        self.dump_metrics()
         """        
         self.cube_reference.stop_streaming()
         self.cube_target.stop_streaming()
         """
 
+    def metrics(self):
+        """
+        The metrics of the streaming pipeline, they can be read at any time
+        @return: dictionary {cube name or "persistence": counters, latency of each stage and sample rate}
+        """
+        return instrumentation.instrumentation().snapshot()
+
+    def dump_metrics(self):
+        """
+        Log the metrics of the streaming pipeline and store them with the data, in metrics.json
+        @return:
+        """
+        registry = instrumentation.instrumentation()
+        log.info("Streaming metrics:\n%s", registry.report())
+        if self.storage_path is not None:
+            registry.dump(os.path.join(self.storage_path, "metrics.json"))
+
     def run(self):
 
         return self.app.exec()
@@ -547,11 +659,6 @@ class TRICubeGui(QMainWindow):
         self.ext_calibrate_tar_button_callback = None
         self.ext_init_tobii_button_callback = None
 
-        self.ext_start_ref_button_callback = None
-        self.ext_stop_ref_button_callback = None
-        self.ext_start_tar_button_callback = None
-        self.ext_stop_tar_button_callback = None
-
         self.ext_start_memo_button_callback = None
         self.ext_stop_memo_button_callback = None
         self.ext_start_recall_button_callback = None
@@ -808,13 +915,20 @@ class TRICubeGui(QMainWindow):
 
     def memo_start_stop_callback(self):
 
+        self.memo_start_stop()
+
+    def memo_start_stop(self, timestamp=None):
+        """
+        Start or stop the memorization
+        @param timestamp: time.perf_counter_ns of the event starting or stopping it, None for now
+        """
+
         if not self.memo_started:
             self.memo_started = True
             self.ref_streamed = True
             self.memo_start_stop_btn.setText("STOP MEMO")
             self.memo_start_stop_btn.setProperty('class', 'danger')
-            self.ext_start_ref_button_callback(cube_type=Icubetype.REFERENCE)
-            self.ext_start_memo_button_callback()
+            self.ext_start_memo_button_callback(timestamp=timestamp)
             self.ext_annotate_tobii_callback(ev_type="Start Memo", value=self.current_trial)
 
         else:
@@ -822,8 +936,7 @@ class TRICubeGui(QMainWindow):
             self.ref_streamed = False
             self.memo_start_stop_btn.setText("START MEMO")
             self.memo_start_stop_btn.setProperty('class', 'danger')
-            self.ext_stop_memo_button_callback()
-            self.ext_stop_ref_button_callback(cube_type=Icubetype.REFERENCE)
+            self.ext_stop_memo_button_callback(timestamp=timestamp)
             self.recall_start_stop_btn.setEnabled(True)
             self.answer_insertion.setEnabled(False)
             self.memo_start_stop_btn.setEnabled(False)
@@ -831,13 +944,20 @@ class TRICubeGui(QMainWindow):
 
     def recall_start_stop_callback(self):
 
+        self.recall_start_stop()
+
+    def recall_start_stop(self, timestamp=None):
+        """
+        Start or stop the recall
+        @param timestamp: time.perf_counter_ns of the event starting or stopping it, None for now
+        """
+
         if not self.recall_started:
             self.recall_started = True
             self.tar_streamed = True
             self.recall_start_stop_btn.setText("STOP RECALL")
             self.recall_start_stop_btn.setProperty('class', 'danger')
-            self.ext_start_tar_button_callback(cube_type=Icubetype.TARGET)
-            self.ext_start_recall_button_callback()
+            self.ext_start_recall_button_callback(timestamp=timestamp)
             self.ext_annotate_tobii_callback(ev_type="Start Recall", value=self.current_trial)
 
         else:
@@ -845,8 +965,7 @@ class TRICubeGui(QMainWindow):
             self.tar_streamed = False
             self.recall_start_stop_btn.setText("START RECALL")
             self.recall_start_stop_btn.setProperty('class', 'danger')
-            self.ext_stop_recall_button_callback()
-            self.ext_stop_tar_button_callback(cube_type=Icubetype.TARGET)
+            self.ext_stop_recall_button_callback(timestamp=timestamp)
             self.ext_annotate_tobii_callback(ev_type="Stop Recall", value=self.current_trial)
             self.answer_insertion.setEnabled(True)
             self.recall_start_stop_btn.setEnabled(False)
@@ -944,3 +1063,12 @@ class TRICubeGui(QMainWindow):
 
         self.multi_images.add_images(images, w, h)
         self.multi_images.show()
+
+    def prefetch_trials(self, trials, w=200, h=200):
+        """
+        Load the images of the next trials in the background, so that render_trial does not wait for the disk
+        @param trials: the trials that may be rendered next
+        """
+        for trial in trials:
+            self.multi_images.prefetch_images(trial.ref_image, w, h)
+            self.multi_images.prefetch_images(trial.target_image, w, h)
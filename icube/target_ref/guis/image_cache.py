@@ -0,0 +1,132 @@
+import collections
+import queue
+import threading
+
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QImage, QPixmap
+
+from icube.target_ref.src.tactile.common import tactile_logging as log
+
+
+def load_scaled(path, w, h):
+    """
+    Decode an image and scale it to fit in w x h, keeping the aspect ratio.
+    It uses QImage, so it can run outside the GUI thread.
+    @param path: path of the image
+    @return: the QImage, a null QImage if the file cannot be read
+    """
+    image = QImage(path)
+    if image.isNull():
+        log.error(f"Cannot load the image {path}")
+        return image
+    return image.scaled(QSize(w, h), aspectRatioMode=Qt.KeepAspectRatio, transformMode=Qt.SmoothTransformation)
+
+
+class _Entry:
+    __slots__ = ('image', 'pixmap', 'ready', 'loading')
+
+    def __init__(self):
+        self.image = None
+        self.pixmap = None
+        self.ready = threading.Event()
+        self.loading = False  # a thread is decoding the image, set holding the lock of the cache
+
+
+class ImageCache:
+    """
+    @package ImageCache
+    @brief an LRU cache of the trial images, decoded and scaled, keyed by path and size.
+    prefetch() queues the images for a worker thread, which decodes and scales them as QImage; get(), on the GUI
+    thread, turns an image into a QPixmap once and then returns always the same QPixmap.
+    """
+
+    def __init__(self, capacity=64):
+        """
+        @param capacity: max number of images kept, the least recently used ones are dropped first
+        """
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.worker_thread = threading.Thread(target=self.__worker, name="image-cache", daemon=True)
+        self.worker_thread.start()
+
+    def __entry(self, key):
+        """
+        @return: the entry of the key, a new one if missing, and True if it is new. Called holding the lock.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry, False
+
+        entry = _Entry()
+        self.entries[key] = entry
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return entry, True
+
+    def __worker(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            key, entry = request
+            if not self.__claim(entry):
+                # get() is loading it
+                continue
+            try:
+                entry.image = load_scaled(*key)
+            except Exception as e:
+                log.exception(str(e) + ' ' + log.get_debug_info())
+            finally:
+                entry.ready.set()
+
+    def __claim(self, entry):
+        """
+        @return: True if the caller has to decode the image of the entry, False if another thread is doing it
+        """
+        with self.lock:
+            if entry.loading:
+                return False
+            entry.loading = True
+            return True
+
+    def prefetch(self, path, w, h):
+        """
+        Decode and scale an image in the background, if it is not cached yet
+        """
+        key = (path, w, h)
+        with self.lock:
+            entry, created = self.__entry(key)
+        if created:
+            self.requests.put((key, entry))
+
+    def get(self, path, w, h):
+        """
+        The image scaled to fit in w x h, to be called on the GUI thread.
+        It waits for the worker if it is decoding the image, it loads it here if the worker has not started it yet
+        (e.g. it is still queued behind other prefetches) or if it was never requested.
+        @return: the QPixmap
+        """
+        key = (path, w, h)
+        with self.lock:
+            entry, _ = self.__entry(key)
+        if self.__claim(entry):
+            try:
+                entry.image = load_scaled(path, w, h)
+            finally:
+                entry.ready.set()
+        if entry.pixmap is None:
+            entry.ready.wait()
+            entry.pixmap = QPixmap.fromImage(entry.image if entry.image is not None else QImage())
+            entry.image = None
+        return entry.pixmap
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def quit(self):
+        self.requests.put(None)
+        self.worker_thread.join()
@@ -1,6 +1,6 @@
-from icube.target_ref.data_handlers.base import BaseDumper
+from icube.target_ref.src.data_handlers.base import BaseDumper
 from icube.target_ref.src.tactile.common import tactile_logging as log
-from icube.target_ref.data_handlers.constants import *
+from icube.target_ref.src.data_handlers.constants import *
 
 import os
 import pandas as pd
@@ -30,6 +30,18 @@ class CSVTable:
     def write_line(self, txt):
         self.file.write(txt + "\n")
 
+    def write_lines(self, lines):
+        """
+        Write several lines at once, a single buffered write instead of one for each line
+        @param lines: the lines to write
+        """
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
     def close(self):
         self.file.close()
 
@@ -42,9 +54,11 @@ def init_storage_path(storage_path=""):
 class CSVFile(BaseDumper):
 
     SEPARATOR = ";"
+    WRITE_BATCH = 4096  # cube data rows for each write
     SUBJECT_HEADER = SEPARATOR.join(['subject_id', 'age', 'hand'])
     CUBE_DATA_HEADER = SEPARATOR.join(['subject_id', 'trial_id', 'phase',
-                                       'quaternions', 'touches', 'accelerometer'])
+                                       'quaternions', 'touches', 'accelerometer', 'timestamp_ns'])
+    CLOCK_HEADER = SEPARATOR.join(['perf_counter_ns', 'wall_time_ns', 'uncertainty_ns'])
     TRIALS_HEADER = SEPARATOR.join(['subject_id', 'trial_id', 'condition', 'trial_start', 'trial_stop',
                                     'memo_start', 'memo_stop', 'recall_start', 'recall_stop',
                                     'similarity', 'answer'])
@@ -61,6 +75,7 @@ class CSVFile(BaseDumper):
         self.subjects_file = CSVTable(path=self.subjects_path, header=self.SUBJECT_HEADER)
         self.cube_data_file = CSVTable(path=self.cube_data_path, header=self.CUBE_DATA_HEADER)
         self.trials_file = CSVTable(path=self.trial_path, header=self.TRIALS_HEADER)
+        self.clock_file = CSVTable(path=self.storage_path + "/session_clock.csv", header=self.CLOCK_HEADER)
 
     # def get_next_subject_id(self):
     #     """
@@ -82,6 +97,17 @@ class CSVFile(BaseDumper):
         self.subjects_file.close()
         self.cube_data_file.close()
         self.trials_file.close()
+        self.clock_file.close()
+
+    def sync(self):
+        """
+        Force the data written so far to disk
+        @return:
+        """
+        self.subjects_file.sync()
+        self.cube_data_file.sync()
+        self.trials_file.sync()
+        self.clock_file.sync()
 
     def dump_subject(self, subject):
         """
@@ -118,13 +144,29 @@ class CSVFile(BaseDumper):
                 str(x) for x in [subject_id, trial_id, trial_condition, t_start, t_stop,
                                  memo_start, memo_stop, recall_start, recall_stop, similarity, answer]))
 
+    def dump_session_clock(self, clock):
+        """
+        Store the mapping between the sample timestamps (time.perf_counter_ns) and the wall clock:
+        wall_time_ns = timestamp_ns - perf_counter_ns + wall_time_ns
+        @param clock: the SessionClock
+        @return:
+        """
+        super().dump_session_clock(clock)
+        self.clock_file.write_line(
+            self.SEPARATOR.join(str(x) for x in [clock.perf_ns, clock.wall_ns, clock.uncertainty_ns]))
+
     def dump_cube_data(self, cube_data):
         """
-        Store a new iCube datapoint
-        @param cube_data: (quaternions, touches, accelerations)
+        Store the iCube data of a phase
+        @param cube_data: SampleStore with the (quaternions, touches, accelerations) of the phase
         @return:
         """
         super().dump_cube_data(cube_data)
-        for data in cube_data:
-            self.cube_data_file.write_line(data.get_csv())
+        lines = []
+        for data in cube_data.iter_cube_data():
+            lines.append(data.get_csv())
+            if len(lines) == self.WRITE_BATCH:
+                self.cube_data_file.write_lines(lines)
+                lines = []
+        self.cube_data_file.write_lines(lines)
         log.info('Cube data stored')
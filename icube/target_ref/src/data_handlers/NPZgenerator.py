@@ -0,0 +1,169 @@
+from icube.target_ref.src.data_handlers.base import BaseDumper
+from icube.target_ref.src.data_handlers.CSVgenerator import CSVFile, CSVTable, init_storage_path
+from icube.target_ref.src.data_handlers.sample_store import N_PADS
+from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common import utilities as utils
+from icube.target_ref.src.data_handlers.constants import *
+
+import os
+import numpy as np
+
+
+class NPZFile(BaseDumper):
+    """
+    @package NPZFile
+    @brief a binary columnar data dumper.
+    Subjects and trials are stored in the same CSVs of CSVFile, the iCube data of each phase is stored as a
+    NumPy .npz chunk with typed columns:
+    * timestamps: int64, time.perf_counter_ns when the sample arrived (see session_clock.csv)
+    * quaternions: (N, 4) float32
+    * accelerometer: (N, 3) float32
+    * touches: (N, 6) uint16, pad i of each face on bit i
+    * flags: (N,) uint8, see sample_store
+    The chunks are listed in an index CSV by subject, trial and phase.
+    """
+
+    SEPARATOR = CSVFile.SEPARATOR
+    INDEX_HEADER = SEPARATOR.join(['subject_id', 'trial_id', 'phase', 'file', 'samples', 'first_timestamp',
+                                   'last_timestamp'])
+
+    def __init__(self, storage_path="", compressed=False):
+        """
+        @param storage_path: where to store the data
+        @param compressed: True to compress the chunks (smaller files, slower dumps)
+        """
+        self.storage_path = storage_path
+        self.compressed = compressed
+        init_storage_path(storage_path)
+
+        self.subjects_path = self.storage_path + "/subjects.csv"
+        self.trial_path = self.storage_path + "/trials.csv"
+        self.cube_data_path = self.storage_path + "/cube_data"
+        self.index_path = self.storage_path + "/cube_data_index.csv"
+        init_storage_path(self.cube_data_path)
+
+        log.info("Opening the Subjects, Trials and Cube Data index CSVs")
+        self.subjects_file = CSVTable(path=self.subjects_path, header=CSVFile.SUBJECT_HEADER)
+        self.trials_file = CSVTable(path=self.trial_path, header=CSVFile.TRIALS_HEADER)
+        self.index_file = CSVTable(path=self.index_path, header=self.INDEX_HEADER)
+        self.clock_file = CSVTable(path=self.storage_path + "/session_clock.csv", header=CSVFile.CLOCK_HEADER)
+        self.next_chunk_id = len(os.listdir(self.cube_data_path))
+
+    def quit(self):
+        """
+        Graceful close
+        @return:
+        """
+        log.info("Closing the files")
+        self.subjects_file.close()
+        self.trials_file.close()
+        self.index_file.close()
+        self.clock_file.close()
+
+    def sync(self):
+        """
+        Force the data written so far to disk, the chunks are closed as soon as they are written
+        @return:
+        """
+        self.subjects_file.sync()
+        self.trials_file.sync()
+        self.index_file.sync()
+        self.clock_file.sync()
+
+    def dump_subject(self, subject):
+        """
+        Store a new subject data
+        @param subject: unique subject id
+        @return:
+        """
+        super().dump_subject(subject)
+        self.subjects_file.write_line(subject.get_csv())
+
+    def dump_trial(self, subject_id=-1, trial_id=-1, trial_condition=Condition.HAPTIC_HAPTIC,
+                   similarity=Similarity.EQUAL, t_start=None, t_stop=None, memo_start=None, memo_stop=None,
+                   recall_start=None, recall_stop=None, answer=''):
+        """
+        Store a new trial data, same format of CSVFile
+        @return:
+        """
+        super().dump_trial(subject_id, trial_id, trial_condition, t_start, t_stop, memo_start, memo_stop,
+                           recall_start, recall_stop, similarity, answer)
+
+        self.trials_file.write_line(
+            self.SEPARATOR.join(
+                str(x) for x in [subject_id, trial_id, trial_condition, t_start, t_stop,
+                                 memo_start, memo_stop, recall_start, recall_stop, similarity, answer]))
+
+    def dump_session_clock(self, clock):
+        """
+        Store the mapping between the sample timestamps and the wall clock, same format of CSVFile
+        @param clock: the SessionClock
+        @return:
+        """
+        super().dump_session_clock(clock)
+        self.clock_file.write_line(
+            self.SEPARATOR.join(str(x) for x in [clock.perf_ns, clock.wall_ns, clock.uncertainty_ns]))
+
+    def dump_cube_data(self, cube_data):
+        """
+        Store the iCube data of a phase as a chunk
+        @param cube_data: SampleStore with the data of the phase
+        @return:
+        """
+        super().dump_cube_data(cube_data)
+        if len(cube_data) == 0:
+            return
+
+        phase = cube_data.phase.name if isinstance(cube_data.phase, Phase) else str(cube_data.phase)
+        file_name = "_".join([utils.remove_special_character_from_string(str(cube_data.subject_id)),
+                              utils.remove_special_character_from_string(str(cube_data.trial_id)),
+                              phase, str(self.next_chunk_id)]) + ".npz"
+        self.next_chunk_id += 1
+
+        columns = cube_data.columns()
+        save = np.savez_compressed if self.compressed else np.savez
+        save(os.path.join(self.cube_data_path, file_name), n_faces=np.uint8(cube_data.n_faces), **columns)
+
+        timestamps = columns['timestamps']
+        self.index_file.write_line(
+            self.SEPARATOR.join(
+                str(x) for x in [cube_data.subject_id, cube_data.trial_id, cube_data.phase, file_name,
+                                 len(cube_data), timestamps[0], timestamps[-1]]))
+        log.info('Cube data stored')
+
+
+def unpack_touches(touches, n_faces=None):
+    """
+    Expand the packed touches in a boolean matrix
+    @param touches: (N, faces) uint16 array
+    @param n_faces: number of faces to keep, all by default
+    @return: (N, faces, 16) bool array, True where the pad is touched
+    """
+    touches = np.asarray(touches, dtype='<u2')[:, :n_faces]
+    bits = np.unpackbits(touches.view(np.uint8), axis=-1, bitorder='little')
+    return bits.reshape(touches.shape + (N_PADS,)).astype(bool)
+
+
+def load_cube_data(storage_path="", subject_id=None, trial_id=None, phase=None):
+    """
+    Load the chunks stored by NPZFile
+    @param storage_path: where the data was stored
+    @param subject_id: keep only this subject, all if None
+    @param trial_id: keep only this trial, all if None
+    @param phase: keep only this phase (e.g. Phase.MEMO), all if None
+    @return: list of (index row, dictionary {column name: array})
+    """
+    chunks = []
+    with open(storage_path + "/cube_data_index.csv") as index_file:
+        header = index_file.readline().strip().split(NPZFile.SEPARATOR)
+        for line in index_file:
+            row = dict(zip(header, line.strip().split(NPZFile.SEPARATOR)))
+            if subject_id is not None and row['subject_id'] != str(subject_id):
+                continue
+            if trial_id is not None and row['trial_id'] != str(trial_id):
+                continue
+            if phase is not None and row['phase'] != str(phase):
+                continue
+            with np.load(os.path.join(storage_path, "cube_data", row['file'])) as data:
+                chunks.append((row, {name: data[name] for name in data.files}))
+    return chunks
@@ -1,5 +1,8 @@
 from .base import BaseHandler
 from .aggregator import AggregateMode
 from .aggregator import CallbackAggregator
+from .aggregator import DropPolicy
 from .icube_movements_classifier import GraspDetector
 from .icube_movements_classifier import GraspState
+from .grasp_events import GraspEvent
+from .grasp_events import GraspEventChannel
@@ -1,45 +1,213 @@
+import collections
 import enum
-import gevent
+import threading
+
+from icube.target_ref.src.tactile.common import instrumentation
+from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common.instrumentation import Stage
 
 
 class AggregateMode(enum.Enum):
     SYNC = 0,
-    ASYNC = 1
+    ASYNC = 1,
+
+
+class DropPolicy(enum.Enum):
+    BLOCK = 0,  # the producer waits for the callback to free a slot, nothing is lost
+    DROP_NEWEST = 1,  # the incoming sample is discarded
+    DROP_OLDEST = 2,  # the oldest pending sample is discarded, the callback always gets the most recent data
+
+
+class _Subscriber:
+    """
+    @class _Subscriber
+    @brief a callback of the aggregator in ASYNC mode, with its own bounded queue and worker thread
+    """
+
+    def __init__(self, callback, name, queue_size, drop_policy):
+        self.callback = callback
+        self.name = name
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.busy = False
+        self.running = False
+        self.worker = None
+        self.metrics = instrumentation.metrics("dispatch:" + name)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.worker = threading.Thread(target=self.__work, name="aggregator-" + self.name, daemon=True)
+        self.worker.start()
+
+    def offer(self, data, kwargs):
+        """
+        @fn offer
+        @brief queue a sample for the callback, applying the drop policy when the queue is full
+        @return False if the sample has been discarded
+        """
+        with self.condition:
+            if len(self.pending) >= self.queue_size:
+                self.metrics.count("queue_full")
+                if self.drop_policy == DropPolicy.DROP_NEWEST:
+                    self.metrics.count("dropped")
+                    return False
+                if self.drop_policy == DropPolicy.DROP_OLDEST:
+                    self.pending.popleft()
+                    self.metrics.count("dropped")
+                else:
+                    while self.running and len(self.pending) >= self.queue_size:
+                        self.condition.wait()
+            if not self.running:
+                self.metrics.count("dropped")
+                return False
+            self.pending.append((data, kwargs))
+            self.condition.notify_all()
+            return True
+
+    def __work(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                data, kwargs = self.pending.popleft()
+                self.busy = True
+                self.condition.notify_all()
+            try:
+                with self.metrics.time(Stage.callback):
+                    self.callback(*data, **kwargs)
+            except Exception as e:
+                log.exception(str(e) + ' ' + log.get_debug_info())
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        @fn flush
+        @brief wait until the callback has handled all the queued samples
+        @return False if the timeout expired first
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.busy, timeout=timeout)
+
+    def stop(self, timeout=None):
+        """
+        @fn stop
+        @brief stop the worker once the queued samples have been handled
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.worker is not None and self.worker is not threading.current_thread():
+            self.worker.join(timeout)
+        self.worker = None
 
 
 class CallbackAggregator:
     """
     @package CallbackAggregator
-    @brief a module to aggregate multiple callbacks and call them in a serial or asynchronous way
+    @brief a module to aggregate multiple callbacks and call them in a serial or concurrent way.
+    In ASYNC mode every callback has a bounded queue and a worker thread: handle only queues the sample, so a slow
+    callback (a file writer, a GUI update) never holds back the caller nor the other callbacks. When a queue is
+    full the DropPolicy of the callback decides between waiting and discarding a sample; the discarded samples
+    are counted in the "dispatch:<callback name>" metrics.
     @author Dario Pasquali
     """
 
-    def __init__(self, aggr_mode):
+    def __init__(self, aggr_mode, queue_size=64, drop_policy=DropPolicy.DROP_OLDEST):
         """
         @param aggr_mode: How to execute the callbacks:
-        * CallbackAggregator.ExecMode.SYNC = sequential execution
-        * CallbackAggregator.ExecMode.ASYNC = start a new callback if there is a delay in the current one
+        * AggregateMode.SYNC = sequential execution, in the thread calling handle
+        * AggregateMode.ASYNC = concurrent execution, each callback in its own worker thread
+        @param queue_size: default max number of samples waiting for a callback in ASYNC mode
+        @param drop_policy: default DropPolicy of the callbacks when their queue is full
         """
         self.aggr_mode = aggr_mode
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
         self.callbacks = []
+        self.subscribers = {}
+        self.lock = threading.Lock()
 
     def set_exec_mode(self, exec_mode):
+        """
+        Switch between SYNC and ASYNC, when switching to SYNC the samples already queued are handled first
+        @param exec_mode: AggregateMode
+        """
         self.aggr_mode = exec_mode
+        if exec_mode != AggregateMode.ASYNC:
+            self.stop()
 
-    def add_callback(self, callback):
-        self.callbacks.append(callback)
+    def add_callback(self, callback, queue_size=None, drop_policy=None, name=None):
+        """
+        @param callback: called with the data of each sample
+        @param queue_size: max number of samples waiting for the callback in ASYNC mode, None for the default
+        @param drop_policy: DropPolicy when the queue is full, None for the default
+        @param name: name of the worker thread and of the metrics, the name of the callback by default
+        """
+        if name is None:
+            name = getattr(callback, "__qualname__", None) or repr(callback)
+        subscriber = _Subscriber(callback, name,
+                                 queue_size=queue_size if queue_size is not None else self.queue_size,
+                                 drop_policy=drop_policy if drop_policy is not None else self.drop_policy)
+        with self.lock:
+            self.callbacks = self.callbacks + [callback]
+            self.subscribers[callback] = subscriber
 
     def remove_callback(self, callback):
-        self.callbacks.remove(callback)
+        """
+        Remove the callback, its queued samples are handled before
+        """
+        with self.lock:
+            self.callbacks = [clb for clb in self.callbacks if clb != callback]
+            subscriber = self.subscribers.pop(callback)
+        subscriber.stop()
 
-    def handle(self, *data):
+    def handle(self, *data, **kwargs):
         """
         Handle the data from the iCUbe
         @param data:
+        @param kwargs: e.g. the timestamp of the sample
         @return:
         """
         if self.aggr_mode == AggregateMode.SYNC:
             for clb in self.callbacks:
-                clb(*data)
+                clb(*data, **kwargs)
         else:
-            gevent.joinall([gevent.spawn(clb(*data)) for clb in self.callbacks])
+            for clb in self.callbacks:
+                subscriber = self.subscribers[clb]
+                if not subscriber.running:
+                    subscriber.start()
+                subscriber.offer(data, kwargs)
+
+    def flush(self, timeout=None):
+        """
+        Wait until the callbacks have handled all the queued samples
+        @param timeout: max seconds to wait for each callback
+        @return: False if some samples are still queued
+        """
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        return all([subscriber.flush(timeout) for subscriber in subscribers])
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker threads once the queued samples have been handled, they are restarted by the next
+        handle in ASYNC mode
+        @param timeout: max seconds to wait for each worker
+        """
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for subscriber in subscribers:
+            subscriber.stop(timeout)
+
+    def quit(self):
+        self.stop()
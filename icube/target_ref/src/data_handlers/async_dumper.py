@@ -0,0 +1,93 @@
+import queue
+import threading
+
+from icube.target_ref.src.data_handlers.base import BaseDumper
+from icube.target_ref.src.tactile.common import instrumentation
+from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common.instrumentation import Stage
+
+
+class AsyncDumper(BaseDumper):
+    """
+    @package AsyncDumper
+    @brief a write-behind wrapper of another dumper.
+    The dump calls are queued and executed, in order, by a writer thread, so the caller (e.g. the GUI stopping a
+    phase) returns immediately whatever the amount of data to store.
+    """
+
+    def __init__(self, dumper, queue_size=16, durable=False):
+        """
+        @param dumper: the dumper actually writing the data (CSVFile, NPZFile, ...)
+        @param queue_size: max number of pending dumps, the caller waits when the queue is full
+        @param durable: True to sync the files to disk after each dump, so that a crash loses only the
+        dumps still in the queue
+        """
+        super().__init__()
+        self.dumper = dumper
+        self.durable = durable
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.metrics = instrumentation.metrics("persistence")
+        self.writer_thread = threading.Thread(target=self.__writer, name="dumper-writer", daemon=True)
+        self.writer_thread.start()
+
+    def __writer(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                dump, args, kwargs = job
+                with self.metrics.time(Stage.dump):
+                    dump(*args, **kwargs)
+                    if self.durable:
+                        self.dumper.sync()
+            except Exception as e:
+                log.exception(str(e) + ' ' + log.get_debug_info())
+            finally:
+                self.queue.task_done()
+
+    def __enqueue(self, dump, *args, **kwargs):
+        if not self.writer_thread.is_alive():
+            log.error("The dumper has been closed, data not stored")
+            self.metrics.count("dumps_lost")
+            return
+        if self.queue.full():
+            # the caller is going to wait for the writer
+            self.metrics.count("dump_queue_full")
+        self.queue.put((dump, args, kwargs))
+
+    def dump_subject(self, subject):
+        self.__enqueue(self.dumper.dump_subject, subject)
+
+    def dump_trial(self, *args, **kwargs):
+        self.__enqueue(self.dumper.dump_trial, *args, **kwargs)
+
+    def dump_cube_data(self, cube_data):
+        """
+        Queue the iCube data of a phase. The caller must not modify cube_data afterwards.
+        @param cube_data: the data of the phase
+        """
+        self.__enqueue(self.dumper.dump_cube_data, cube_data)
+
+    def dump_session_clock(self, clock):
+        self.__enqueue(self.dumper.dump_session_clock, clock)
+
+    def flush(self):
+        """
+        Wait until all the queued dumps are written
+        """
+        self.queue.join()
+        self.dumper.sync()
+
+    def sync(self):
+        self.flush()
+
+    def quit(self):
+        """
+        Write the pending dumps and close the wrapped dumper
+        """
+        if self.writer_thread.is_alive():
+            self.queue.put(None)
+            self.writer_thread.join()
+        self.dumper.sync()
+        self.dumper.quit()
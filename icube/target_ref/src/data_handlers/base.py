@@ -8,7 +8,47 @@ class BaseHandler:
     def __init__(self):
         pass
 
-    def handle(self, quaternions, touches, accelerometer):
+    def handle(self, quaternions, touches, accelerometer, timestamp=None):
+        """
+        @param timestamp: time.perf_counter_ns when the sample arrived
+        """
+        pass
+
+    def quit(self):
+        pass
+
+
+class BaseDumper:
+    """
+    @package BaseDumper
+    @brief a base persistence layer for subjects, trials and iCube data
+    """
+
+    def __init__(self):
+        pass
+
+    def dump_subject(self, subject):
+        pass
+
+    def dump_trial(self, subject_id=-1, trial_id=-1, trial_condition=None, t_start=None, t_stop=None,
+                   memo_start=None, memo_stop=None, recall_start=None, recall_stop=None, similarity=None,
+                   answer=''):
+        pass
+
+    def dump_cube_data(self, cube_data):
+        pass
+
+    def dump_session_clock(self, clock):
+        """
+        Store the mapping between the sample timestamps and the wall clock, once per session
+        @param clock: the SessionClock
+        """
+        pass
+
+    def sync(self):
+        """
+        Force the data written so far to disk
+        """
         pass
 
     def quit(self):
@@ -1,20 +1,32 @@
+import collections
+import functools
+import threading
 import time
 
-from icube.target_ref.data_handlers.base import BaseDumper
-from icube.target_ref.data_handlers.CSVgenerator import CSVFile
-from icube.target_ref.data_handlers.constants import *
-from icube.target_ref.data_handlers.model_cube import *
+from icube.target_ref.src.data_handlers.base import BaseDumper
+from icube.target_ref.src.data_handlers.CSVgenerator import CSVFile
+from icube.target_ref.src.data_handlers.constants import *
+from icube.target_ref.src.data_handlers.model_cube import *
+from icube.target_ref.src.data_handlers.sample_store import SampleStore
+from icube.target_ref.src.tactile.common import instrumentation
 from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common.instrumentation import Stage
+from icube.target_ref.src.tactile.common.timer import SessionClock
 
 
 class Datacollector(BaseDumper):
 
-    def __init__(self, persistence=None):
+    def __init__(self, persistence=None, lookback=3.0):
+        """
+        @param persistence: the dumper of the recorded data
+        @param lookback: seconds of samples kept while not recording, so a phase can start at a past timestamp
+        (e.g. the onset of a grasp, detected later)
+        """
         super().__init__()
         self.subjects = {}
         self.trials = {}
         self.tested_cube = None
-        self.cube_data = []
+        self.cube_data = SampleStore()
         self.phase = None
         self.similarity = None
         self.current_subject = None
@@ -29,6 +41,24 @@ class Datacollector(BaseDumper):
         self.recall_stop = None
         # self.next_subject_id = self.persistence.get_next_subject_id()
         self.recording = False
+        self.metrics = instrumentation.metrics("persistence")
+
+        # push_data runs on the threads of the bus subscriptions: the lock guards recording, cube_data, the
+        # time.perf_counter_ns bounds of the phase and the recent samples
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.phase_cubes = {}  # {Phase: the cube recorded in the phase}, all the cubes for the phases missing
+        self.start_ns = None
+        self.stop_ns = None
+        self.flush_timeout = 2.0
+        # the recent samples of each cube, (timestamp, quaternions, touches, accelerometer) oldest first
+        self.lookback_ns = int(lookback * 1e9)
+        self.recent = collections.defaultdict(collections.deque)
+
+        # the phase boundaries are taken on the same clock of the sample timestamps, as wall clock seconds
+        self.clock = SessionClock()
+        if self.persistence is not None:
+            self.persistence.dump_session_clock(self.clock)
 
     def add_subject(self, subject_id=0, age=0, hand=Hand.RIGHT):
 
@@ -52,7 +82,7 @@ class Datacollector(BaseDumper):
     def stop_trial(self, answer=""):
 
         log.info(f"Stop collecting data for trial {self.current_trial.trial_id}")
-        self.t_stop = time.time()
+        self.t_stop = self.clock.now()
         self.persistence.dump_trial(subject_id=self.current_subject.subject_id,
                                     trial_id=self.current_trial.trial_id,
                                     trial_condition=self.current_trial.trial_condition,
@@ -65,70 +95,165 @@ class Datacollector(BaseDumper):
                                     similarity=self.current_trial.similarity,
                                     answer=answer)
 
-        self.persistence.dump_cube_data(self.cube_data)
-        self.cube_data = []
+        self.__dump_cube_data()
+
+    def attach(self, bus, phase_cubes):
+        """
+        Receive the samples published on a SampleBus, on a thread of the bus for each cube. The subscriptions
+        are lossless: the samples recorded are never dropped, and stopping a phase waits for the samples published
+        before the stop.
+        @param bus: the SampleBus
+        @param phase_cubes: {Phase: name of the cube on the bus recorded in the phase}
+        @return: the Subscriptions
+        """
+        self.phase_cubes = dict(phase_cubes)
+        for cube in set(self.phase_cubes.values()):
+            self.subscriptions.append(bus.attach(functools.partial(self.push_data, cube=cube),
+                                                 name="data_collector_" + cube.lower(), cube=cube, lossless=True))
+        return self.subscriptions
+
+    def __dump_cube_data(self):
+        """
+        Hand the samples of the phase to the persistence layer and start a new buffer
+        """
+        with self.lock:
+            cube_data = self.cube_data
+            self.cube_data = SampleStore(subject_id=cube_data.subject_id,
+                                         trial_id=cube_data.trial_id,
+                                         phase=cube_data.phase)
+        self.persistence.dump_cube_data(cube_data)
+
+    def __new_phase_data(self, timestamp):
+        """
+        Start recording the samples from timestamp
+        @param timestamp: time.perf_counter_ns of the start of the phase, None for now
+        """
+        with self.lock:
+            self.cube_data = SampleStore(subject_id=self.current_subject.subject_id,
+                                         trial_id=self.current_trial.trial_id,
+                                         phase=self.phase)
+            self.start_ns = time.perf_counter_ns() if timestamp is None else timestamp
+            self.stop_ns = None
+            # the samples received since the start of the phase, before it was handled
+            cube = self.phase_cubes.get(self.phase)
+            for recent_cube, samples in self.recent.items():
+                if cube is None or recent_cube == cube:
+                    for sample in samples:
+                        if sample[0] >= self.start_ns:
+                            self.cube_data.append(*sample)
+            self.cube_data_id = len(self.cube_data)
+            self.recording = True
 
-    def start_memo(self, trial_id):
+    def __stop_recording(self, timestamp):
+        """
+        Stop recording at timestamp, after the samples published before it have been pushed
+        @param timestamp: time.perf_counter_ns of the end of the phase, None for now
+        @return: the time.perf_counter_ns of the end of the phase
+        """
+        with self.lock:
+            self.stop_ns = stop_ns = time.perf_counter_ns() if timestamp is None else timestamp
+        for subscription in self.subscriptions:
+            if not subscription.flush(self.flush_timeout):
+                log.error(f"The samples of the phase were not all received in {self.flush_timeout} s")
+        with self.lock:
+            self.recording = False
+            # the samples received after the end of the phase, before it was handled
+            self.cube_data.cut(stop=stop_ns)
+            self.cube_data_id = len(self.cube_data)
+        return stop_ns
+
+    def __phase_time(self, timestamp):
+        """
+        @param timestamp: time.perf_counter_ns of the event starting or stopping a phase, None for now
+        @return: the wall clock time in seconds
+        """
+        return self.clock.now() if timestamp is None else self.clock.to_wall(timestamp)
+
+    def start_memo(self, trial_id, timestamp=None):
+        """
+        @param trial_id:
+        @param timestamp: time.perf_counter_ns when the phase started (e.g. the sample of a grasp), None for now
+        """
 
         if self.recording:
             log.error(f"Still running {self.current_trial.trial_id}.")
             return
 
         self.phase = Phase.MEMO
-        self.t_start = time.time()
-        self.memo_start = time.time()
+        self.t_start = self.__phase_time(timestamp)
+        self.memo_start = self.t_start
         self.current_trial = self.trials[trial_id]
         self.cube_data_id = 0
-        self.recording = True
+        self.__new_phase_data(timestamp)
         log.info(f"Start collecting data for Memo phase of {trial_id}")
 
-    def stop_memo(self):
+    def stop_memo(self, timestamp=None):
+        """
+        @param timestamp: time.perf_counter_ns when the phase stopped (e.g. the sample of a pose), None for now
+        """
 
         if not self.recording:
             log.error("No trial right now")
             return
 
         log.info(f"Stop collecting data from Memorization phase of trial {self.current_trial.trial_id}")
-        self.recording = False
-        self.memo_stop = time.time()
-        self.persistence.dump_cube_data(self.cube_data)
-        self.cube_data = []
+        self.memo_stop = self.__phase_time(self.__stop_recording(timestamp))
+        self.__dump_cube_data()
 
-    def start_recall(self, trial_id):
+    def start_recall(self, trial_id, timestamp=None):
+        """
+        @param trial_id:
+        @param timestamp: time.perf_counter_ns when the phase started (e.g. the sample of a grasp), None for now
+        """
 
         if self.recording:
             log.error(f"Still running {self.current_trial.trial_id}.")
             return
 
         self.phase = Phase.RECALL
-        self.recall_start = time.time()
+        self.recall_start = self.__phase_time(timestamp)
         log.info(f"Start collecting data for Recall phase of {trial_id}")
-        self.recording = True
+        self.__new_phase_data(timestamp)
 
-    def stop_recall(self):
+    def stop_recall(self, timestamp=None):
+        """
+        @param timestamp: time.perf_counter_ns when the phase stopped (e.g. the sample of a pose), None for now
+        """
 
         if not self.recording:
             log.error("No trial right now")
             return
 
         log.info(f"Stop collecting data from Recall phase of trial {self.current_trial.trial_id}")
-        self.recording = False
-        self.recall_stop = time.time()
-        self.persistence.dump_cube_data(self.cube_data)
-        self.cube_data = []
+        self.recall_stop = self.__phase_time(self.__stop_recording(timestamp))
+        self.__dump_cube_data()
 
-    def push_data(self, quaternions=[], touches=[], accelerometer=[]):
+    def push_data(self, quaternions=[], touches=[], accelerometer=[], timestamp=None, cube=None):
+        """
+        @param timestamp: time.perf_counter_ns when the sample arrived, now if None
+        @param cube: the cube of the sample, None if the collector receives a single cube
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter_ns()
+        with self.lock:
+            if self.lookback_ns > 0:
+                recent = self.recent[cube]
+                recent.append((timestamp, quaternions, touches, accelerometer))
+                while recent[0][0] < timestamp - self.lookback_ns:
+                    recent.popleft()
 
-        if self.recording:
-            data = CubeData(
-                subject_id=self.current_subject.subject_id,
-                trial_id=self.current_trial.trial_id,
-                phase=self.phase,
-                quaternions=quaternions,
-                touches=touches,
-                accelerometer=accelerometer
-            )
-            self.cube_data.append(data)
+            if not self.recording:
+                if self.stop_ns is not None and self.start_ns <= timestamp <= self.stop_ns:
+                    # in the phase, but published after it was stopped
+                    self.metrics.count("late_samples")
+                    log.warning("A sample of the phase arrived after its end, it was not recorded")
+                return
+            phase_cube = self.phase_cubes.get(self.phase)
+            if timestamp < self.start_ns or (phase_cube is not None and cube != phase_cube):
+                # before the start of the phase, or of the cube of the other phase
+                return
+            with self.metrics.time(Stage.persist):
+                self.cube_data.append(timestamp, quaternions, touches, accelerometer)
             self.cube_data_id += 1
 
     def quit(self):
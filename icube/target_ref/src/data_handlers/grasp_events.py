@@ -0,0 +1,63 @@
+import collections
+import queue
+
+from icube.target_ref.src.data_handlers.icube_movements_classifier import GraspState
+
+
+class GraspEvent(collections.namedtuple("GraspEvent", ["cube", "state", "timestamp"])):
+    """
+    @package GraspEvent
+    @brief a grasp or a pose of a cube
+    cube: the cube, e.g. Icubetype.REFERENCE
+    state: GraspState.GRABBED or GraspState.POSED
+    timestamp: time.perf_counter_ns of the sample where the grasp or the pose started
+    """
+    __slots__ = ()
+
+
+class GraspEventChannel:
+    """
+    @package GraspEventChannel
+    @brief a thread safe channel of the GraspEvent from the detectors, running on the sample threads, to the
+    controller, which reads them on its own thread (e.g. the Qt event loop).
+    The events carry the timestamp of the sample where the grasp started, so the phases start and stop at the
+    instant of the grasp whatever the delay in handling the event.
+    """
+
+    def __init__(self):
+        self.events = queue.SimpleQueue()
+
+    def connect(self, detector, cube):
+        """
+        Publish the grasps and the poses detected by a GraspDetector
+        @param detector: the GraspDetector
+        @param cube: the cube the detector receives the samples of
+        """
+        detector.set_on_grab_callback(lambda timestamp: self.publish(cube, GraspState.GRABBED, timestamp))
+        detector.set_on_pose_callback(lambda timestamp: self.publish(cube, GraspState.POSED, timestamp))
+
+    def publish(self, cube, state, timestamp):
+        self.events.put(GraspEvent(cube, state, timestamp))
+
+    def get(self, timeout=None):
+        """
+        Wait for the next event
+        @param timeout: max seconds to wait, None to wait forever
+        @return: the GraspEvent, None if none arrived before the timeout
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def poll(self):
+        """
+        The events arrived since the last call, without waiting
+        @return: the list of the GraspEvent, oldest first
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
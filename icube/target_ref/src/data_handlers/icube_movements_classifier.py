@@ -1,38 +1,72 @@
 import enum
+import time
 
 from icube.target_ref.src.data_handlers.base import BaseHandler
+from icube.target_ref.src.tactile.common.touch_frame import TouchFrame
 import numpy as np
 
-CUBE_POSED_FACE = "1111111111111111"
+MAX_FACES = 6  # faces of the iCube, the FlexTS uses the first 4
+FULL_FACE = 0xFFFF  # packed face with all the pads touched
 
 
 class GraspState(enum.Enum):
     POSED = 0,
-    GRABBED = 1
+    GRABBED = 1,
 
 
 class GraspDetector(BaseHandler):
     """
     @package GraspDetector
-    @brief a module to detect when the participant grasps the iCube or place it on a flat surface
+    @brief a module to detect when the participant grasps the iCube or place it on a flat surface.
+    The last samples are kept in a preallocated ring (accelerometer and packed touches) and the features are
+    computed on the whole window every few samples:
+    * motion: the RMS distance of the accelerations from the rest acceleration
+    * shake: the RMS distance of the accelerations from their mean, it does not depend on the face the iCube
+    rests on
+    * posed: the fraction of the window in which only one face is touched, fully covered
+    The iCube is grabbed when it moves and it is not posed, it is posed again when it is still (shake below
+    grab_tolerance * release_ratio) and posed. The condition has to last for the debounce time before the state
+    changes, so a single noisy sample does not toggle it.
     @author Dario Pasquali
     """
-    def __init__(self, grab_tolerance=1):
+    def __init__(self, grab_tolerance=1, window=16, hop=8, release_ratio=0.5, posed_ratio=0.8, debounce=0.2):
         """
-        @param grab_tolerance: how much being tolerant on classifying an acceleration as grasping
+        @param grab_tolerance: how much being tolerant on classifying an acceleration as grasping, in m/s^2
+        @param window: number of samples the features are computed on
+        @param hop: the features are computed every hop samples
+        @param release_ratio: the iCube is still when the shake is below grab_tolerance * release_ratio
+        @param posed_ratio: the iCube is posed when the touches of a posed iCube are in this fraction of the window,
+        it is held when they are in less than 1 - posed_ratio
+        @param debounce: how long in seconds the grasp or the pose have to last before the state changes
         """
         super().__init__()
-        self.init_acc = None
-
-        self.icube_state = GraspState.POSED
         self.grab_tolerance = grab_tolerance
+        self.release_tolerance = grab_tolerance * release_ratio
+        self.posed_ratio = posed_ratio
+        self.window = window
+        self.hop = hop
+        self.debounce_ns = int(debounce * 1e9)
+
+        self.accelerations = np.zeros((window, 3))
+        self.touches = np.zeros((window, MAX_FACES), dtype=np.uint16)
         self.on_grab = None
         self.on_pose = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the samples and the rest acceleration, the iCube is considered posed
+        """
+        self.n_samples = 0
+        self.init_acc = None
+        self.icube_state = GraspState.POSED
+        self.candidate_since = None  # timestamp of the first sample of a possible state change
+        self.transition_timestamp = None  # timestamp of the onset of the last state change
 
     def set_on_grab_callback(self, on_grab):
         """
         What to do on grasp
-        @param on_grab:
+        @param on_grab: called with the time.perf_counter_ns of the sample where the grasp started
         @return:
         """
         self.on_grab = on_grab
@@ -40,54 +74,129 @@ class GraspDetector(BaseHandler):
     def set_on_pose_callback(self, on_pose):
         """
         What to do on pose
-        @param on_pose:
+        @param on_pose: called with the time.perf_counter_ns of the sample where the pose started
         @return:
         """
         self.on_pose = on_pose
 
-    def __icube_posed(self, touches):
+    @staticmethod
+    def __packed_faces(touches):
         """
-        Classify if the iCube is posed based on touches
-        If only one face is fully active the cube is posed somewhere
-        Otherwise the cube is held
-        @param touches: a set of touches form the iCube
-        @return: True if touched
+        @param touches: the TouchFrame of the iCube, (faces, TouchFrame) for the iCube V4, the face strings or None
+        @return: the packed faces, None if there are no touches
         """
+        if isinstance(touches, tuple):
+            touches = touches[1] if len(touches) > 1 else None
+        if touches is None or len(touches) == 0:
+            return None
+        if not isinstance(touches, TouchFrame):
+            touches = TouchFrame.from_strings(touches)
+        return touches.faces[:MAX_FACES]
 
-        if touches is None:
-            return False
-        full_covered_faces = touches.count(CUBE_POSED_FACE)
-        touched_faces = ["1" in t for t in touches].count(True)
-        return full_covered_faces == 1 and touched_faces == 1
-
-    def __icube_moved(self, accelerometer):
+    def features(self):
         """
-        Check if the cube is moving computing the euclidian distance of the accelerations with respect to when the iCube started
-        @param accelerometer: set of accelerations
-        @return:
+        The features of the samples in the window
+        @return: motion and shake (m/s^2), fraction of the window in which the iCube is posed
         """
-        return np.linalg.norm(accelerometer - self.init_acc) > self.grab_tolerance
+        mean = np.add.reduce(self.accelerations, axis=0) / self.window
+        if self.init_acc is None:
+            self.init_acc = mean
+        centered = self.accelerations - mean
+        shake2 = np.einsum('ij,ij->', centered, centered) / self.window
+        offset = mean - self.init_acc
+        # mean squared distance from the rest acceleration = variance + squared distance of the mean
+        motion = np.sqrt(shake2 + offset.dot(offset))
+
+        # posed: a single face touched, fully covered
+        touches = self.touches
+        posed = (np.add.reduce(touches != 0, axis=1) == 1) & (np.maximum.reduce(touches, axis=1) == FULL_FACE)
+        return motion, np.sqrt(shake2), np.count_nonzero(posed) / self.window
 
-    def handle(self, quaternions, touches, accelerometer):
+    def handle(self, quaternions, touches, accelerometer, timestamp=None):
         """
         Classifies participants' behavior
         @param quaternions:
         @param touches:
         @param accelerometer:
-        @return:
+        @param timestamp: time.perf_counter_ns when the sample arrived, now if None
+        @return: True if the state changed
         """
-        if accelerometer is None or accelerometer == []:
+        if accelerometer is None or len(accelerometer) == 0:
+            return False
+
+        i = self.n_samples % self.window
+        self.accelerations[i] = accelerometer
+        faces = self.__packed_faces(touches)
+        if faces is None:
+            self.touches[i] = 0
+        else:
+            self.touches[i, :len(faces)] = faces
+            self.touches[i, len(faces):] = 0
+        self.n_samples += 1
+
+        if self.n_samples < self.window or self.n_samples % self.hop != 0:
+            return False
+        return self.__update(timestamp if timestamp is not None else time.perf_counter_ns())
+
+    def handle_batch(self, accelerometer, touches, timestamps):
+        """
+        Classifies a batch of samples, e.g. the columns of a SampleStore
+        @param accelerometer: (N, 3) accelerations, the samples with NaN are skipped
+        @param touches: (N, faces) packed touches
+        @param timestamps: N time.perf_counter_ns of the samples
+        @return: True if the state changed
+        """
+        accelerometer = np.asarray(accelerometer, dtype=np.float64)
+        touches = np.asarray(touches, dtype=np.uint16)[:, :MAX_FACES]
+        timestamps = np.asarray(timestamps)
+        valid = ~np.isnan(accelerometer).any(axis=1)
+        accelerometer, touches, timestamps = accelerometer[valid], touches[valid], timestamps[valid]
+
+        changed = False
+        start = 0
+        while start < len(accelerometer):
+            # up to the next evaluation of the features
+            stop = min(len(accelerometer), start + self.hop - self.n_samples % self.hop)
+            rows = (self.n_samples + np.arange(stop - start)) % self.window
+            self.accelerations[rows] = accelerometer[start:stop]
+            self.touches[rows] = 0
+            self.touches[rows, :touches.shape[1]] = touches[start:stop]
+            self.n_samples += stop - start
+            if self.n_samples >= self.window and self.n_samples % self.hop == 0:
+                changed |= self.__update(int(timestamps[stop - 1]))
+            start = stop
+        return changed
+
+    def __update(self, timestamp):
+        """
+        Updates the state from the features of the window
+        @param timestamp: timestamp of the last sample
+        @return: True if the state changed
+        """
+        motion, shake, posed = self.features()
+        if self.icube_state == GraspState.POSED:
+            candidate = motion > self.grab_tolerance and posed <= 1 - self.posed_ratio
+        else:
+            candidate = shake < self.release_tolerance and posed >= self.posed_ratio
+
+        if not candidate:
+            self.candidate_since = None
+            return False
+        if self.candidate_since is None:
+            self.candidate_since = timestamp
+        if timestamp - self.candidate_since < self.debounce_ns:
             return False
-        np_acc = np.array(accelerometer)
-        if self.init_acc is None:
-            self.init_acc = np_acc
 
+        self.transition_timestamp = self.candidate_since
+        self.candidate_since = None
         if self.icube_state == GraspState.POSED:
-            if self.__icube_moved(accelerometer) and not self.__icube_posed(touches):
-                self.icube_state = GraspState.GRABBED
-                self.on_grab()
-
-        if self.icube_state == GraspState.GRABBED:
-            if self.__icube_posed(touches):
-                self.icube_state = GraspState.POSED
-                self.on_pose()
+            self.icube_state = GraspState.GRABBED
+            if self.on_grab is not None:
+                self.on_grab(self.transition_timestamp)
+        else:
+            self.icube_state = GraspState.POSED
+            # rest acceleration of the new pose
+            self.init_acc = self.accelerations.mean(axis=0)
+            if self.on_pose is not None:
+                self.on_pose(self.transition_timestamp)
+        return True
@@ -1,5 +1,5 @@
 import string
-from icube.target_ref.data_handlers.constants import Hand
+from icube.target_ref.src.data_handlers.constants import Hand
 
 
 class Subject:
@@ -31,7 +31,7 @@ class Trial:
 
 class CubeData:
     def __init__(self, subject_id=None, trial_id=None, phase=None,
-                 quaternions=[], touches=[], accelerometer=[]):
+                 quaternions=[], touches=[], accelerometer=[], timestamp=None):
 
         self.subject_id = subject_id
         self.trial_id = trial_id
@@ -39,6 +39,7 @@ class CubeData:
         self.quaternions = quaternions
         self.touches = touches
         self.accelerometer = accelerometer
+        self.timestamp = timestamp  # time.perf_counter_ns when the sample arrived
 
     def get_csv(self, sep=";"):
         return sep.join([
@@ -47,7 +48,8 @@ class CubeData:
             str(self.phase),
             str(self.quaternions),
             str(self.touches),
-            str(self.accelerometer)
+            str(self.accelerometer),
+            str(self.timestamp)
         ])
 
 
@@ -0,0 +1,199 @@
+import numpy as np
+
+from icube.target_ref.src.data_handlers.model_cube import CubeData
+from icube.target_ref.src.tactile.common import orientation
+from icube.target_ref.src.tactile.common.touch_frame import TouchFrame, N_PADS
+
+N_FACES = 6  # faces of the iCube, the FlexTS uses the first 4
+
+HAS_QUATERNIONS = 1
+HAS_TOUCHES = 2
+HAS_ACCELEROMETER = 4
+
+
+def pack_face(face):
+    """
+    Pack a face touch string ("1" where the pad is touched, pad 0 first) into an integer, pad i on bit i
+    @param face: the face string
+    @return: the packed face
+    """
+    return int(face[::-1], 2) if face else 0
+
+
+def unpack_face(value, n_pads=N_PADS):
+    """
+    Inverse of pack_face
+    @param value: the packed face
+    @param n_pads: number of pads of the face
+    @return: the face string
+    """
+    return format(int(value), f"0{n_pads}b")[::-1]
+
+
+class SampleStore:
+    """
+    @package SampleStore
+    @brief a columnar buffer of the iCube samples of a phase.
+    Each column is a NumPy array with a fixed dtype, allocated in advance and grown geometrically,
+    so appending a sample does not create Python objects.
+    * timestamps: int64, time.perf_counter_ns when the sample arrived
+    * quaternions: 4 x float32 (NaN when missing)
+    * accelerometer: 3 x float32 (NaN when missing)
+    * touches: 6 x uint16, one bit for each pad (96 bits)
+    * flags: uint8, which of the values above were received
+    """
+
+    def __init__(self, capacity=1024, subject_id=None, trial_id=None, phase=None):
+        self.subject_id = subject_id
+        self.trial_id = trial_id
+        self.phase = phase
+        self.size = 0
+        self.n_faces = 0  # number of faces actually reported by the device
+
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.quaternions = np.empty((capacity, 4), dtype=np.float32)
+        self.accelerometer = np.empty((capacity, 3), dtype=np.float32)
+        self.touches = np.empty((capacity, N_FACES), dtype=np.uint16)
+        self.flags = np.empty(capacity, dtype=np.uint8)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.timestamps)
+
+    def __grow(self):
+        capacity = 2 * self.capacity
+        for name in ('timestamps', 'quaternions', 'accelerometer', 'touches', 'flags'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, timestamp, quaternions=None, touches=None, accelerometer=None):
+        """
+        Append a sample
+        @param timestamp: time.perf_counter_ns when the sample was received
+        @param quaternions: [w, x, y, z], empty if missing
+        @param touches: TouchFrame, (faces, TouchFrame) for the iCube V4, None if missing.
+        A list of face strings is accepted as well
+        @param accelerometer: [x, y, z], empty if missing
+        @return:
+        """
+        if self.size == self.capacity:
+            self.__grow()
+
+        i = self.size
+        flags = 0
+        self.timestamps[i] = timestamp
+
+        if quaternions is not None and len(quaternions) == 4:
+            self.quaternions[i] = quaternions
+            flags |= HAS_QUATERNIONS
+        else:
+            self.quaternions[i] = np.nan
+
+        if accelerometer is not None and len(accelerometer) == 3:
+            self.accelerometer[i] = accelerometer
+            flags |= HAS_ACCELEROMETER
+        else:
+            self.accelerometer[i] = np.nan
+
+        if isinstance(touches, tuple):
+            touches = touches[1] if len(touches) > 1 else None
+        if touches:
+            if isinstance(touches, TouchFrame):
+                faces = touches.faces[:N_FACES]
+                self.touches[i, :len(faces)] = faces
+            else:
+                faces = touches[:N_FACES]
+                for f, face in enumerate(faces):
+                    self.touches[i, f] = pack_face(face)
+            self.touches[i, len(faces):] = 0
+            self.n_faces = max(self.n_faces, len(faces))
+            flags |= HAS_TOUCHES
+        else:
+            self.touches[i] = 0
+
+        self.flags[i] = flags
+        self.size += 1
+
+    def cut(self, start=None, stop=None):
+        """
+        Keep only the samples with start <= timestamp <= stop, in place
+        @param start: time.perf_counter_ns of the first sample to keep, None for no lower bound
+        @param stop: time.perf_counter_ns of the last sample to keep, None for no upper bound
+        @return: the number of samples removed
+        """
+        n = self.size
+        keep = np.ones(n, dtype=bool)
+        if start is not None:
+            keep &= self.timestamps[:n] >= start
+        if stop is not None:
+            keep &= self.timestamps[:n] <= stop
+        kept = int(np.count_nonzero(keep))
+        if kept < n:
+            for name in ('timestamps', 'quaternions', 'accelerometer', 'touches', 'flags'):
+                column = getattr(self, name)
+                column[:kept] = column[:n][keep]
+            self.size = kept
+        return n - kept
+
+    def columns(self):
+        """
+        The stored samples, column by column. The arrays are views on the store, without copies.
+        @return: dictionary {column name: array}
+        """
+        n = self.size
+        return {
+            'timestamps': self.timestamps[:n],
+            'quaternions': self.quaternions[:n],
+            'accelerometer': self.accelerometer[:n],
+            'touches': self.touches[:n],
+            'flags': self.flags[:n],
+        }
+
+    def rotation_matrices(self):
+        """
+        The orientation of the device for all the stored samples, computed at once from the quaternions
+        @return: (N, 3, 3) rotation matrices, NaN where the quaternions are missing
+        """
+        return orientation.rotation_matrices(self.quaternions[:self.size])
+
+    def euler_angles(self, degrees=False):
+        """
+        @param degrees: True for degrees, radians otherwise
+        @return: (N, 3) [roll, pitch, yaw] of the stored samples, see orientation.euler_angles
+        """
+        return orientation.euler_angles(self.quaternions[:self.size], degrees=degrees)
+
+    def angular_velocity(self):
+        """
+        @return: (N, 3) angular velocity in rad/s between each sample and the previous one, see
+        orientation.angular_velocity
+        """
+        return orientation.angular_velocity(self.quaternions[:self.size], self.timestamps[:self.size])
+
+    def iter_cube_data(self):
+        """
+        Rebuild the samples as CubeData, for the row based persistence layers
+        @return: an iterator over the CubeData
+        """
+        n = self.size
+        quaternions = np.round(self.quaternions[:n].astype(np.float64), 6).tolist()
+        accelerometer = np.round(self.accelerometer[:n].astype(np.float64), 6).tolist()
+        touches = self.touches[:n, :self.n_faces]
+        flags = self.flags[:n].tolist()
+        timestamps = self.timestamps[:n].tolist()
+
+        for i in range(n):
+            yield CubeData(
+                subject_id=self.subject_id,
+                trial_id=self.trial_id,
+                phase=self.phase,
+                quaternions=quaternions[i] if flags[i] & HAS_QUATERNIONS else [],
+                touches=TouchFrame(touches[i]) if flags[i] & HAS_TOUCHES else None,
+                accelerometer=accelerometer[i] if flags[i] & HAS_ACCELEROMETER else [],
+                timestamp=timestamps[i]
+            )
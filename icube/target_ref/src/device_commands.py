@@ -4,6 +4,8 @@
 """
 import enum
 
+from icube.target_ref.src.tactile.communication.frame_decoder import FrameDecoder, FrameSpec, ReplyDemultiplexer
+
 
 class ICubeVersion(enum.Enum):
     V3 = {'version': 3, 'ping_reply': 0x81, 'get_fwm_version': 0x13, 'reply_get_fw': 3, 'reply_mpx': 14, 'reply_mpx_single': 3}
@@ -18,6 +20,12 @@ class ICubeVersion(enum.Enum):
         return self.value[item]
 
 
+class ReplyType(enum.Enum):
+    QUATERNIONS = 0,
+    TOUCHES = 1,
+    ACCELEROMETER = 2
+
+
 class MsgLength:
     def __init__(self, version):
         self.reply_ping = 3
@@ -70,6 +78,32 @@ class DeviceCommands:
         self.stop_reply = 0xfa
         self.ping_reply = version['ping_reply']  # 0x31(v3) / 0x81(v4) TODO fix in the documentation
         self.battery_reply = 0x2e
+        self.quat_reply = 0x57  # 'W', the quaternion reply is not framed: W<w>X<x>Y<y>Z<z>
+        self.axis_x = 0x58  # 'X'
+        self.axis_y = 0x59  # 'Y'
+        self.axis_z = 0x5a  # 'Z'
         self.firmware_reply = version['reply_get_fw']
 
         self.msg_length = MsgLength(version)
+
+    def frame_decoder(self, length=None):
+        """
+        @brief It creates a decoder for the replies framed by start_reply and stop_reply
+        @param length the length of the reply, start and stop bytes included. None for variable length replies
+        @return the FrameDecoder
+        """
+        return FrameDecoder(self.start_reply, self.stop_reply, length)
+
+    def reply_demultiplexer(self):
+        """
+        @brief It creates a decoder that splits the quaternion, touch and accelerometer replies when they are
+        requested back to back.
+        @return the ReplyDemultiplexer, yielding (ReplyType, frame) tuples
+        """
+        return ReplyDemultiplexer([
+            FrameSpec(ReplyType.QUATERNIONS, self.quat_reply, self.msg_length.reply_bno,
+                      markers={8: self.axis_x, 16: self.axis_y, 24: self.axis_z}),
+            FrameSpec(ReplyType.ACCELEROMETER, self.start_reply, self.msg_length.reply_accel, self.stop_reply,
+                      markers={1: self.axis_x}),
+            FrameSpec(ReplyType.TOUCHES, self.start_reply, self.msg_length.reply_mpx, self.stop_reply),
+        ])
@@ -0,0 +1,487 @@
+"""
+@file device_simulator
+@brief A simulated iCube V3 / V4 or FlexTS on the other end of a serial port, to run and benchmark the whole
+device stack (SerialComm, framing, parsing) without the hardware.
+The simulator answers the requests of DeviceCommands as the firmware does, with configurable faults of the link:
+reply latency and jitter, replies split in several chunks, corrupted bytes and lost replies.
+It is connected to the host either in process (open_serial, a stand-in of serial.Serial) or through a pseudo
+terminal (open_pty, POSIX only).
+"""
+
+import heapq
+import random
+import threading
+import time
+
+import serial
+
+from icube.target_ref.src.device_commands import DeviceCommands, ICubeVersion
+from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.communication.pty_serial import PtySerialPair
+
+# the bytes of a request: start, [group or peripheral, device id], command, argument, [padding], stop
+REQUEST_LENGTH = {ICubeVersion.V3: 4, ICubeVersion.V4: 6, ICubeVersion.FlexTS: 8}
+COMMAND_POSITION = {ICubeVersion.V3: 1, ICubeVersion.V4: 3, ICubeVersion.FlexTS: 3}
+N_FACETS = {ICubeVersion.V3: 6, ICubeVersion.V4: 6, ICubeVersion.FlexTS: 4}
+# (low byte, high byte) of each facet in the touch reply, as ICubeV3.touch_face_bytes and
+# FlexTSDevice.touch_face_bytes
+TOUCH_FACE_BYTES = {ICubeVersion.V3: [(11, 10), (3, 2), (5, 4), (9, 8), (1, 0), (7, 6)],
+                    ICubeVersion.FlexTS: [(3, 2), (5, 4), (1, 0), (7, 6)]}
+N_PADS = 16
+PAD_TOUCHED = 100  # value of a touched pad in the V4 facet frames, it must not be a start or stop byte
+
+
+def _fixed_width(value, width):
+    """
+    It formats a number in exactly width characters, as the firmware does for the quaternions
+    """
+    decimals = width - 2 if value >= 0 else width - 3
+    return f"{value:.{max(decimals, 0)}f}"[:width]
+
+
+class DeviceSimulator:
+    """
+    @class DeviceSimulator
+    The firmware of a device: it decodes the requests written by the host and sends back the replies.
+    The replies are delivered by a thread, in order, after latency + a random jitter; each reply can be split in
+    chunks, corrupted (one bit flipped) or lost, with the given probabilities.
+    The sensors values are constant until they are changed with set_state(), the V4 actuator commands are
+    stored in actuator_log.
+    """
+
+    def __init__(self, version=ICubeVersion.V3, latency=0.002, jitter=0.0, split_probability=0.0, split_gap=0.001,
+                 corruption_probability=0.0, drop_probability=0.0, boot_time=0.0, seed=None):
+        """
+        @param version the ICubeVersion of the simulated device
+        @param latency the time in seconds between a request and its reply
+        @param jitter the max random time in seconds added to the latency
+        @param split_probability probability of a reply to be sent in two or three chunks
+        @param split_gap the time in seconds between the chunks of a split reply
+        @param corruption_probability probability of a reply to have a bit flipped
+        @param drop_probability probability of a reply to be lost
+        @param boot_time the requests received in the first boot_time seconds after start() are ignored
+        @param seed the seed of the random faults, to reproduce a run. The replies to the host and the pushed
+        frames draw from two generators, seeded from it
+        """
+        self.version = version
+        self.cmd = DeviceCommands(version)
+        self.latency = latency
+        self.jitter = jitter
+        self.split_probability = split_probability
+        self.split_gap = split_gap
+        self.corruption_probability = corruption_probability
+        self.drop_probability = drop_probability
+        self.boot_time = boot_time
+        # the replies are sent from the thread writing the requests and from the push thread, each one has its own
+        # generator so a run is reproducible and the generators are not shared among threads
+        self.random = random.Random(seed)
+        self.push_random = random.Random(None if seed is None else f"{seed}:push")
+
+        self.request_length = REQUEST_LENGTH[version]
+        self.command_position = COMMAND_POSITION[version]
+        self.n_facets = N_FACETS[version]
+
+        # state of the device
+        self.state_lock = threading.Lock()
+        self.quaternion = [1.0, 0.0, 0.0, 0.0]
+        self.acceleration = [0.0, 0.0, 9.81]
+        self.touches = [0] * self.n_facets  # the pads of each facet, packed as in TouchFrame
+        self.registered_touches = list(self.touches)  # V4: the touches registered by the last register_facets
+        self.battery = 3.7
+        self.firmware = self.cmd.firmware_reply
+        self.calibration = (3, 3, 3, 3)  # sys, gyro, accel, mag
+        self.actuator_log = []  # V4: (time.perf_counter_ns, command, value) of each actuator command
+
+        self.counters = dict.fromkeys(("requests", "replies", "unknown", "dropped", "corrupted", "split"), 0)
+        self.counters_lock = threading.Lock()
+
+        # link to the host
+        self.output = None  # function writing bytes to the host, set by the transport
+        self.incoming = bytearray()
+        self.incoming_lock = threading.Lock()
+        self.deliveries = []  # heap of (due time, sequence, chunk)
+        self.delivery_condition = threading.Condition()
+        self.delivery_sequence = 0
+        self.last_due = 0.0
+        self.delivery_thread = None
+        self.running = False
+        self.t_boot = 0.0
+
+        self.push_thread = None
+        self.pushing = False
+        self.pty_pair = None
+        self.pty_thread = None
+
+    def start(self):
+        """
+        @fn start
+        @brief It starts the thread delivering the replies, the device boots from now
+        """
+        if self.running:
+            return
+        self.running = True
+        self.t_boot = time.monotonic() + self.boot_time
+        self.delivery_thread = threading.Thread(target=self.__deliver, name="simulator-delivery", daemon=True)
+        self.delivery_thread.start()
+
+    def stop(self):
+        """
+        @fn stop
+        @brief It stops the threads of the simulator and closes the pseudo terminal, if any. The pending replies
+        are lost.
+        """
+        self.stop_pushing()
+        with self.delivery_condition:
+            self.running = False
+            self.deliveries.clear()
+            self.delivery_condition.notify_all()
+        for thread in (self.delivery_thread, self.pty_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        self.delivery_thread = None
+        self.pty_thread = None
+        if self.pty_pair is not None:
+            self.pty_pair.close()
+            self.pty_pair = None
+
+    def open_serial(self, port="simulator", timeout=0.1):
+        """
+        @fn open_serial
+        @brief It connects the simulator to an in process stand-in of serial.Serial and starts it
+        @param port the name of the port
+        @param timeout the read timeout of the port
+        @return the SimulatedSerial to give to SerialComm.attach_serial (or ICubeInterface.attach)
+        """
+        ser = SimulatedSerial(self, port=port, timeout=timeout)
+        self.start()
+        return ser
+
+    def open_pty(self):
+        """
+        @fn open_pty
+        @brief It connects the simulator to the device end of a pseudo terminal pair and starts it
+        @return the PtySerialPair, its open_host() gives the serial.Serial of the host
+        """
+        self.pty_pair = PtySerialPair()
+        self.output = self.pty_pair.device_write
+        self.start()
+        self.pty_thread = threading.Thread(target=self.__read_pty, name="simulator-pty", daemon=True)
+        self.pty_thread.start()
+        return self.pty_pair
+
+    def __read_pty(self):
+        while self.running:
+            try:
+                data = self.pty_pair.device_read(timeout=0.05)
+            except OSError:
+                return
+            if data:
+                self.receive(data)
+
+    def set_state(self, quaternion=None, acceleration=None, touches=None):
+        """
+        @fn set_state
+        @brief It changes the values of the sensors
+        @param quaternion w, x, y, z
+        @param acceleration x, y, z
+        @param touches the pads of each facet, packed as in TouchFrame (pad i on bit i)
+        """
+        with self.state_lock:
+            if quaternion is not None:
+                self.quaternion = list(quaternion)
+            if acceleration is not None:
+                self.acceleration = list(acceleration)
+            if touches is not None:
+                self.touches = [int(face) for face in touches]
+
+    def receive(self, data):
+        """
+        @fn receive
+        @brief It is called by the transport with the bytes written by the host
+        @param data the bytes
+        """
+        with self.incoming_lock:
+            self.incoming += data
+            requests = self.__split_requests()
+
+        if time.monotonic() < self.t_boot:
+            return
+        for request in requests:
+            self.count("requests")
+            reply = self.reply_to(request[self.command_position], request[self.command_position + 1])
+            if reply:
+                self.send(reply)
+
+    def __split_requests(self):
+        requests = []
+        incoming = self.incoming
+        while True:
+            start = incoming.find(self.cmd.start)
+            if start < 0:
+                incoming.clear()
+                return requests
+            del incoming[:start]
+            if len(incoming) < self.request_length:
+                return requests
+            if incoming[self.request_length - 1] != self.cmd.stop:
+                # not the beginning of a request, resync on the next start byte
+                del incoming[:1]
+                continue
+            requests.append(bytes(incoming[:self.request_length]))
+            del incoming[:self.request_length]
+
+    def reply_to(self, command, argument):
+        """
+        @fn reply_to
+        @brief The firmware: the reply to a request
+        @param command the command byte of the request
+        @param argument the argument byte of the request
+        @return the bytes of the reply, None if the command has no reply
+        """
+        cmd = self.cmd
+        if command == cmd.ping:
+            return self.ping_reply()
+        if command == cmd.battery:
+            return self.framed(f"{self.battery:.1f}".encode())
+        if command == cmd.get_fwm_version:
+            return self.framed(str(self.firmware).encode())
+        if command == cmd.read_bno:
+            if argument == cmd.quat:
+                return self.quaternion_reply()
+            if argument == cmd.accel:
+                return self.accelerometer_reply()
+            return self.calibration_reply()
+        if command == cmd.touch_mpx:
+            if self.version != ICubeVersion.V4:
+                return self.touch_reply()
+            if argument == cmd.register_facets:
+                with self.state_lock:
+                    self.registered_touches = list(self.touches)
+                return None
+            if argument == cmd.send_facets:
+                return b''.join(self.facet_frame(face) for face in self.registered_touches)
+            with self.state_lock:
+                touches = self.touches
+            return self.facet_frame(touches[min(max(argument - 1, 0), self.n_facets - 1)])
+        if self.version == ICubeVersion.V4 and command in (cmd.activate_vibro, cmd.duty_vibro, cmd.time_vibro,
+                                                          cmd.play_audio, cmd.volume):
+            self.actuator_log.append((time.perf_counter_ns(), command, argument))
+            return None
+        if self.version == ICubeVersion.FlexTS and command == cmd.shutdown:
+            return None
+
+        self.count("unknown")
+        log.debug("Simulator: unknown command %#x", command)
+        return None
+
+    def count(self, counter):
+        with self.counters_lock:
+            self.counters[counter] += 1
+
+    def framed(self, payload):
+        return bytes([self.cmd.start_reply]) + bytes(payload) + bytes([self.cmd.stop_reply])
+
+    def ping_reply(self):
+        if self.version == ICubeVersion.FlexTS:
+            # the FlexTS answers with the ASCII of its id
+            return self.framed(str(self.cmd.device_id).encode())
+        return self.framed([self.cmd.ping_reply])
+
+    def quaternion_reply(self):
+        """
+        @return W<w>X<x>Y<y>Z<z>, each value in 7 characters, not framed
+        """
+        with self.state_lock:
+            quaternion = self.quaternion
+        return b''.join(marker.encode() + _fixed_width(value, 7).encode() for marker, value in zip("WXYZ", quaternion))
+
+    def accelerometer_reply(self):
+        """
+        @return | start | X<x>Y<y>Z<z> | acc_end_digit padding | stop |, reply_accel bytes
+        """
+        with self.state_lock:
+            acceleration = self.acceleration
+        payload = b''.join(marker.encode() + f"{value:.2f}".encode() for marker, value in zip("XYZ", acceleration))
+        payload = payload.ljust(self.cmd.msg_length.reply_accel - 2, b'\x00')
+        return self.framed(payload)
+
+    def calibration_reply(self):
+        sys, gyro, accel, mag = self.calibration
+        return f"Sys: {sys} Gyro: {gyro} Accel: {accel} Mag: {mag}".encode()
+
+    def touch_reply(self):
+        """
+        @return | start | two bytes for each facet | stop |, reply_mpx bytes
+        """
+        payload = bytearray(self.cmd.msg_length.reply_mpx - 2)
+        with self.state_lock:
+            touches = self.touches
+        for face, (low, high) in zip(touches, TOUCH_FACE_BYTES[self.version]):
+            payload[low] = face & 0xFF
+            payload[high] = face >> 8
+        return self.framed(payload)
+
+    def facet_frame(self, face):
+        """
+        @return the V4 frame of a facet: | start | one byte for each pad | stop |
+        """
+        return self.framed(bytes(PAD_TOUCHED if face >> pad & 1 else 0 for pad in range(N_PADS)))
+
+    def send(self, reply, randomizer=None):
+        """
+        @fn send
+        @brief It queues a reply for the host, applying the faults of the link
+        @param reply the bytes of the reply
+        @param randomizer the random.Random of the faults, the one of the replies to the host if None
+        """
+        randomizer = randomizer or self.random
+        if randomizer.random() < self.drop_probability:
+            self.count("dropped")
+            return
+        reply = bytearray(reply)
+        if randomizer.random() < self.corruption_probability:
+            reply[randomizer.randrange(len(reply))] ^= 1 << randomizer.randrange(8)
+            self.count("corrupted")
+
+        chunks = [bytes(reply)]
+        if len(reply) > 1 and randomizer.random() < self.split_probability:
+            cuts = sorted(randomizer.sample(range(1, len(reply)), min(randomizer.randint(1, 2), len(reply) - 1)))
+            chunks = [bytes(reply[begin:end]) for begin, end in zip([0] + cuts, cuts + [len(reply)])]
+            self.count("split")
+        self.count("replies")
+
+        with self.delivery_condition:
+            # the link is FIFO: a reply never overtakes the previous one
+            due = max(time.monotonic() + self.latency + randomizer.uniform(0, self.jitter), self.last_due)
+            for chunk in chunks:
+                heapq.heappush(self.deliveries, (due, self.delivery_sequence, chunk))
+                self.delivery_sequence += 1
+                due += self.split_gap
+            self.last_due = due - self.split_gap
+            self.delivery_condition.notify()
+
+    def __deliver(self):
+        while True:
+            with self.delivery_condition:
+                while self.running and (not self.deliveries or self.deliveries[0][0] > time.monotonic()):
+                    wait = self.deliveries[0][0] - time.monotonic() if self.deliveries else None
+                    self.delivery_condition.wait(wait)
+                if not self.running:
+                    return
+                _, _, chunk = heapq.heappop(self.deliveries)
+            try:
+                if self.output is not None:
+                    self.output(chunk)
+            except Exception as e:
+                log.exception(str(e) + ' ' + log.get_debug_info())
+
+    def start_pushing(self, period=0.01):
+        """
+        @fn start_pushing
+        @brief The device streams a sample (quaternions, touches, accelerometer) every period, as in the PUSH
+        streaming mode. The faults of the link apply to each frame.
+        @param period seconds between two samples
+        """
+        self.pushing = True
+        self.push_thread = threading.Thread(target=self.__push, args=(period,), name="simulator-push", daemon=True)
+        self.push_thread.start()
+
+    def stop_pushing(self):
+        self.pushing = False
+        if self.push_thread is not None and self.push_thread is not threading.current_thread():
+            self.push_thread.join()
+        self.push_thread = None
+
+    def sample_replies(self):
+        """
+        @return the replies of a whole sample: quaternions, touches and accelerometer
+        """
+        if self.version == ICubeVersion.V4:
+            with self.state_lock:
+                touches = b''.join(self.facet_frame(face) for face in self.touches)
+        else:
+            touches = self.touch_reply()
+        return [self.quaternion_reply(), touches, self.accelerometer_reply()]
+
+    def __push(self, period):
+        next_time = time.monotonic()
+        while self.pushing and self.running:
+            for reply in self.sample_replies():
+                self.send(reply, self.push_random)
+            next_time += period
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+
+class SimulatedSerial:
+    """
+    @class SimulatedSerial
+    An in process stand-in of serial.Serial connected to a DeviceSimulator: what is written is received by the
+    simulator, its replies are read back with the same blocking semantic of a port with a read timeout.
+    """
+
+    def __init__(self, simulator, port="simulator", timeout=0.1):
+        self.simulator = simulator
+        self.port = port
+        self.name = port
+        self.baudrate = 250000
+        self.timeout = timeout
+        self.is_open = True
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        simulator.output = self.__device_write
+
+    def __device_write(self, data):
+        with self.condition:
+            self.buffer += data
+            self.condition.notify_all()
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            return len(self.buffer)
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self.condition:
+            self.is_open = False
+            self.condition.notify_all()
+
+    def read(self, size=1):
+        """
+        It waits until size bytes are received or the timeout expires
+        @return the bytes received, at most size
+        """
+        with self.condition:
+            t_end = None if self.timeout is None else time.monotonic() + self.timeout
+            while self.is_open and len(self.buffer) < size:
+                remaining = None if t_end is None else t_end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if not self.is_open:
+                raise serial.SerialException("Attempting to use a port that is not open")
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a port that is not open")
+        data = bytes(data)
+        self.simulator.receive(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self.buffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
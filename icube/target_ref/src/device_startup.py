@@ -0,0 +1,106 @@
+import concurrent.futures
+import time
+
+from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.tactile_device import DeviceStatus
+
+CHECKS_TIME = 5  # seconds left after the ping for opening the port and the battery and firmware checks
+
+
+class StartupResult:
+    """
+    @class StartupResult
+    The outcome of the start up of one device
+    """
+
+    def __init__(self, name, interface, status=DeviceStatus.NOT_STARTED, elapsed=0.0):
+        self.name = name
+        self.interface = interface
+        self.status = status
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.status == DeviceStatus.READY
+
+    def __repr__(self):
+        return f"{self.name}: {self.status.name} in {self.elapsed:.2f} s"
+
+
+def start_devices(devices, deadline=15, ping_timeout=None):
+    """
+    @fn start_devices
+    @brief It starts up all the devices in parallel, each one in its own thread: open the port, ping, battery and
+    firmware checks. The whole start up takes as long as the slowest device.
+    The scan of the ports (empty serial port) is not safe when done while other devices open their ports: if a
+    device has no serial port, all the devices are started one after the other in a single thread, the ones with
+    a port first. The devices sharing the same port are not started and are reported as FAILED.
+    @param devices list of (interface, name, serial port), the interfaces are ICubeInterface or FlexTSInterface
+    @param deadline max time for the whole start up, the devices not ready by then are reported as TIMEOUT
+    @param ping_timeout max time waiting for each device to answer the ping, shorter than the deadline so a
+    device which does not answer is reported as NOT_CONNECTED and its thread ends. None for deadline - CHECKS_TIME,
+    divided among the devices when they are started one after the other
+    @return dictionary {name: StartupResult}, in the same order of devices
+    """
+    results = {name: StartupResult(name, interface) for interface, name, _ in devices}
+    if not devices:
+        return results
+
+    ports = [serial_port for _, _, serial_port in devices if serial_port]
+    duplicated = {serial_port for serial_port in ports if ports.count(serial_port) > 1}
+    for interface, name, serial_port in devices:
+        if serial_port in duplicated:
+            log.error("The %s cannot start, the port %s is given to several devices", name, serial_port)
+            results[name].status = DeviceStatus.FAILED
+    devices = [device for device in devices if device[2] not in duplicated]
+    if not devices:
+        return results
+
+    if len(ports) < len(devices):
+        # a device scans the ports, nobody else may open a port at the same time
+        devices = sorted(devices, key=lambda device: not device[2])
+        batches = [devices]
+        log.info("Some devices have no serial port, they are started one after the other")
+    else:
+        batches = [[device] for device in devices]
+
+    if ping_timeout is None:
+        # the devices started one after the other share the deadline
+        ping_timeout = max(deadline - CHECKS_TIME, deadline / 3) / len(batches[0])
+
+    t_start = time.monotonic()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(batches), thread_name_prefix="device-startup")
+    try:
+        # {name: (status, elapsed)} of the devices started so far, filled by the threads
+        statuses = {}
+        futures = [executor.submit(_start_batch, batch, ping_timeout, statuses) for batch in batches]
+        concurrent.futures.wait(futures, timeout=deadline)
+
+        for _, name, _ in devices:
+            result = results[name]
+            if name in statuses:
+                result.status, result.elapsed = statuses[name]
+            else:
+                result.status, result.elapsed = DeviceStatus.TIMEOUT, time.monotonic() - t_start
+            log.info("Start up of the %s", result)
+    finally:
+        # the threads still running are left behind, they end with the ping timeout and the checks
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def _start_batch(batch, timeout, statuses):
+    for interface, name, serial_port in batch:
+        statuses[name] = _start_device(interface, name, serial_port, timeout)
+
+
+def _start_device(interface, name, serial_port, timeout):
+    t_start = time.monotonic()
+    try:
+        interface.init(name=name, serial_port=serial_port, timeout=timeout)
+        status = interface.device.status
+    except Exception as e:
+        log.exception(str(e) + ' ' + log.get_debug_info())
+        status = DeviceStatus.FAILED
+    return status, time.monotonic() - t_start
@@ -1,9 +1,13 @@
 from icube.device_commands import DeviceCommands, ICubeVersion
 from icube.tactile.common import tactile_logging as log
+from icube.tactile.common.instrumentation import Stage
+from icube.tactile.common.touch_frame import TouchFrame
 from icube.tactile.tactile_device import TactileDevice
 
 
 class FlexTSDevice(TactileDevice):
+    # (low byte, high byte) of each facet in the touch reply, without the start byte
+    touch_face_bytes = [(3, 2), (5, 4), (1, 0), (7, 6)]
 
     def __init__(self):
         """
@@ -12,6 +16,7 @@ class FlexTSDevice(TactileDevice):
         """
         super().__init__()
         self.cmd = DeviceCommands(ICubeVersion.FlexTS)
+        self.reply_demultiplexer = self.cmd.reply_demultiplexer()
 
     def is_device_connected(self, timeout=10):
         """
@@ -142,6 +147,19 @@ class FlexTSDevice(TactileDevice):
 
             # print(f"the touch message is {touch_message}")
 
+            return self.parse_touch_message(touch_message)
+
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            return []
+
+    def parse_touch_message(self, touch_message):
+        """
+        The method parses the reply to the touch message
+        @param touch_message the reply, as a list of bytes
+        @return the TouchFrame with the touches of the facets
+        """
+        try:
             if not touch_message or len(touch_message) != self.cmd.msg_length.reply_mpx:
                 return None
 
@@ -149,15 +167,8 @@ class FlexTSDevice(TactileDevice):
             touch_message = touch_message[1:]
             touch_message = touch_message[:-1]
 
-            binary_message = list(map(lambda x: "{0:08b}".format(x)[::-1], touch_message))
-
-            facets = list()
-            facets.append(''.join([binary_message[3], binary_message[2]]))
-            facets.append(''.join([binary_message[5], binary_message[4]]))
-            facets.append(''.join([binary_message[1], binary_message[0]]))
-            facets.append(''.join([binary_message[7], binary_message[6]]))
-
-            return facets
+            with self.metrics.time(Stage.parse):
+                return TouchFrame.from_bytes(touch_message, self.touch_face_bytes)
 
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
@@ -187,3 +198,12 @@ class FlexTSDevice(TactileDevice):
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
             return []
+
+    def sensor_requests(self):
+        """
+        The quaternion, touch and accelerometer requests, written back to back by read_all
+        """
+        header = [self.cmd.start, self.cmd.peripheral_number, self.cmd.device_id]
+        return [header + [self.cmd.read_bno, self.cmd.quat, self.cmd.zero, self.cmd.zero, self.cmd.stop],
+                header + [self.cmd.touch_mpx, self.cmd.zero, self.cmd.zero, self.cmd.zero, self.cmd.stop],
+                header + [self.cmd.read_bno, self.cmd.accel, self.cmd.zero, self.cmd.zero, self.cmd.stop]]
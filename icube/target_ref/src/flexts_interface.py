@@ -1,14 +1,19 @@
 from icube import flexts_device
+from icube.device_commands import ICubeVersion
 from icube.icube_interface import ICubeInterfaceV3
 
 
 class FlexTSInterface(ICubeInterfaceV3):
-    def __init__(self, is_mocked=False):
-        super().__init__(is_mocked)
+    version = ICubeVersion.FlexTS
 
-    def init(self, name="flex-ts", serial_port=""):
-        self.device = flexts_device.FlexTSDevice()
-        return self.device.start_up(device_name=name, serial_port=serial_port)
+    def __init__(self, is_mocked=False, reader_mode=False, pipelined=False):
+        super().__init__(is_mocked, reader_mode, pipelined)
+
+    def new_device(self):
+        return flexts_device.FlexTSDevice()
+
+    def init(self, name="flex-ts", serial_port="", timeout=10):
+        return super().init(name=name, serial_port=serial_port, timeout=timeout)
 
     def read_touch_single(self, timeout=0.4, face=1):
         """
@@ -1,9 +1,13 @@
 from icube.target_ref.src.device_commands import DeviceCommands, ICubeVersion
 from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common.instrumentation import Stage
+from icube.target_ref.src.tactile.common.touch_frame import TouchFrame
 from icube.target_ref.src.tactile.tactile_device import TactileDevice, TactileDeviceV4
 
 
 class ICubeV3(TactileDevice):
+    # (low byte, high byte) of each facet in the touch reply, without the start byte
+    touch_face_bytes = [(11, 10), (3, 2), (5, 4), (9, 8), (1, 0), (7, 6)]
 
     def __init__(self):
         """
@@ -12,6 +16,7 @@ class ICubeV3(TactileDevice):
         """
         super().__init__()
         self.cmd = DeviceCommands(ICubeVersion.V3)
+        self.reply_demultiplexer = self.cmd.reply_demultiplexer()
 
     def is_device_connected(self, timeout=10):
         """
@@ -127,6 +132,19 @@ class ICubeV3(TactileDevice):
 
             # print(f"the touch message is {touch_message}")
 
+            return self.parse_touch_message(touch_message)
+
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            return []
+
+    def parse_touch_message(self, touch_message):
+        """
+        The method parses the reply to the touch message
+        @param touch_message the reply, as a list of bytes
+        @return the TouchFrame with the touches of the cube facets
+        """
+        try:
             if not touch_message or len(touch_message) != self.cmd.msg_length.reply_mpx:
                 return None
 
@@ -134,17 +152,8 @@ class ICubeV3(TactileDevice):
             touch_message = touch_message[1:]
             touch_message = touch_message[:-1]
 
-            binary_message = list(map(lambda x: "{0:08b}".format(x)[::-1], touch_message))
-
-            facets = list()
-            facets.append(''.join([binary_message[11], binary_message[10]]))
-            facets.append(''.join([binary_message[3], binary_message[2]]))
-            facets.append(''.join([binary_message[5], binary_message[4]]))
-            facets.append(''.join([binary_message[9], binary_message[8]]))
-            facets.append(''.join([binary_message[1], binary_message[0]]))
-            facets.append(''.join([binary_message[7], binary_message[6]]))
-
-            return facets
+            with self.metrics.time(Stage.parse):
+                return TouchFrame.from_bytes(touch_message, self.touch_face_bytes)
 
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
@@ -174,6 +183,14 @@ class ICubeV3(TactileDevice):
             log.exception(str(e) + ' ' + log.get_debug_info())
             return []
 
+    def sensor_requests(self):
+        """
+        The quaternion, touch and accelerometer requests, written back to back by read_all
+        """
+        return [[self.cmd.start, self.cmd.read_bno, self.cmd.quat, self.cmd.stop],
+                [self.cmd.start, self.cmd.touch_mpx, self.cmd.zero, self.cmd.stop],
+                [self.cmd.start, self.cmd.read_bno, self.cmd.accel, self.cmd.stop]]
+
 
 class ICubeV4(TactileDeviceV4):
     num_facets = 6
@@ -262,14 +279,11 @@ class ICubeV4(TactileDeviceV4):
         @brief The method returns a list of the pressed cells for each facet of the icube.
         The list of the facets are ordered from the first side to the last side, according to
         the standard used for the icube (see documentation).
-        Each element of the list is a binary string where there is a one where the cell has been presed, and zero
-        when the cell is not pressed.
         The cells on each side are read from left to right and then from top to bottom.
-        @return the list of cube facets and each facet is a string of a binary number,
-        with zero where the cell is not touched, and one where the cell has been touched.
+        @return the list of the pad values of each facet and the TouchFrame with the touches of the cube facets
         """
         facets = []
-        facets_string = ['0' * 16 for i in range(6)]
+        touch_frame = TouchFrame.empty(self.num_facets)
         try:
             ask_msg = [self.cmd.start,
                        self.group, self.device_id,
@@ -281,27 +295,19 @@ class ICubeV4(TactileDeviceV4):
                        self.group, self.device_id,
                        self.cmd.touch_mpx, self.cmd.send_facets,
                        self.cmd.stop]
-            touch_messages = self.get_all_touch_messages(ask_msg, self.cmd.msg_length.reply_mpx, timeout)
-
-            drop_payload = False
-            face = []
-            for tm in touch_messages:
-                if tm == self.cmd.start_reply:
-                    face = []
-                    drop_payload = False
-                elif tm == self.cmd.stop_reply:
-                    facets.append(face)
-                    drop_payload = True
-                else:
-                    if not drop_payload:
-                        face.append(tm)
-
-            facets_string = [''.join(['1' if x > 0 else '0' for x in face]) for face in facets]
-            return facets, facets_string
+            touch_frames = self.get_touch_frames(ask_msg, self.num_facets, timeout)
+            if not touch_frames:
+                return facets, touch_frame
+
+            # The start and stop characters are removed from each facet frame
+            facets = [frame[1:-1] for frame in touch_frames]
+
+            touch_frame = TouchFrame.from_pads(facets)
+            return facets, touch_frame
 
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
-            return facets,
+            return facets, touch_frame
 
     def read_accelerometer(self, timeout=0.4):
         """
@@ -339,6 +345,15 @@ class ICubeV4(TactileDeviceV4):
             log.exception(str(e) + ' ' + log.get_debug_info())
             return []
 
+    def actuator_message(self, command, value=0x00):
+        """
+        The method builds the message of an actuator command
+        @param command the command, e.g. self.cmd.duty_vibro
+        @param value the value of the command
+        @return the message
+        """
+        return [self.cmd.start, self.group, self.device_id, command, value, self.cmd.stop]
+
     def send_vibration(self):
         """
         The method sends the message for vibrating the icube
@@ -1,111 +1,345 @@
+import concurrent.futures
+import enum
 import sys
 import threading
 import time
 
-from scipy.spatial.transform import Rotation as rotation
-
 from icube.target_ref.src import icube_device
-from icube.target_ref.src.device_commands import ICubeVersion
+from icube.target_ref.src.device_simulator import DeviceSimulator
+from icube.target_ref.src.device_commands import ICubeVersion, ReplyType
+from icube.target_ref.src.tactile.common import orientation
 from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common.instrumentation import Stage
+from icube.target_ref.src.tactile.communication.command_executor import CommandPriority
+from icube.target_ref.src.tactile.tactile_device import DeviceStatus
+
 
+class StreamingMode(enum.Enum):
+    POLL = 0,  # the grabber requests each sample to the device
+    PUSH = 1  # the device streams the frames on its own, the grabber only decodes them
 
-def ICubeInterface(version=ICubeVersion.V3, is_mocked=False):
+
+def ICubeInterface(version=ICubeVersion.V3, is_mocked=False, reader_mode=False, pipelined=False):
     if version == ICubeVersion.V3:
-        return ICubeInterfaceV3(is_mocked)
+        return ICubeInterfaceV3(is_mocked, reader_mode, pipelined)
     else:
-        return ICubeInterfaceV4(is_mocked)
+        return ICubeInterfaceV4(is_mocked, reader_mode, pipelined)
 
 
 class ICubeInterfaceV3:
-    def __init__(self, is_mocked=False):
+    version = ICubeVersion.V3
+
+    def __init__(self, is_mocked=False, reader_mode=False, pipelined=False):
         # iCube handling
         self.device = None
+        # True to receive the replies through a dedicated serial reader thread instead of polling the port
+        self.reader_mode = reader_mode
+        # True to request quaternions, touches and accelerometer all at once in grab()
+        self.pipelined = pipelined
 
         # Data Grabber
         self.icube_grabber_thread = None
+        # time.perf_counter_ns when the last byte of the last sample arrived, and of each of its frames (PUSH mode)
+        self.sample_timestamp = 0
+        self.sample_timestamps = {}
         self.timeout = 0.4
         self.on_data_callback = None
+        # SampleBus receiving the samples, tagged with bus_cube
+        self.sample_bus = None
+        self.bus_cube = None
 
+        # True to connect the device to a DeviceSimulator instead of a serial port
         self.is_mocked = is_mocked
+        self.simulator = None
 
     def bind_callback(self, callback):
         self.on_data_callback = callback
 
-    def init(self, name="icube", serial_port=""):
-        self.device = icube_device.ICubeV3()
-        return self.device.start_up(device_name=name, serial_port=serial_port)
+    def bind_bus(self, bus, cube=None):
+        """
+        It publishes the streamed samples to a SampleBus, along with the bound callback if any
+        @param bus the SampleBus, None to stop publishing
+        @param cube the name tagging the samples on the bus, the name of the device by default
+        """
+        self.bus_cube = cube
+        self.sample_bus = bus
+
+    def new_device(self):
+        return icube_device.ICubeV3()
+
+    def init(self, name="icube", serial_port="", timeout=10):
+        if self.is_mocked:
+            # attach() builds the device
+            return self.start_simulated(name, timeout)
+        self.device = self.new_device()
+        return self.start_device(name, serial_port, timeout)
+
+    def start_simulated(self, name="icube", timeout=10, **faults):
+        """
+        It connects the device to a DeviceSimulator instead of a serial port: the whole stack (serial
+        communication, framing, parsing) runs as with the real iCube
+        @param name the name of the device
+        @param timeout max time waiting for the reply to the ping
+        @param faults the faults of the link, see DeviceSimulator
+        @return True if the simulated iCube answered the ping
+        """
+        if self.simulator is not None:
+            self.simulator.stop()
+        self.simulator = DeviceSimulator(self.version, **faults)
+        self.attach(self.simulator.open_serial(port=name), name)
+        return self.device.reconnect(timeout)
+
+    def attach(self, ser, name="icube"):
+        """
+        It uses an already open port without the start up handshake, e.g. the host side of a PtySerialPair
+        @param ser the serial.Serial connected to the device
+        @param name the name of the device
+        """
+        self.device = self.new_device()
+        self.device.device_name = name
+        self.device.serial_communication.attach_serial(ser)
+        if self.reader_mode:
+            self.device.start_reader()
+        self.device.command_executor.start()
+
+    @property
+    def metrics(self):
+        """
+        The Metrics of the iCube: latency of each stage, reply timeouts, parse errors and sample rate.
+        metrics.snapshot() can be called at any time, also while streaming.
+        """
+        return self.device.metrics
+
+    @property
+    def status(self):
+        """
+        The DeviceStatus of the start up, NOT_STARTED before init()
+        """
+        return self.device.status if self.device is not None else DeviceStatus.NOT_STARTED
+
+    def start_device(self, name, serial_port, timeout=10):
+        started = self.device.start_up(device_name=name, serial_port=serial_port, timeout=timeout)
+        if started and self.reader_mode:
+            self.device.start_reader()
+        self.device.command_executor.start()
+        return started
+
+    def execute(self, priority, command, *args, **kwargs):
+        """
+        It runs a command of the device on its command executor, the only thread using the serial port
+        @param priority the CommandPriority of the command
+        @param command the method of the device to call
+        @return the Future of the command
+        """
+        return self.device.command_executor.submit(priority, command, *args, **kwargs)
+
+    def reconnect(self, timeout=2):
+        """
+        It checks the connection again, e.g. after the battery of the iCube was replaced
+        @param timeout max time waiting for the iCube
+        @return True if the iCube is connected
+        """
+        return self.execute(CommandPriority.CONTROL, self.device.reconnect, timeout=timeout).result()
 
     def calibrate(self, max_time=30):
         log.info("Please rotate the iCube of 90 degrees in different direction each 3 SECONDS")
         log.info("Keep doing it until all the sensors are = 3")
         i = 0
-        while not self.device.check_calibration() and i < max_time:
+        while not self.execute(CommandPriority.CONTROL, self.device.check_calibration).result() and i < max_time:
             i += 1
             time.sleep(1)
             log.info(str(i))
 
         log.info("Calibration Done!")
 
-    def start_streaming(self, timeout=0.4):
+    def start_streaming(self, timeout=0.4, mode=StreamingMode.POLL, decoder=None, target_rate=None):
+        """
+        It starts the thread which grabs the data from the iCube
+        @param timeout the waiting time for each reply
+        @param mode POLL to request each sample, PUSH when the device firmware streams the frames on its own
+        @param decoder PUSH mode only: the decoder of the stream, an object with reset() and feed(chunk) returning
+        (ReplyType, frame) tuples. By default the reply demultiplexer of the device.
+        @param target_rate the minimum rate of the complete samples in Hz, a warning is logged when the stream is
+        slower. None not to check it.
+        """
 
         log.info(f"Init streaming from the {self.device.device_name}")
         self.fsm_running = True
+        self.metrics.set_target_rate(target_rate)
 
-        # Allow for mocked data streaming
         grabber_method = self.__grabber
-        if self.is_mocked:
-            grabber_method = self.__mocked_grabber
+        extra_args = ()
+        if mode == StreamingMode.PUSH:
+            if decoder is None:
+                decoder = getattr(self.device, 'reply_demultiplexer', None)
+            if decoder is None:
+                log.error("The %s cannot decode a pushed stream", self.device.device_name)
+                self.fsm_running = False
+                return
+            if not self.device.start_reader():
+                log.error("Cannot read the stream of the %s", self.device.device_name)
+                self.fsm_running = False
+                return
+            grabber_method = self.__push_grabber
+            extra_args = (decoder,)
 
         self.icube_grabber_thread = threading.Thread(
             target=grabber_method,
             args=(
                 self.device,
                 lambda: self.timeout,
-                lambda q, t, a: self.on_data_callback(q, t, a),
+                self.__on_sample,
                 lambda: self.fsm_running
-            )
+            ) + extra_args
         )
         self.icube_grabber_thread.start()
         log.info("Streaming started")
 
+    def __on_sample(self, quaternions, touches, accelerometer, timestamp):
+        if self.sample_bus is not None:
+            cube = self.bus_cube if self.bus_cube is not None else self.device.device_name
+            self.sample_bus.publish(cube, timestamp, quaternions, touches, accelerometer)
+        if self.on_data_callback is not None:
+            self.on_data_callback(quaternions, touches, accelerometer, timestamp=timestamp)
+
     def stop_streaming(self):
         self.fsm_running = False
-        self.icube_grabber_thread.join()
+        if self.icube_grabber_thread is not None:
+            self.icube_grabber_thread.join()
         log.info("Streaming stopped")
 
+    def close(self):
+        """
+        It stops the streaming and the command executor of the device, the pending commands are executed first,
+        then the DeviceSimulator if any
+        """
+        self.stop_streaming()
+        if self.device is not None:
+            self.device.command_executor.stop()
+        if self.simulator is not None:
+            self.simulator.stop()
+            self.simulator = None
+
     def grab(self, timeout=0.4):
-        quaternions, rotation_matrix = self.read_quaternions(timeout)
-        touches = self.read_touch(timeout)
-        accelerometer = self.read_accelerometer(timeout)
-        return quaternions, touches, accelerometer, rotation_matrix
+        """
+        It reads a sample, as a single command: the requests of the other callers are not interleaved
+        @return quaternions, touches, accelerometer, rotation_matrix
+        """
+        quaternions, touches, accelerometer = self.execute(CommandPriority.SENSOR, self.__grab, timeout).result()
+        return quaternions, touches, accelerometer, self.__to_rotation(quaternions)
+
+    def __grab(self, timeout):
+        serial_communication = self.device.serial_communication
+        last_arrival_ns = serial_communication.last_arrival_ns
+        if self.pipelined:
+            quaternions, touches, accelerometer = self.device.read_all(timeout=timeout)
+        else:
+            quaternions = self.device.read_quaternions(timeout=timeout)
+            touches = self.read_touch(timeout)
+            accelerometer = self.read_accelerometer(timeout)
 
-    def __grabber(self, device, timeout, callback, running_condition):
-        touches = []
-        quaternions = []
-        accelerometer = []
+        if serial_communication.last_arrival_ns != last_arrival_ns:
+            self.sample_timestamp = serial_communication.last_arrival_ns
+        else:
+            # no reply arrived, the sample (empty) is stamped when the reads timed out
+            self.sample_timestamp = time.perf_counter_ns()
+        return self.__valid_quaternions(quaternions), touches, accelerometer or []
+
+    def grab_pipelined(self, timeout=0.4):
+        """
+        It writes the quaternion, touch and accelerometer requests back to back and waits for all the replies,
+        a single serial round trip per sample.
+        @return quaternions, touches, accelerometer, rotation_matrix
+        """
+        quaternions, touches, accelerometer = self.execute(CommandPriority.SENSOR, self.device.read_all,
+                                                           timeout=timeout).result()
+        quaternions = self.__valid_quaternions(quaternions)
+        return quaternions, touches, accelerometer or [], self.__to_rotation(quaternions)
 
+    def __grabber(self, device, timeout, callback, running_condition):
+        """
+        Grabber of the POLL mode. Only the raw quaternions are streamed: the orientation is derived when needed,
+        see the orientation module and SampleStore.
+        """
         while running_condition():
-            quaternions, touches, accelerometer, _ = self.grab(timeout())
-            callback(quaternions, touches, accelerometer)
+            quaternions, touches, accelerometer = self.execute(CommandPriority.SENSOR, self.__grab,
+                                                               timeout()).result()
+            self.__deliver(callback, quaternions, touches, accelerometer)
+
+    def __push_grabber(self, device, timeout, callback, running_condition, decoder):
+        """
+        Grabber of the PUSH mode: the frames are decoded and timestamped as they arrive, a sample is complete when
+        it has one frame of each type or when a type repeats.
+        """
+        decoder.reset()
+        sample = {}
 
-    def __mocked_grabber(self, device, timeout, callback, running_condition):
         while running_condition():
-            callback([], [], [])
+            reply = device.serial_communication.wait_frame(decoder, timeout(), stamped=True)
+            if reply is None:
+                if not device.serial_communication.is_reading:
+                    log.error("The stream of the %s was interrupted", device.device_name)
+                    break
+                # nothing arrived: the rate is checked anyway
+                device.metrics.rate.mark(0)
+                continue
+
+            (reply_type, frame), timestamp = reply
+            if reply_type in sample:
+                self.__push_sample(sample, callback)
+                sample = {}
+
+            sample[reply_type] = (timestamp, device.parse_reply(reply_type, bytes(frame)))
+            if len(sample) == len(ReplyType):
+                self.__push_sample(sample, callback)
+                sample = {}
+
+    def __push_sample(self, sample, callback):
+        # arrival time (time.perf_counter_ns) of each frame of the last sample
+        self.sample_timestamps = {reply_type: timestamp for reply_type, (timestamp, _) in sample.items()}
+        self.sample_timestamp = max(self.sample_timestamps.values())
+
+        quaternions = self.__valid_quaternions(sample.get(ReplyType.QUATERNIONS, (None, []))[1])
+        touches = sample.get(ReplyType.TOUCHES, (None, None))[1]
+        accelerometer = sample.get(ReplyType.ACCELEROMETER, (None, None))[1]
+        self.__deliver(callback, quaternions, touches, accelerometer or [])
+
+    def __deliver(self, callback, quaternions, touches, accelerometer):
+        """
+        It passes a sample to the callback, measuring the time spent in it, and updates the sample rate.
+        Only the complete samples count for the rate.
+        """
+        metrics = self.device.metrics
+        complete = len(quaternions) > 0 and touches is not None and len(touches) > 0 and len(accelerometer) > 0
+        metrics.count("samples")
+        if not complete:
+            metrics.count("incomplete_samples")
+        metrics.rate.mark(1 if complete else 0)
+
+        with metrics.time(Stage.callback):
+            callback(quaternions, touches, accelerometer, self.sample_timestamp)
 
     def read_quaternions(self, timeout=0.4):
         """
         It reads the quaternions from the icube
         @return the retrieved quaternions
         """
-        quaternions = self.device.read_quaternions(timeout=timeout)
+        quaternions = self.execute(CommandPriority.SENSOR, self.device.read_quaternions, timeout=timeout).result()
+        quaternions = self.__valid_quaternions(quaternions)
+        return quaternions, self.__to_rotation(quaternions)
+
+    @staticmethod
+    def __valid_quaternions(quaternions):
         if not quaternions or all(q == 0 for q in quaternions):
-            quaternions = []
-            rotation_matrix = None
-        else:
-            rotation_instance = rotation.from_quat(quaternions)
-            rotation_matrix = rotation_instance.as_matrix()
+            return []
+        return quaternions
+
+    def __to_rotation(self, quaternions):
+        if not quaternions:
+            return None
 
-        return quaternions, rotation_matrix
+        with self.device.metrics.time(Stage.rotation):
+            return orientation.rotation_matrix(quaternions)
 
     def read_touch(self, timeout=0.4):
         """
@@ -113,7 +347,7 @@ class ICubeInterfaceV3:
         @brief It reads the cells of the icubes facets
         @return the retrieved cells
         """
-        return self.device.read_touch(timeout=timeout)
+        return self.execute(CommandPriority.SENSOR, self.device.read_touch, timeout=timeout).result()
 
     def read_touch_single(self, timeout=0.4, face=1):
         """
@@ -121,14 +355,16 @@ class ICubeInterfaceV3:
         @brief It reads the cells of the icubes facets
         @return the retrieved cells
         """
-        return self.device.read_touch_single(timeout=timeout, face=face)
+        return self.execute(CommandPriority.SENSOR, self.device.read_touch_single, timeout=timeout,
+                            face=face).result()
 
     def read_accelerometer(self, timeout=0.4):
         """
          It reads the values of the accelerometer from the icube.
         @return the retrieved cells
         """
-        accelerometer = self.device.read_accelerometer(timeout=timeout)
+        accelerometer = self.execute(CommandPriority.SENSOR, self.device.read_accelerometer,
+                                     timeout=timeout).result()
 
         if not accelerometer:
             return []
@@ -137,25 +373,89 @@ class ICubeInterfaceV3:
 
 
 class ICubeInterfaceV4(ICubeInterfaceV3):
+    version = ICubeVersion.V4
+
+    def __init__(self, is_mocked=False, reader_mode=False, pipelined=False):
+        super().__init__(is_mocked, reader_mode, pipelined)
+
+        # actuator commands not sent yet, in the order they were given: a setting replaces the same setting queued
+        # after the last trigger (the last value wins), the triggers are all kept
+        self.actuator_lock = threading.Lock()
+        self.pending_actuators = []
+        self.pending_settings = {}  # index in pending_actuators of each setting queued after the last trigger
+        self.actuator_future = None  # completion handle of the batch not sent yet
 
-    def __init__(self, is_mocked=False):
-        super().__init__(is_mocked)
+    def new_device(self):
+        return icube_device.ICubeV4()
 
-    def init(self, name="icube", serial_port=""):
-        self.device = icube_device.ICubeV4()
-        return self.device.start_up(device_name=name, serial_port=serial_port)
+    # The actuator commands return immediately with a Future, which is done when the batch including them has
+    # been written. The commands queued before the batch is sent are written all together, in the order they were
+    # given, before the pending sensor requests.
 
     def set_vibration_duration(self, duration):
-        self.device.set_vibration_duration(duration)
+        return self.cue(duration=duration, vibrate=False)
 
     def set_vibration_duty(self, duty):
-        self.device.set_vibration_duty(duty)
+        return self.cue(duty=duty, vibrate=False)
 
     def vibrate(self):
-        self.device.send_vibration()
+        return self.cue()
 
     def set_audio_volume(self, value):
-        self.device.set_audio_volume(value)
+        return self.cue(volume=value, vibrate=False)
 
     def play_sound(self, sound_id):
-        self.device.send_play_audio(sound_id)
+        return self.cue(sound_id=sound_id, vibrate=False)
+
+    def cue(self, duration=None, duty=None, volume=None, vibrate=True, sound_id=None):
+        """
+        It queues a haptic and/or audio cue, the settings are sent before the activation in the same write
+        @param duration the duration of the vibration, None to keep the current one
+        @param duty the duty of the vibration, None to keep the current one
+        @param volume the volume of the audio, None to keep the current one
+        @param vibrate True to activate the vibration
+        @param sound_id the audio file to play, None for no audio
+        @return the Future of the write, its result is True if the messages were written
+        """
+        cmd = self.device.cmd
+        settings = [(command, value) for command, value in ((cmd.time_vibro, duration),
+                                                            (cmd.duty_vibro, duty),
+                                                            (cmd.volume, volume)) if value is not None]
+        triggers = []
+        if vibrate:
+            triggers.append((cmd.activate_vibro, 0x00))
+        if sound_id is not None:
+            triggers.append((cmd.play_audio, sound_id))
+
+        with self.actuator_lock:
+            for command, value in settings:
+                index = self.pending_settings.get(command)
+                if index is None:
+                    self.pending_settings[command] = len(self.pending_actuators)
+                    self.pending_actuators.append((command, value))
+                else:
+                    self.pending_actuators[index] = (command, value)
+            if triggers:
+                # the settings queued from now on apply to the next triggers only
+                self.pending_actuators.extend(triggers)
+                self.pending_settings = {}
+            if self.actuator_future is not None:
+                return self.actuator_future
+            future = self.actuator_future = concurrent.futures.Future()
+
+        self.execute(CommandPriority.ACTUATOR, self.__send_actuators, future)
+        return future
+
+    def __send_actuators(self, future):
+        with self.actuator_lock:
+            actuators, self.pending_actuators = self.pending_actuators, []
+            self.pending_settings = {}
+            if self.actuator_future is future:
+                self.actuator_future = None
+
+        try:
+            messages = [self.device.actuator_message(command, value) for command, value in actuators]
+            future.set_result(self.device.send_actuator_messages(messages))
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            future.set_exception(e)
@@ -0,0 +1,432 @@
+#! /usr/bin/python
+
+"""
+@package instrumentation
+@brief Counters, latency histograms and rate meters of the streaming pipeline.
+The metrics are grouped by source (the name of a device, "persistence", ...) and by stage, see Stage.
+Recording a value is O(1) and does not allocate, the snapshots and the reports are built only when asked, at
+runtime or when the application closes.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+
+from icube.target_ref.src.tactile.common import tactile_logging as log
+
+SUB_BUCKET_BITS = 5  # 32 buckets for each power of two: the values are recorded with an error below 1 / 32
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_BITS = 48  # values up to 2**48 ns (about 3 days), the larger ones fall in the last bucket
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Stage:
+    """
+    @class Stage
+    @brief the stages of the pipeline, used as the names of the latency histograms
+    """
+    write = "write"  # write of a request on the serial port
+    wait_reply = "wait_reply"  # from the request to the complete reply
+    parse = "parse"  # parse of a reply
+    rotation = "rotation"  # conversion of the quaternions to a rotation matrix
+    callback = "callback"  # the callback receiving a sample (data collector, aggregator)
+    persist = "persist"  # store of a sample in the phase buffer
+    dump = "dump"  # write of the data of a phase to the files
+
+
+class Counter:
+    """
+    @class Counter
+    A thread safe event counter
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def increment(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def reset(self):
+        with self.lock:
+            self.value = 0
+
+
+class LatencyHistogram:
+    """
+    @class LatencyHistogram
+    A histogram of durations in nanoseconds with logarithmic buckets, as in HdrHistogram: each power of two is
+    split in SUB_BUCKETS linear buckets, so every value is kept with the same relative precision whatever its
+    magnitude, in a fixed amount of memory.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * ((MAX_BITS - SUB_BUCKET_BITS) * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    @staticmethod
+    def bucket_index(value):
+        """
+        @fn bucket_index
+        @param value the duration in ns
+        @return the index of the bucket of the value
+        """
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            return value
+        return min((shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS,
+                   (MAX_BITS - SUB_BUCKET_BITS) * SUB_BUCKETS - 1)
+
+    @staticmethod
+    def bucket_value(index):
+        """
+        @fn bucket_value
+        @param index the index of a bucket
+        @return the value in the middle of the bucket
+        """
+        if index < 2 * SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        low = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+        return low + (1 << shift) // 2
+
+    def record(self, value):
+        """
+        @fn record
+        @param value the duration in ns, the negative values are recorded as 0
+        """
+        value = max(int(value), 0)
+        index = self.bucket_index(value)
+        with self.lock:
+            self.buckets[index] += 1
+            if self.count == 0 or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+            self.count += 1
+            self.total += value
+
+    def percentile(self, percentile):
+        """
+        @fn percentile
+        @param percentile the percentile, between 0 and 100
+        @return the value in ns below which are the percentile % of the recorded values, 0 if nothing was recorded
+        """
+        with self.lock:
+            return self.__percentile(percentile)
+
+    def __percentile(self, percentile):
+        if self.count == 0:
+            return 0
+        rank = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        @fn snapshot
+        @return dictionary with count, min, mean, max and the PERCENTILES, in ns
+        """
+        with self.lock:
+            snapshot = {"count": self.count,
+                        "min": self.min,
+                        "mean": self.total / self.count if self.count else 0,
+                        "max": self.max}
+            for percentile in PERCENTILES:
+                snapshot[f"p{percentile:g}"] = self.__percentile(percentile)
+        return snapshot
+
+    def reset(self):
+        with self.lock:
+            self.buckets = [0] * len(self.buckets)
+            self.count = 0
+            self.total = 0
+            self.min = 0
+            self.max = 0
+
+
+class RateMeter:
+    """
+    @class RateMeter
+    It measures the rate of an event on consecutive windows and warns when it drops below the target rate.
+    The check is done by mark(), which has to be called also when nothing happened (count=0), e.g. when a reply
+    timed out, otherwise a stream which stops completely is not noticed.
+    """
+
+    def __init__(self, name, window=1.0, target_rate=None):
+        """
+        @param name the name used in the warnings
+        @param window the length of a window in seconds
+        @param target_rate the minimum rate in events / s, None not to check it
+        """
+        self.name = name
+        self.window_ns = int(window * 1e9)
+        self.target_rate = target_rate
+        self.lock = threading.Lock()
+        self.window_start = None
+        self.window_count = 0
+        self.rate = None  # the rate of the last complete window
+        self.min_rate = None
+        self.low_rate_windows = 0
+        self.below_target = False
+
+    def mark(self, count=1, now=None):
+        """
+        @fn mark
+        @param count the number of events
+        @param now time.perf_counter_ns of the events, now if None
+        """
+        now = time.perf_counter_ns() if now is None else now
+        with self.lock:
+            if self.window_start is None:
+                self.window_start = now
+            self.window_count += count
+            elapsed = now - self.window_start
+            if elapsed < self.window_ns:
+                return
+            rate = self.window_count * 1e9 / elapsed
+            self.rate = rate
+            self.min_rate = rate if self.min_rate is None else min(self.min_rate, rate)
+            self.window_start = now
+            self.window_count = 0
+
+            was_below_target = self.below_target
+            self.below_target = self.target_rate is not None and rate < self.target_rate
+            if self.below_target:
+                self.low_rate_windows += 1
+
+        if self.below_target and not was_below_target:
+            log.warning("The %s is streaming at %.1f Hz, below the target of %.1f Hz",
+                        self.name, rate, self.target_rate)
+        elif was_below_target and not self.below_target:
+            log.info("The %s is back to %.1f Hz", self.name, rate)
+
+    def snapshot(self):
+        with self.lock:
+            return {"rate": self.rate,
+                    "min_rate": self.min_rate,
+                    "target_rate": self.target_rate,
+                    "low_rate_windows": self.low_rate_windows,
+                    "below_target": self.below_target}
+
+    def reset(self):
+        with self.lock:
+            self.window_start = None
+            self.window_count = 0
+            self.rate = None
+            self.min_rate = None
+            self.low_rate_windows = 0
+            self.below_target = False
+
+
+class _Timing:
+    """
+    Context manager recording the time spent in its block in a histogram
+    """
+
+    __slots__ = ('histogram', 't_start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.t_start = 0
+
+    def __enter__(self):
+        self.t_start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter_ns() - self.t_start)
+        return False
+
+
+class Metrics:
+    """
+    @class Metrics
+    The counters, the latency histograms (one for each Stage) and the sample rate of one source
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.rate = RateMeter(name)
+
+    def histogram(self, stage):
+        """
+        @fn histogram
+        @param stage the Stage
+        @return the LatencyHistogram of the stage, created at the first call
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        return histogram
+
+    def counter(self, name):
+        """
+        @fn counter
+        @param name the name of the counter, e.g. "reply_timeouts"
+        @return the Counter, created at the first call
+        """
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(name, Counter())
+        return counter
+
+    def record(self, stage, duration):
+        """
+        @fn record
+        @param stage the Stage
+        @param duration the duration in ns
+        """
+        self.histogram(stage).record(duration)
+
+    def time(self, stage):
+        """
+        @fn time
+        @brief with metrics.time(Stage.parse): ... records the duration of the block
+        @param stage the Stage
+        @return the context manager
+        """
+        return _Timing(self.histogram(stage))
+
+    def count(self, name, amount=1):
+        self.counter(name).increment(amount)
+
+    def set_target_rate(self, target_rate, window=1.0):
+        """
+        @fn set_target_rate
+        @param target_rate the minimum sample rate in Hz, None not to check it
+        @param window the length in seconds of the windows on which the rate is measured
+        """
+        self.rate.target_rate = target_rate
+        self.rate.window_ns = int(window * 1e9)
+
+    def snapshot(self):
+        """
+        @fn snapshot
+        @return dictionary with the counters, the histograms (see LatencyHistogram.snapshot) and the rate
+        """
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {"counters": {name: counter.value for name, counter in counters.items()},
+                "latency_ns": {stage: histogram.snapshot() for stage, histogram in histograms.items()},
+                "rate": self.rate.snapshot()}
+
+    def reset(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            for counter in self.counters.values():
+                counter.reset()
+        self.rate.reset()
+
+
+class Instrumentation:
+    """
+    @class Instrumentation
+    The registry of the Metrics of all the sources
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sources = {}
+
+    def metrics(self, name):
+        """
+        @fn metrics
+        @param name the name of the source, e.g. the name of the device
+        @return the Metrics of the source, created at the first call
+        """
+        with self.lock:
+            metrics = self.sources.get(name)
+            if metrics is None:
+                metrics = self.sources[name] = Metrics(name)
+            return metrics
+
+    def snapshot(self):
+        """
+        @fn snapshot
+        @return dictionary {source name: Metrics.snapshot()}
+        """
+        with self.lock:
+            sources = dict(self.sources)
+        return {name: metrics.snapshot() for name, metrics in sources.items()}
+
+    def report(self):
+        """
+        @fn report
+        @return a human readable summary of the snapshot, one line for each counter, histogram and rate
+        """
+        lines = []
+        for name, snapshot in self.snapshot().items():
+            rate = snapshot["rate"]
+            if rate["rate"] is not None:
+                line = f"{name} rate: last {rate['rate']:.1f} Hz, min {rate['min_rate']:.1f} Hz"
+                if rate["target_rate"] is not None:
+                    line += f", {rate['low_rate_windows']} windows below the target of {rate['target_rate']} Hz"
+                lines.append(line)
+            for counter, value in sorted(snapshot["counters"].items()):
+                lines.append(f"{name} {counter}: {value}")
+            for stage, latency in snapshot["latency_ns"].items():
+                percentiles = ", ".join(f"p{percentile:g} {latency[f'p{percentile:g}'] / 1e6:.3f}"
+                                        for percentile in PERCENTILES)
+                lines.append(f"{name} {stage}: {latency['count']} samples, mean {latency['mean'] / 1e6:.3f}, "
+                             f"{percentiles}, max {latency['max'] / 1e6:.3f} ms")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """
+        @fn dump
+        @brief It writes the snapshot to a JSON file
+        @param path the path of the file
+        """
+        try:
+            folder = os.path.dirname(path)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(path, 'w') as metrics_file:
+                json.dump({"time_ns": time.time_ns(), "sources": self.snapshot()}, metrics_file, indent=2)
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+
+    def reset(self):
+        with self.lock:
+            sources = list(self.sources.values())
+        for metrics in sources:
+            metrics.reset()
+
+
+_instrumentation = Instrumentation()
+
+
+def metrics(name):
+    """
+    @fn metrics
+    @param name the name of the source
+    @return the Metrics of the source in the shared registry
+    """
+    return _instrumentation.metrics(name)
+
+
+def instrumentation():
+    """
+    @fn instrumentation
+    @return the Instrumentation shared by the whole application
+    """
+    return _instrumentation
@@ -0,0 +1,105 @@
+#! /usr/bin/python
+
+"""
+@package orientation
+@brief Orientation derived from the quaternions of the devices, vectorised over whole recordings.
+The quaternions are [w, x, y, z] (scalar first) as returned by the devices, one row for each sample; the rows of
+the missing samples are NaN and give NaN results. The functions work on any number of rows, a single quaternion
+is a recording of one sample.
+"""
+
+import numpy as np
+
+
+def as_quaternions(quaternions):
+    """
+    @fn as_quaternions
+    @param quaternions [w, x, y, z] or an (N, 4) array of them
+    @return the (N, 4) float64 array of the unit quaternions
+    """
+    q = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    norm = np.linalg.norm(q, axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return q / norm
+
+
+def rotation_matrices(quaternions):
+    """
+    @fn rotation_matrices
+    @param quaternions [w, x, y, z] or an (N, 4) array of them
+    @return the (N, 3, 3) rotation matrices, from the device frame to the reference frame
+    """
+    w, x, y, z = as_quaternions(quaternions).T
+    matrices = np.empty((len(w), 3, 3))
+    matrices[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    matrices[:, 0, 1] = 2 * (x * y - z * w)
+    matrices[:, 0, 2] = 2 * (x * z + y * w)
+    matrices[:, 1, 0] = 2 * (x * y + z * w)
+    matrices[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    matrices[:, 1, 2] = 2 * (y * z - x * w)
+    matrices[:, 2, 0] = 2 * (x * z - y * w)
+    matrices[:, 2, 1] = 2 * (y * z + x * w)
+    matrices[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return matrices
+
+
+def rotation_matrix(quaternions):
+    """
+    @fn rotation_matrix
+    @param quaternions [w, x, y, z] of one sample
+    @return the 3 x 3 rotation matrix, None if the quaternions are missing
+    """
+    if quaternions is None or len(quaternions) != 4:
+        return None
+    return rotation_matrices(quaternions)[0]
+
+
+def euler_angles(quaternions, degrees=False):
+    """
+    @fn euler_angles
+    @brief the intrinsic Z-Y'-X'' (yaw, pitch, roll) angles of the rotations
+    @param quaternions [w, x, y, z] or an (N, 4) array of them
+    @param degrees True for degrees, radians otherwise
+    @return the (N, 3) array of [roll, pitch, yaw]: roll and yaw in [-pi, pi], pitch in [-pi / 2, pi / 2]
+    """
+    w, x, y, z = as_quaternions(quaternions).T
+    roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    pitch = np.arcsin(np.clip(2 * (w * y - x * z), -1.0, 1.0))
+    yaw = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    angles = np.stack([roll, pitch, yaw], axis=1)
+    return np.degrees(angles) if degrees else angles
+
+
+def angular_velocity(quaternions, timestamps):
+    """
+    @fn angular_velocity
+    @brief the angular velocity between consecutive samples, from the rotation between them
+    @param quaternions the (N, 4) array of [w, x, y, z]
+    @param timestamps the N time.perf_counter_ns of the samples
+    @return the (N, 3) angular velocities in rad/s in the device frame, row i between sample i - 1 and sample i,
+    the first row is NaN
+    """
+    q = as_quaternions(quaternions)
+    velocity = np.full((len(q), 3), np.nan)
+    if len(q) < 2:
+        return velocity
+
+    # relative rotation conj(q[i - 1]) * q[i]
+    w0, x0, y0, z0 = q[:-1].T
+    w1, x1, y1, z1 = q[1:].T
+    w = w0 * w1 + x0 * x1 + y0 * y1 + z0 * z1
+    v = np.stack([w0 * x1 - x0 * w1 - y0 * z1 + z0 * y1,
+                  w0 * y1 + x0 * z1 - y0 * w1 - z0 * x1,
+                  w0 * z1 - x0 * y1 + y0 * x1 - z0 * w1], axis=1)
+    # q and -q are the same rotation: take the shortest path
+    v[w < 0] *= -1
+    w = np.abs(w)
+
+    sin_half = np.linalg.norm(v, axis=1)
+    angle = 2 * np.arctan2(sin_half, w)
+    dt = np.diff(np.asarray(timestamps, dtype=np.int64)) * 1e-9
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # angle / sin(angle / 2) tends to 2 for small rotations
+        scale = np.where(sin_half > 1e-12, angle / sin_half, 2.0) / dt
+    velocity[1:] = v * scale[:, None]
+    return velocity
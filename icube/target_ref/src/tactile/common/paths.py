@@ -19,6 +19,7 @@ def create_folder_if_not_exist(path):
 class File:
     db_file = "explorations.sqlite"
     extraction_path = "extraction_path.config"
+    handshake_timings = "handshake_timings.json"
 
 
 class Folders:
@@ -50,7 +51,8 @@ class Paths:
     logs = os.path.join(device_code, Folders.logs)
     database = os.path.join(data, File.db_file)
     extraction_path_file = os.path.join(data, File.extraction_path)
+    handshake_timings_file = os.path.join(device_code, File.handshake_timings)
 
     ## Create data directory if doesn't exist
     # create_folder_if_not_exist(data)
-    create_folder_if_not_exist(logs)
+    # the logs folder is created by the logger, the first time it is used
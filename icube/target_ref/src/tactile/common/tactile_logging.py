@@ -11,82 +11,151 @@ It could be info, warning, error or exception.
 @date 10/02/2014
 @copyright Istituto Italiano di Tecnologia (iit) 2014
 """
+import atexit
 import logging.config
+import logging.handlers
+import queue
+import threading
 import traceback
 import sys
 import os.path
 from icube.target_ref.src.tactile.common.paths import Paths as paths
+from icube.target_ref.src.tactile.common.paths import create_folder_if_not_exist
 import icube.target_ref.src.tactile.common.device_info as device_info
 
+LOGGER_NAME = "wristbotDash"
+
+_logger = None
+_listener = None
+_lock = threading.Lock()
+
 
 def initLogger():
     """
     @function initLogger
-    It initialises the file logger.
-    """
-    dictLogConfig = {
-        "version": 1,
-        "handlers": {
-                    "rotHandler": {
-                        "class": "logging.handlers.RotatingFileHandler",
-                        "formatter": "myFormatter",
-                        "filename": os.path.join(paths.logs, f"{device_info.name}.log"),
-                        "maxBytes":  500000,
-                        "backupCount": 10,
-                        }
-                    },
-        "loggers": {
-            "wristbotDash": {
-                "handlers": ["rotHandler"],
-                "level": "INFO",
-                }
-            },
-
-        "formatters": {
-            "myFormatter": {
-                "format": "%(asctime)s-%(levelname)s- %(message)s"
-                }
+    It initialises the file logger, only the first time it is called.
+    The logger puts the records on a queue, a QueueListener thread writes them to the rotating file, so the
+    callers never wait for the disk or for the rotation of the file.
+    @return the logger
+    """
+    global _logger, _listener
+    if _logger is not None:
+        return _logger
+
+    with _lock:
+        if _logger is not None:
+            return _logger
+
+        create_folder_if_not_exist(paths.logs)
+        dictLogConfig = {
+            "version": 1,
+            "handlers": {
+                        "rotHandler": {
+                            "class": "logging.handlers.RotatingFileHandler",
+                            "formatter": "myFormatter",
+                            "filename": os.path.join(paths.logs, f"{device_info.name}.log"),
+                            "maxBytes":  500000,
+                            "backupCount": 10,
+                            }
+                        },
+            "loggers": {
+                "wristbotDashFile": {
+                    "handlers": ["rotHandler"],
+                    "level": "INFO",
+                    "propagate": False,
+                    }
+                },
+
+            "formatters": {
+                "myFormatter": {
+                    "format": "%(asctime)s-%(levelname)s- %(message)s"
+                    }
+                },
+            "disable_existing_loggers": False,
             }
-        }
 
-    logging.config.dictConfig(dictLogConfig)
-    return logging.getLogger("wristbotDash")
+        logging.config.dictConfig(dictLogConfig)
+        file_logger = logging.getLogger("wristbotDashFile")
+
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, *file_logger.handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.handlers = [logging.handlers.QueueHandler(records)]
+        logger.setLevel(file_logger.level)
+        logger.propagate = False
+        _logger = logger
+    return _logger
+
+
+def shutdown():
+    """
+    @function shutdown
+    It writes the pending records and stops the listener thread
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def set_level(level):
+    """
+    @function set_level
+    It changes the level of the logger, e.g. logging.DEBUG to enable the debug messages
+    @param level the new level
+    """
+    initLogger().setLevel(level)
+
+
+def _log(level, label, message, args, exc_info=False):
+    """
+    The message is formatted with the args (%-style) only if the level is enabled
+    """
+    logger = _logger or initLogger()
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, message, *args, exc_info=exc_info)
+    print(f"{label}: {message % args if args else message}")
+
+
+def debug(message, *args):
+    """
+    @function debug
+    Different message in case of a debug message, disabled by default.
+    """
+    _log(logging.DEBUG, "debug", message, args)
 
-def info(message):
+def info(message, *args):
     """
     @function info
     Different message in case of an info message.
     """
-    logger = initLogger()
-    logger.info(message)
-    print(f"info: {message}")
+    _log(logging.INFO, "info", message, args)
 
-def warning(message):
+def warning(message, *args):
     """
     @function warning
     Different message in case of a warning message.
     """
-    logger = initLogger()
-    logger.warning(message)
-    print(f"warning: {message}")
+    _log(logging.WARNING, "warning", message, args)
 
-def error(message):
+def error(message, *args):
     """
     @function error
     Different message in case of an error message.
     """
-    logger = initLogger()
-    logger.error(message)
-    print(f"error: {message}")
+    _log(logging.ERROR, "error", message, args)
 
-def exception(message):
+def exception(message, *args):
     """
     @function exception
     Different message in case of an exception message.
     """
-    logger = initLogger()
-    logger.exception(message)
-    print(f"exception: {message}")
+    _log(logging.ERROR, "exception", message, args, exc_info=True)
 
 def get_debug_info():
     """
@@ -15,4 +15,42 @@ class Timer:
         self.t_currn = time.time()
 
     def elapsed(self):
-        return time.time() - self.t_start
\ No newline at end of file
+        return time.time() - self.t_start
+
+class SessionClock:
+    """
+    @class SessionClock
+    The mapping between time.perf_counter_ns, the monotonic high resolution clock of the sample timestamps, and the
+    wall clock (time.time_ns), measured once at the beginning of the session.
+    The wall clock is read before and after the monotonic one, the pair with the shortest bracket is kept and its
+    width is the uncertainty of the mapping.
+    """
+
+    def __init__(self, rounds=16):
+        self.perf_ns = 0
+        self.wall_ns = 0
+        self.uncertainty_ns = 0
+        self.calibrate(rounds)
+
+    def calibrate(self, rounds=16):
+        best = None
+        for _ in range(rounds):
+            wall_before = time.time_ns()
+            perf = time.perf_counter_ns()
+            wall_after = time.time_ns()
+            if best is None or wall_after - wall_before < best[2]:
+                best = (perf, (wall_before + wall_after) // 2, wall_after - wall_before)
+        self.perf_ns, self.wall_ns, self.uncertainty_ns = best
+
+    def to_wall(self, perf_ns):
+        """
+        @param perf_ns a time.perf_counter_ns timestamp of this session
+        @return the wall clock time in seconds, as time.time()
+        """
+        return (self.wall_ns + perf_ns - self.perf_ns) / 1e9
+
+    def now(self):
+        """
+        @return the wall clock time in seconds, as time.time(), but on the same clock of the sample timestamps
+        """
+        return self.to_wall(time.perf_counter_ns())
@@ -0,0 +1,133 @@
+#! /usr/bin/python
+
+import numpy as np
+
+N_PADS = 16  # pads for each face, one bit each
+
+
+class TouchFrame:
+    """
+    @class TouchFrame
+    The touches of all the faces of a device at one instant, packed in a uint16 for each face: pad i of a face is
+    on bit i, pads read from left to right and then from top to bottom, as in the face strings.
+    The common queries work on the packed values, the face strings ("1" where the pad is touched, pad 0 first)
+    are only built when to_strings() is called.
+    """
+
+    __slots__ = ('faces', '__strings')
+
+    def __init__(self, faces):
+        """
+        @param faces the packed faces, one integer for each face
+        """
+        self.faces = np.asarray(faces, dtype=np.uint16)
+        self.__strings = None
+
+    @classmethod
+    def empty(cls, n_faces):
+        """
+        @fn empty
+        @brief It creates a frame with no pad touched
+        @param n_faces the number of faces
+        @return the TouchFrame
+        """
+        return cls(np.zeros(n_faces, dtype=np.uint16))
+
+    @classmethod
+    def from_bytes(cls, payload, face_bytes):
+        """
+        @fn from_bytes
+        @brief It creates a frame from a reply where each face is made of two bytes, pad 0 on bit 0 of the low byte
+        @param payload the bytes of the reply, without the start and stop bytes
+        @param face_bytes the list of (low byte index, high byte index) for each face
+        @return the TouchFrame
+        """
+        payload = np.frombuffer(bytes(payload), dtype=np.uint8).astype(np.uint16)
+        low, high = np.array(face_bytes).T
+        return cls(payload[low] | (payload[high] << 8))
+
+    @classmethod
+    def from_pads(cls, pads):
+        """
+        @fn from_pads
+        @brief It creates a frame from the values of the pads
+        @param pads the values of the pads of each face, a pad is touched when its value is > 0
+        @return the TouchFrame
+        """
+        touched = np.zeros((len(pads), N_PADS), dtype=bool)
+        for f, face in enumerate(pads):
+            face = np.asarray(face[:N_PADS])
+            touched[f, :len(face)] = face > 0
+        bits = np.packbits(touched, axis=1, bitorder='little')
+        return cls(bits.view('<u2').ravel())
+
+    @classmethod
+    def from_strings(cls, strings):
+        """
+        @fn from_strings
+        @brief It creates a frame from the face strings
+        @param strings the list of face strings
+        @return the TouchFrame
+        """
+        return cls([int(face[::-1], 2) if face else 0 for face in strings])
+
+    def __len__(self):
+        return len(self.faces)
+
+    def __eq__(self, other):
+        return isinstance(other, TouchFrame) and np.array_equal(self.faces, other.faces)
+
+    def __repr__(self):
+        return str(self.to_strings())
+
+    def touched(self):
+        """
+        @fn touched
+        @return bool array, True for the faces with at least one pad touched
+        """
+        return self.faces != 0
+
+    def fully_covered(self):
+        """
+        @fn fully_covered
+        @return bool array, True for the faces with all the pads touched
+        """
+        return self.faces == 0xFFFF
+
+    def faces_touched(self):
+        """
+        @fn faces_touched
+        @return the number of faces with at least one pad touched
+        """
+        return int(np.count_nonzero(self.faces))
+
+    def fully_covered_faces(self):
+        """
+        @fn fully_covered_faces
+        @return the number of faces with all the pads touched
+        """
+        return int(np.count_nonzero(self.faces == 0xFFFF))
+
+    def popcount(self):
+        """
+        @fn popcount
+        @return uint8 array with the number of pads touched on each face
+        """
+        return self.to_array().sum(axis=1, dtype=np.uint8)
+
+    def to_array(self):
+        """
+        @fn to_array
+        @return (faces, N_PADS) bool array, True where the pad is touched
+        """
+        bits = np.unpackbits(self.faces.astype('<u2').view(np.uint8), bitorder='little')
+        return bits.reshape(len(self.faces), N_PADS).view(bool)
+
+    def to_strings(self):
+        """
+        @fn to_strings
+        @return the list of face strings, built at the first call
+        """
+        if self.__strings is None:
+            self.__strings = [format(int(face), f"0{N_PADS}b")[::-1] for face in self.faces]
+        return self.__strings
@@ -0,0 +1,129 @@
+#! /usr/bin/python
+
+import concurrent.futures
+import enum
+import itertools
+import queue
+import threading
+
+from icube.target_ref.src.tactile.common import tactile_logging as log
+
+
+class CommandPriority(enum.IntEnum):
+    ACTUATOR = 0,  # vibration, audio: the cues have to be given on time
+    CONTROL = 1,  # calibration, battery, reconnection
+    SENSOR = 2  # quaternions, touches and accelerometer polling
+
+
+class CommandExecutor:
+    """
+    @class CommandExecutor
+    It runs all the commands sent to a device on a single thread, one at a time, so the requests and the replies
+    of different callers (grabber thread, GUI, actuators) are never interleaved on the serial port.
+    The pending commands are executed by priority, then in the order they were submitted.
+    Each command returns a concurrent.futures.Future with its result.
+    """
+
+    def __init__(self, name="device"):
+        """
+        @param name the name of the device, used for the name of the thread
+        """
+        self.name = name
+        self.commands = queue.PriorityQueue()
+        self.counter = itertools.count()  # keeps the submission order among the commands with the same priority
+        self.worker_thread = None
+        self.lock = threading.Lock()
+        self.running = False
+
+    @property
+    def is_running(self):
+        return self.running
+
+    def start(self):
+        """
+        @function start
+        It starts the worker thread, if it is not running yet
+        """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.worker_thread = threading.Thread(target=self.__worker, name=f"{self.name}-commands", daemon=True)
+            self.worker_thread.start()
+
+    def stop(self, cancel_pending=False):
+        """
+        @function stop
+        It stops the worker thread after the pending commands
+        @param cancel_pending True to cancel the pending commands instead of executing them
+        """
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            worker_thread = self.worker_thread
+            self.worker_thread = None
+            # the stop command has the lowest priority, it runs after the commands already submitted. Queued
+            # holding the lock, so no command is queued after it.
+            self.commands.put((len(CommandPriority), next(self.counter), None, None, (), {}))
+
+        if cancel_pending:
+            self.__cancel_pending()
+        if worker_thread is not threading.current_thread():
+            worker_thread.join()
+
+    def submit(self, priority, command, *args, **kwargs):
+        """
+        @function submit
+        It queues a command
+        @param priority the CommandPriority of the command
+        @param command the function to execute, called as command(*args, **kwargs)
+        @return the Future of the command. When called from a command already running on the worker thread, or
+        when the executor is not running, the command is executed immediately in the caller thread.
+        """
+        future = concurrent.futures.Future()
+        with self.lock:
+            queued = self.running and threading.current_thread() is not self.worker_thread
+            if queued:
+                self.commands.put((int(priority), next(self.counter), future, command, args, kwargs))
+        if not queued:
+            # not started (e.g. during the start up), stopped or nested command: run it in the caller thread
+            self.__execute(future, command, args, kwargs)
+        return future
+
+    def call(self, priority, command, *args, timeout=None, **kwargs):
+        """
+        @function call
+        It queues a command and waits for its result
+        @param priority the CommandPriority of the command
+        @param command the function to execute
+        @param timeout max time waiting for the result, None to wait forever
+        @return the result of the command
+        """
+        return self.submit(priority, command, *args, **kwargs).result(timeout)
+
+    def __worker(self):
+        while True:
+            _, _, future, command, args, kwargs = self.commands.get()
+            if command is None:
+                break
+            self.__execute(future, command, args, kwargs)
+
+    @staticmethod
+    def __execute(future, command, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(command(*args, **kwargs))
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            future.set_exception(e)
+
+    def __cancel_pending(self):
+        while True:
+            try:
+                _, _, future, _, _, _ = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if future is not None:
+                future.cancel()
@@ -0,0 +1,216 @@
+#! /usr/bin/python
+
+
+class FrameDecoder:
+    """
+    @class FrameDecoder
+    Incremental decoder for the replies of the device, framed as | start_reply | payload | stop_reply |.
+    It accepts chunks of bytes of any size, as they come from the serial port, and returns the complete frames.
+    A frame split among several chunks is kept until its last byte arrives, several frames in the same chunk
+    are all returned.
+    The frames are memoryview slices of the internal buffer: no bytes are copied, but a frame is only valid
+    until the next call to feed(). Convert it (bytes(frame), list(frame)) if it has to be kept.
+    """
+
+    def __init__(self, start_byte, stop_byte, length=None, capacity=1024):
+        """
+        @param start_byte the first byte of a frame
+        @param stop_byte the last byte of a frame
+        @param length the length of the frame, start and stop bytes included.
+        If None the frame ends at the first stop_byte, otherwise the stop_byte has to be at the end of the
+        frame and the payload can contain any value.
+        @param capacity size of the internal buffer, the oldest bytes are dropped if it is full.
+        """
+        self.start_byte = start_byte
+        self.stop_byte = stop_byte
+        self.length = length
+        self.capacity = max(capacity, 2 * (length or 0))
+        self.buffer = bytearray(self.capacity)
+        self.view = memoryview(self.buffer)
+        self.begin = 0  # first byte not decoded yet
+        self.end = 0  # one past the last byte received
+        self.dropped = 0  # number of bytes discarded because they did not belong to a frame
+        self.arrival_ns = 0  # arrival time of the last chunk, set by the caller (see SerialComm.wait_frame)
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def reset(self):
+        """
+        @function reset
+        It forgets all the bytes received so far
+        """
+        self.begin = 0
+        self.end = 0
+        self.arrival_ns = 0
+
+    def feed(self, chunk):
+        """
+        @function feed
+        It appends a chunk of bytes coming from the device
+        @param chunk the bytes received
+        @return an iterator over the complete frames
+        """
+        if chunk:
+            self.append(chunk)
+        return self.frames()
+
+    def frames(self):
+        """
+        @function frames
+        @return an iterator over the complete frames in the buffer. The frames not consumed by the caller are
+        returned by the next call.
+        """
+        buffer = self.buffer
+        while True:
+            position = buffer.find(self.start_byte, self.begin, self.end)
+            if position < 0:
+                self.dropped += self.end - self.begin
+                self.begin = self.end
+                return
+
+            self.dropped += position - self.begin
+            self.begin = position
+
+            if self.length is not None:
+                if self.end - position < self.length:
+                    return
+                frame_end = position + self.length
+                if buffer[frame_end - 1] != self.stop_byte:
+                    # the start byte was not the beginning of a frame, resync on the next one
+                    self.dropped += 1
+                    self.begin = position + 1
+                    continue
+            else:
+                stop = buffer.find(self.stop_byte, position + 1, self.end)
+                if stop < 0:
+                    return
+                frame_end = stop + 1
+
+            self.begin = frame_end
+            yield self.view[position:frame_end]
+
+    def append(self, chunk):
+        """
+        @function append
+        It stores a chunk of bytes without decoding it
+        @param chunk the bytes received
+        """
+        size = len(chunk)
+        if size > self.capacity:
+            self.dropped += self.end - self.begin + size - self.capacity
+            chunk = chunk[size - self.capacity:]
+            size = self.capacity
+            self.reset()
+
+        if self.end + size > self.capacity:
+            # move the pending bytes at the beginning of the buffer, dropping the oldest ones if needed
+            pending = self.end - self.begin
+            overflow = pending + size - self.capacity
+            if overflow > 0:
+                self.dropped += overflow
+                self.begin += overflow
+                pending -= overflow
+            self.buffer[0:pending] = self.buffer[self.begin:self.end]
+            self.begin = 0
+            self.end = pending
+
+        self.buffer[self.end:self.end + size] = chunk
+        self.end += size
+
+
+class FrameSpec:
+    """
+    @class FrameSpec
+    Description of one kind of reply, used by the ReplyDemultiplexer to recognise it in the stream.
+    """
+
+    def __init__(self, kind, first_byte, length, last_byte=None, markers=None):
+        """
+        @param kind the identifier returned with the frames of this kind
+        @param first_byte the first byte of the reply
+        @param length the length of the reply
+        @param last_byte the last byte of the reply, None if it can be any value
+        @param markers dictionary {offset: byte} of the other bytes with a known value
+        """
+        self.kind = kind
+        self.first_byte = first_byte
+        self.length = length
+        self.last_byte = last_byte
+        self.markers = markers or {}
+
+    def matches(self, buffer, position):
+        if self.last_byte is not None and buffer[position + self.length - 1] != self.last_byte:
+            return False
+        return all(buffer[position + offset] == value for offset, value in self.markers.items())
+
+
+class ReplyDemultiplexer:
+    """
+    @class ReplyDemultiplexer
+    Incremental decoder for a stream where replies of different kinds are interleaved, e.g. when several requests
+    are written back to back. Each kind of reply is described by a FrameSpec, the replies are returned as
+    (kind, frame) tuples. As for the FrameDecoder, the frames are memoryview slices of the internal buffer and are
+    only valid until the next call to feed().
+    """
+
+    def __init__(self, specs, capacity=1024):
+        """
+        @param specs the list of FrameSpec. When two specs match the same bytes the first one wins.
+        @param capacity size of the internal buffer, the oldest bytes are dropped if it is full.
+        """
+        self.specs = {}
+        for spec in specs:
+            self.specs.setdefault(spec.first_byte, []).append(spec)
+        self.decoder = FrameDecoder(None, None, capacity=max([capacity] + [2 * s.length for s in specs]))
+        self.arrival_ns = 0  # arrival time of the last chunk, set by the caller (see SerialComm.wait_frame)
+
+    @property
+    def dropped(self):
+        return self.decoder.dropped
+
+    def __len__(self):
+        return len(self.decoder)
+
+    def reset(self):
+        self.decoder.reset()
+        self.arrival_ns = 0
+
+    def feed(self, chunk):
+        """
+        @function feed
+        It appends a chunk of bytes coming from the device
+        @param chunk the bytes received
+        @return an iterator over the complete (kind, frame) tuples
+        """
+        if chunk:
+            self.decoder.append(chunk)
+        return self.frames()
+
+    def frames(self):
+        """
+        @function frames
+        @return an iterator over the complete (kind, frame) tuples in the buffer
+        """
+        decoder = self.decoder
+        buffer = decoder.buffer
+        while decoder.begin < decoder.end:
+            position = decoder.begin
+            available = decoder.end - position
+            waiting = False
+            match = None
+            for spec in self.specs.get(buffer[position], ()):
+                if available < spec.length:
+                    waiting = True
+                elif spec.matches(buffer, position):
+                    match = spec
+                    break
+
+            if match is not None:
+                decoder.begin = position + match.length
+                yield match.kind, decoder.view[position:decoder.begin]
+            elif waiting:
+                return
+            else:
+                decoder.dropped += 1
+                decoder.begin = position + 1
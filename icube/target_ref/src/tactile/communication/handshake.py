@@ -0,0 +1,157 @@
+#! /usr/bin/python
+
+import json
+import os
+import threading
+import time
+
+from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common.paths import Paths as paths
+
+
+class HandshakeTimings:
+    """
+    @class HandshakeTimings
+    The reply time of each request on each port, measured by the last successful handshake and stored in a JSON file
+    so the next run (or the next reconnection) starts waiting for the time the device really needs.
+    The file is written only when a reply time changes meaningfully, not at each exchange.
+    """
+
+    def __init__(self, path=None, tolerance=0.25, min_change=0.001):
+        """
+        @param path the JSON file, Paths.handshake_timings_file if None
+        @param tolerance relative change of a reply time worth storing
+        @param min_change the smallest change of a reply time worth storing, in seconds
+        """
+        self.path = path = path or paths.handshake_timings_file
+        self.tolerance = tolerance
+        self.min_change = min_change
+        self.lock = threading.Lock()
+        self.timings = {}
+        try:
+            if os.path.exists(path):
+                with open(path) as timings_file:
+                    self.timings = json.load(timings_file)
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            self.timings = {}
+
+    def get(self, port, request):
+        """
+        @function get
+        @param port the name of the serial port
+        @param request the name of the request, e.g. "ping"
+        @return the last reply time in seconds, None if it was never measured
+        """
+        with self.lock:
+            return self.timings.get(str(port), {}).get(request)
+
+    def update(self, port, request, reply_time):
+        """
+        @function update
+        It stores a new reply time and saves the file, if the time differs enough from the stored one
+        @param port the name of the serial port
+        @param request the name of the request, e.g. "ping"
+        @param reply_time the time between the request and the reply, in seconds
+        @return True if the time was stored
+        """
+        with self.lock:
+            port_timings = self.timings.setdefault(str(port), {})
+            known = port_timings.get(request)
+            if known is not None and abs(reply_time - known) <= max(self.tolerance * known, self.min_change):
+                return False
+
+            port_timings[request] = round(reply_time, 6)
+            try:
+                temp_path = self.path + ".tmp"
+                with open(temp_path, 'w') as timings_file:
+                    json.dump(self.timings, timings_file, indent=2)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                log.exception(str(e) + ' ' + log.get_debug_info())
+            return True
+
+
+_default_timings = None
+_default_timings_lock = threading.Lock()
+
+
+def default_timings():
+    """
+    @function default_timings
+    @return the HandshakeTimings shared by all the devices, loaded at the first call
+    """
+    global _default_timings
+    with _default_timings_lock:
+        if _default_timings is None:
+            _default_timings = HandshakeTimings()
+        return _default_timings
+
+
+class Handshake:
+    """
+    @class Handshake
+    Request / reply exchanges with a device which may not be ready yet (e.g. while it boots after the port was opened).
+    The request is sent again with an exponential backoff of the waiting window, and the exchange ends as soon as
+    the bytes received match the expected reply, without waiting for the end of the window.
+    The first window is twice the reply time remembered for the port, so a known device answers at the first try.
+    """
+
+    def __init__(self, serial_communication, timings=None, first_wait=0.05, min_wait=0.005, max_wait=0.5):
+        """
+        @param serial_communication the SerialComm of the device
+        @param timings the HandshakeTimings, the shared one if None
+        @param first_wait the first waiting window when the reply time of the port is not known
+        @param min_wait the shortest waiting window
+        @param max_wait the longest waiting window
+        """
+        self.serial_communication = serial_communication
+        self.timings = timings
+        self.first_wait = first_wait
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+
+    def exchange(self, request, message, match, timeout=2):
+        """
+        @function exchange
+        It sends the message until the reply matches or the timeout expires
+        @param request the name of the request, used to remember its reply time
+        @param message the message to send
+        @param match function called with all the bytes received after the last send, it returns the parsed reply
+        or None if the reply is not complete yet or does not parse; it must not raise
+        @param timeout max time for the whole exchange
+        @return the value returned by match, None if the timeout expired
+        """
+        timings = self.timings or default_timings()
+        port = self.serial_communication.port_name
+        known = timings.get(port, request)
+        wait = min(max(2 * known, self.min_wait), self.max_wait) if known is not None else self.first_wait
+
+        t_end = time.monotonic() + timeout
+        attempts = 0
+        while time.monotonic() < t_end:
+            attempts += 1
+            self.serial_communication.empty_serial()
+            t_sent = time.monotonic()
+            self.serial_communication.write_to(message)
+
+            received = bytearray()
+            attempt_end = min(t_sent + wait, t_end)
+            while True:
+                remaining = attempt_end - time.monotonic()
+                if remaining <= 0:
+                    break
+                chunk = self.serial_communication.wait_available(remaining)
+                if not chunk:
+                    continue
+                received += chunk
+                reply = match(bytes(received))
+                if reply is not None:
+                    reply_time = time.monotonic() - t_sent
+                    log.debug("%s reply on %s after %d attempts, %.4f s", request, port, attempts, reply_time)
+                    timings.update(port, request, reply_time)
+                    return reply
+
+            wait = min(2 * wait, self.max_wait)
+
+        return None
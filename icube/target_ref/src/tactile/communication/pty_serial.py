@@ -0,0 +1,108 @@
+#! /usr/bin/python
+
+import os
+import select
+import threading
+import time
+import tty
+
+import serial
+
+from icube.target_ref.src.tactile.common import utilities as utils
+from icube.target_ref.src.tactile.common import tactile_logging as log
+
+
+class PtySerialPair:
+    """
+    @class PtySerialPair
+    A local stand-in for a device on a serial port, based on a pseudo terminal pair (POSIX only).
+    The host side is a real serial.Serial opened on the slave end, so SerialComm and everything above it run
+    unchanged. The device side is the master end: what is written there is received by the host and vice versa.
+    """
+
+    def __init__(self):
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self.host = None
+        self.push_thread = None
+        self.pushing = False
+
+    def open_host(self, baudrate=250000, timeout=0.1):
+        """
+        @function open_host
+        It opens the host side of the pair
+        @param baudrate ignored by the pseudo terminal, kept for symmetry with the real port
+        @param timeout the read timeout of the port
+        @return the serial.Serial to give to SerialComm.attach_serial
+        """
+        self.host = serial.Serial(port=self.port, baudrate=baudrate, timeout=timeout)
+        return self.host
+
+    def device_write(self, data):
+        """
+        @function device_write
+        It sends bytes to the host, as the device would do
+        @param data the bytes to send
+        """
+        view = memoryview(bytes(data))
+        while view:
+            written = os.write(self.master_fd, view)
+            view = view[written:]
+
+    def device_read(self, timeout=0.1):
+        """
+        @function device_read
+        It reads what the host wrote to the device
+        @param timeout max time waiting
+        @return the bytes read, empty if nothing arrived before the timeout
+        """
+        ready, _, _ = select.select([self.master_fd], [], [], timeout)
+        if not ready:
+            return b''
+        return os.read(self.master_fd, 4096)
+
+    def start_pushing(self, next_frames, period=0.01):
+        """
+        @function start_pushing
+        It starts a thread which pushes frames to the host, as a device streaming on its own would do
+        @param next_frames function returning the list of frames (bytes) to push at each period
+        @param period seconds between two pushes
+        """
+        self.pushing = True
+        self.push_thread = threading.Thread(target=self.__push, args=(next_frames, period), daemon=True)
+        self.push_thread.start()
+
+    def stop_pushing(self):
+        self.pushing = False
+        if self.push_thread is not None:
+            self.push_thread.join()
+        self.push_thread = None
+
+    def __push(self, next_frames, period):
+        next_time = time.monotonic()
+        while self.pushing:
+            try:
+                for frame in next_frames():
+                    self.device_write(frame)
+            except Exception as e:
+                print(utils.get_exception_message(e))
+                log.exception(str(e) + ' ' + log.get_debug_info())
+                self.pushing = False
+
+            next_time += period
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+    def close(self):
+        """
+        @function close
+        It stops the pushing thread and closes both ends
+        """
+        self.stop_pushing()
+        if self.host is not None:
+            self.host.close()
+        for fd in (self.master_fd, self.slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
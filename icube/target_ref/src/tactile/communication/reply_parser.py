@@ -0,0 +1,152 @@
+#! /usr/bin/python
+
+"""
+@package reply_parser
+@brief Batch parsers for the ASCII replies of the devices.
+A batch is a buffer with N replies of the same length back to back (bytes, bytearray, memoryview, a list of
+replies or an (N, length) uint8 array), it is parsed in one NumPy pass: the fields are found at their offsets
+and the ASCII numbers are converted all together, without a Python loop on the samples.
+The replies which cannot be parsed give a row of NaN.
+"""
+
+import numpy as np
+
+from icube.target_ref.src.tactile.common.constants import Acceleration_limits as al
+
+QUATERNION_LENGTH = 32
+QUATERNION_MARKERS = b'WXYZ'
+QUATERNION_FIELD_WIDTH = 8  # the marker and 7 characters
+ACCELEROMETER_MARKERS = bytes([al.acc_x_digit, al.acc_y_digit, al.acc_z_digit])
+
+_DIGIT_0 = ord('0')
+_DOT = ord('.')
+_MINUS = ord('-')
+_PLUS = ord('+')
+_SPACE = ord(' ')
+
+
+def as_batch(replies, length):
+    """
+    @fn as_batch
+    @brief It views the replies as a (N, length) uint8 array, copying them only if they are not contiguous
+    @param replies the buffer with the replies, a list of replies or a list of bytes (a single reply)
+    @param length the length of each reply
+    @return the (N, length) array
+    """
+    if isinstance(replies, np.ndarray):
+        return replies.astype(np.uint8, copy=False).reshape(-1, length)
+    if isinstance(replies, (list, tuple)):
+        if replies and isinstance(replies[0], int):
+            replies = bytes(replies)
+        else:
+            replies = b''.join(bytes(reply) for reply in replies)
+    batch = np.frombuffer(replies, dtype=np.uint8)
+    return batch[:len(batch) - len(batch) % length].reshape(-1, length)
+
+
+def parse_ascii_fields(batch, starts, ends):
+    """
+    @fn parse_ascii_fields
+    @brief It converts the ASCII decimal numbers found between starts and ends, as float() does.
+    The common syntax ([+-]digits[.digits], padded with spaces on either side) is converted in one NumPy pass,
+    the few other fields (e.g. with an exponent) are passed to float().
+    @param batch the (N, length) uint8 array
+    @param starts (N, K) or (K,) index of the first character of each field
+    @param ends (N, K) or (K,) index one past the last character of each field
+    @return (N, K) float64 array, NaN where the field is not a number
+    """
+    n_rows = batch.shape[0]
+    starts = np.broadcast_to(starts, (n_rows, np.shape(starts)[-1]))
+    ends = np.broadcast_to(ends, starts.shape)
+    width = max(int((ends - starts).max(initial=0)), 1)
+
+    # (N, K, width) characters of each field, padded with a marker outside the field
+    index = starts[..., None] + np.arange(width)
+    inside = index < ends[..., None]
+    chars = np.take_along_axis(batch, np.minimum(index, batch.shape[1] - 1).reshape(n_rows, -1), axis=1)
+    chars = np.where(inside, chars.reshape(index.shape), 0).astype(np.int64)
+
+    # the spaces before and after the number are padding, as for float()
+    content = inside & (chars != _SPACE)
+    position = np.arange(width)
+    first = content.argmax(axis=-1)
+    last = width - 1 - content[..., ::-1].argmax(axis=-1)
+    inner = (position >= first[..., None]) & (position <= last[..., None])
+
+    digits = (chars >= _DIGIT_0) & (chars <= _DIGIT_0 + 9)
+    dots = chars == _DOT
+    signs = (chars == _MINUS) | (chars == _PLUS)
+
+    valid = (digits | dots | (signs & (position == first[..., None])) | ~content).all(axis=-1)
+    valid &= (content | ~inner).all(axis=-1)  # no space inside the number
+    valid &= dots.sum(axis=-1) <= 1
+    valid &= digits.any(axis=-1) & (digits.sum(axis=-1) <= 18)  # the mantissa fits in an int64
+
+    # the value is mantissa / 10**fraction_digits, as exact as float()
+    dot_position = np.where(dots.any(axis=-1), dots.argmax(axis=-1), width)
+    fraction_digits = (digits & (position > dot_position[..., None])).sum(axis=-1)
+    rank = np.cumsum(digits[..., ::-1], axis=-1)[..., ::-1] - 1
+    mantissa = np.where(digits, (chars - _DIGIT_0) * 10 ** np.maximum(rank, 0), 0).sum(axis=-1)
+
+    values = mantissa / 10.0 ** fraction_digits
+    negative = np.take_along_axis(chars, first[..., None], axis=-1)[..., 0] == _MINUS
+    values = np.where(negative, -values, values)
+    values = np.where(valid, values, np.nan)
+
+    for row, field in zip(*np.nonzero(~valid & content.any(axis=-1))):
+        values[row, field] = _parse_float(batch[row, starts[row, field]:ends[row, field]])
+    return values
+
+
+def _parse_float(field):
+    """
+    @return float() of the ASCII field, NaN if it is not a number
+    """
+    try:
+        return float(bytes(field).decode('ascii'))
+    except (ValueError, UnicodeDecodeError):
+        return np.nan
+
+
+def parse_quaternions(replies, length=QUATERNION_LENGTH):
+    """
+    @fn parse_quaternions
+    @brief It parses a batch of quaternion replies, W<7 chars>X<7 chars>Y<7 chars>Z<7 chars>
+    @param replies the replies, see as_batch
+    @param length the length of each reply
+    @return (N, 4) float64 array with w, x, y, z, NaN rows for the replies not recognised
+    """
+    batch = as_batch(replies, length)
+    offsets = np.arange(len(QUATERNION_MARKERS)) * QUATERNION_FIELD_WIDTH
+
+    values = parse_ascii_fields(batch, offsets + 1, offsets + QUATERNION_FIELD_WIDTH)
+    markers = (batch[:, offsets] == np.frombuffer(QUATERNION_MARKERS, dtype=np.uint8)).all(axis=1)
+    values[~markers] = np.nan
+    return values
+
+
+def parse_accelerometer(replies, length):
+    """
+    @fn parse_accelerometer
+    @brief It parses a batch of accelerometer replies, ..X<chars>Y<chars>Z<chars><acc_end_digit>..
+    The fields can have any width, the markers are searched in each reply.
+    @param replies the replies, see as_batch
+    @param length the length of each reply
+    @return (N, 3) float64 array with x, y, z, NaN rows for the replies not recognised
+    """
+    batch = as_batch(replies, length)
+    columns = np.arange(batch.shape[1])
+
+    positions = np.stack([(batch == marker).argmax(axis=1) for marker in ACCELEROMETER_MARKERS], axis=1)
+    found = np.stack([(batch == marker).any(axis=1) for marker in ACCELEROMETER_MARKERS], axis=1).all(axis=1)
+
+    after_z = (batch == al.acc_end_digit) & (columns > positions[:, 2:3])
+    end = after_z.argmax(axis=1)
+    found &= after_z.any(axis=1)
+    found &= (positions[:, 0] < positions[:, 1]) & (positions[:, 1] < positions[:, 2])
+
+    starts = positions + 1
+    ends = np.concatenate([positions[:, 1:], end[:, None]], axis=1)
+    values = parse_ascii_fields(batch, starts, np.maximum(ends, starts))
+    values[~found] = np.nan
+    return values
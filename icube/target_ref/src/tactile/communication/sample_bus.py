@@ -0,0 +1,233 @@
+#! /usr/bin/python
+
+import collections
+import threading
+
+from icube.target_ref.src.tactile.common import instrumentation
+from icube.target_ref.src.tactile.common import tactile_logging as log
+
+
+class Sample(collections.namedtuple("Sample", ["cube", "timestamp", "quaternions", "touches", "accelerometer"])):
+    """
+    @class Sample
+    An immutable sample of a device, shared by all the subscribers of a SampleBus
+    cube: the name of the device publishing it
+    timestamp: time.perf_counter_ns when the sample arrived
+    quaternions: (w, x, y, z), empty if missing
+    touches: TouchFrame, (faces, TouchFrame) for the iCube V4, None if missing
+    accelerometer: (x, y, z), empty if missing
+    """
+    __slots__ = ()
+
+
+class SampleBus:
+    """
+    @class SampleBus
+    A publish/subscribe ring of the samples of one or more devices.
+    The interfaces publish each sample once in a ring of fixed size, each subscriber reads it from its own cursor:
+    the samples are never copied and publishing costs the same whatever the number of subscribers. A subscriber
+    slower than the publishers loses the oldest samples it has not read yet, the lost samples are counted in the
+    "bus:<subscriber name>" metrics and logged. A lossless subscriber (e.g. the recording) never loses a sample:
+    the publishers wait for it when it is a whole ring behind.
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        @param capacity the number of samples kept in the ring, the max backlog of a subscriber
+        """
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        self.published = 0  # number of samples published since the creation of the bus
+        self.condition = threading.Condition()
+        self.subscriptions = []
+        self.lossless = []  # the lossless subscriptions, the publishers wait for them
+
+    def publish(self, cube, timestamp, quaternions, touches, accelerometer):
+        """
+        @fn publish
+        @brief It publishes a sample, the publisher must not modify touches afterwards
+        @return the Sample
+        """
+        sample = Sample(cube, timestamp, tuple(quaternions), touches, tuple(accelerometer))
+        with self.condition:
+            if self.lossless:
+                self.condition.wait_for(self.__has_room)
+            self.ring[self.published % self.capacity] = sample
+            self.published += 1
+            self.condition.notify_all()
+        return sample
+
+    def __has_room(self):
+        # called holding the lock: publishing does not overwrite a sample a lossless subscriber has not read
+        return all(self.published - subscription.cursor < self.capacity for subscription in self.lossless)
+
+    def subscribe(self, name, cube=None, lossless=False):
+        """
+        @fn subscribe
+        @brief It creates a subscription starting from the next published sample
+        @param name the name of the subscriber, used for its metrics
+        @param cube the name of the device to receive the samples of, None for all of them
+        @param lossless True if the publishers have to wait for the subscriber instead of overwriting the samples
+        it has not read yet
+        @return the Subscription, read it with poll() or wait()
+        """
+        subscription = Subscription(self, name, cube, lossless)
+        with self.condition:
+            self.subscriptions.append(subscription)
+            if lossless:
+                self.lossless.append(subscription)
+        return subscription
+
+    def attach(self, callback, name, cube=None, lossless=False):
+        """
+        @fn attach
+        @brief It calls the callback for each sample, in a thread of the subscriber
+        @param callback called as callback(quaternions, touches, accelerometer, timestamp=timestamp)
+        @param name the name of the subscriber, used for its thread and its metrics
+        @param cube the name of the device to receive the samples of, None for all of them
+        @param lossless True if the publishers have to wait for the subscriber, see subscribe
+        @return the Subscription, close() it to stop the thread
+        """
+        subscription = self.subscribe(name, cube, lossless)
+        subscription.start(callback)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.condition:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+            if subscription in self.lossless:
+                self.lossless.remove(subscription)
+                self.condition.notify_all()
+
+    def close(self):
+        """
+        @fn close
+        @brief It stops all the subscribers, the threads deliver the samples already published first
+        """
+        with self.condition:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.close()
+
+
+class Subscription:
+    """
+    @class Subscription
+    The cursor of a subscriber on a SampleBus
+    """
+
+    def __init__(self, bus, name, cube=None, lossless=False):
+        self.bus = bus
+        self.name = name
+        self.cube = cube
+        self.lossless = lossless
+        self.cursor = bus.published
+        self.delivered = self.cursor  # the samples before it have been passed to the callback of the thread
+        self.closed = False
+        self.worker_thread = None
+        self.metrics = instrumentation.metrics("bus:" + name)
+
+    @property
+    def backlog(self):
+        """
+        The number of samples published and not read yet, of any device
+        """
+        return min(self.bus.published - self.cursor, self.bus.capacity)
+
+    def poll(self, max_samples=None):
+        """
+        @fn poll
+        @brief It reads the samples published since the last read, without waiting
+        @param max_samples max number of samples to return, None for all of them
+        @return the list of the Sample, oldest first
+        """
+        with self.bus.condition:
+            return self.__take(max_samples)
+
+    def wait(self, timeout=None, max_samples=None):
+        """
+        @fn wait
+        @brief It waits for new samples and reads them
+        @param timeout max time waiting in seconds, None to wait until a sample is published or the subscription
+        is closed
+        @param max_samples max number of samples to return, None for all of them
+        @return the list of the Sample, empty if none arrived before the timeout
+        """
+        with self.bus.condition:
+            self.bus.condition.wait_for(lambda: self.bus.published > self.cursor or self.closed, timeout)
+            return self.__take(max_samples)
+
+    def __take(self, max_samples):
+        # called holding the lock of the bus
+        bus = self.bus
+        available = bus.published - self.cursor
+        if available > bus.capacity:
+            # the publishers have overwritten the samples not read yet
+            self.metrics.count("overruns", available - bus.capacity)
+            log.warning("The %s subscriber of the sample bus lost %d samples", self.name, available - bus.capacity)
+            self.cursor = bus.published - bus.capacity
+            available = bus.capacity
+        if max_samples is not None:
+            available = min(available, max_samples)
+
+        samples = [bus.ring[i % bus.capacity] for i in range(self.cursor, self.cursor + available)]
+        self.cursor += available
+        if self.lossless and available:
+            # the publishers may be waiting for room
+            bus.condition.notify_all()
+        if self.cube is not None:
+            samples = [sample for sample in samples if sample.cube == self.cube]
+        return samples
+
+    def start(self, callback):
+        """
+        @fn start
+        @brief It starts the thread calling the callback for each sample
+        @param callback called as callback(quaternions, touches, accelerometer, timestamp=timestamp)
+        """
+        self.worker_thread = threading.Thread(target=self.__deliver, args=(callback,), name="bus-" + self.name,
+                                              daemon=True)
+        self.worker_thread.start()
+
+    def __deliver(self, callback):
+        while True:
+            samples = self.wait()
+            for sample in samples:
+                try:
+                    callback(sample.quaternions, sample.touches, sample.accelerometer, timestamp=sample.timestamp)
+                except Exception as e:
+                    log.exception(str(e) + ' ' + log.get_debug_info())
+            self.metrics.count("samples", len(samples))
+            with self.bus.condition:
+                self.delivered = self.cursor
+                self.bus.condition.notify_all()
+            if self.closed and not self.backlog:
+                return
+
+    def flush(self, timeout=None):
+        """
+        @fn flush
+        @brief It waits for the thread to pass to the callback all the samples published so far
+        @param timeout max time waiting in seconds, None to wait until they are delivered
+        @return True if they were delivered, False on timeout or if the thread is not running
+        """
+        with self.bus.condition:
+            target = self.bus.published
+            if self.worker_thread is None or not self.worker_thread.is_alive():
+                return self.delivered >= target
+            if self.worker_thread is threading.current_thread():
+                return False
+            return self.bus.condition.wait_for(lambda: self.delivered >= target, timeout)
+
+    def close(self):
+        """
+        @fn close
+        @brief It stops the subscription, the thread delivers the samples already published first
+        """
+        with self.bus.condition:
+            self.closed = True
+            self.bus.condition.notify_all()
+        if self.worker_thread is not None and self.worker_thread is not threading.current_thread():
+            self.worker_thread.join()
+        self.bus.unsubscribe(self)
@@ -3,9 +3,127 @@
 import serial
 import serial.tools.list_ports
 import binascii
+import collections
+import threading
+import time
 
 from icube.target_ref.src.tactile.common import utilities as utils
 from icube.target_ref.src.tactile.common import tactile_logging as log
+from icube.target_ref.src.tactile.common.instrumentation import Stage
+
+
+class RingBuffer:
+    """
+    @class RingBuffer
+    Fixed size byte buffer filled by the serial reader thread.
+    The storage is allocated once, when the buffer is full the oldest bytes are overwritten.
+    Each write is kept as a chunk with its arrival time, so the reader can tell when a given byte arrived.
+    It is not thread safe, the owner has to guard it with its own lock.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.head = 0  # position of the oldest byte
+        self.size = 0
+        self.overwritten = 0  # number of bytes lost because the consumer was too slow
+        self.chunks = collections.deque()  # [bytes left, arrival time] of each write, oldest first
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.buffer[(self.head + index) % self.capacity]
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+        self.chunks.clear()
+
+    def write(self, data, arrival_ns=0):
+        """
+        @function write
+        Appends the bytes at the end of the buffer, overwriting the oldest ones if there is no room left.
+        @param data the bytes to append
+        @param arrival_ns when the bytes were received (time.perf_counter_ns)
+        """
+        length = len(data)
+        if length == 0:
+            return
+        if length >= self.capacity:
+            self.overwritten += self.size + length - self.capacity
+            data = data[-self.capacity:]
+            length = self.capacity
+            self.clear()
+
+        overflow = self.size + length - self.capacity
+        if overflow > 0:
+            self.drop(overflow)
+            self.overwritten += overflow
+
+        tail = (self.head + self.size) % self.capacity
+        first = min(length, self.capacity - tail)
+        self.buffer[tail:tail + first] = data[:first]
+        if first < length:
+            self.buffer[0:length - first] = data[first:]
+        self.size += length
+        self.chunks.append([length, arrival_ns])
+
+    def drop(self, num_bytes):
+        """
+        @function drop
+        Discards the oldest bytes
+        @param num_bytes how many bytes to discard
+        """
+        num_bytes = min(num_bytes, self.size)
+        self.head = (self.head + num_bytes) % self.capacity
+        self.size -= num_bytes
+
+        chunks = self.chunks
+        while num_bytes > 0:
+            if chunks[0][0] > num_bytes:
+                chunks[0][0] -= num_bytes
+                break
+            num_bytes -= chunks.popleft()[0]
+
+    def read(self, num_bytes):
+        """
+        @function read
+        Removes the oldest bytes from the buffer and returns them.
+        @param num_bytes how many bytes to read
+        @return the bytes read
+        """
+        num_bytes = min(num_bytes, self.size)
+        first = min(num_bytes, self.capacity - self.head)
+        out = bytes(self.buffer[self.head:self.head + first])
+        if first < num_bytes:
+            out += bytes(self.buffer[0:num_bytes - first])
+        self.drop(num_bytes)
+        return out
+
+    def read_chunk(self):
+        """
+        @function read_chunk
+        Removes the oldest chunk, i.e. what is left of the oldest write, from the buffer.
+        @return (bytes, arrival_ns) of the chunk, (b'', 0) if the buffer is empty
+        """
+        if not self.chunks:
+            return b'', 0
+        num_bytes, arrival_ns = self.chunks[0]
+        return self.read(num_bytes), arrival_ns
+
+    def find(self, value, start=0):
+        """
+        @function find
+        Looks for a byte value in the buffer
+        @param value the byte to look for
+        @param start the offset, from the oldest byte, where to start looking
+        @return the offset of the byte, -1 if not found
+        """
+        for i in range(start, self.size):
+            if self.buffer[(self.head + i) % self.capacity] == value:
+                return i
+        return -1
 
 
 class SerialComm:
@@ -13,9 +131,35 @@ class SerialComm:
     @class SerialComm
     Class which deals with the communications with a standard serial port..
     Il it essentially a wrapper to pyserial
+    It can work in two ways:
+    * polling: the caller checks the port for new bytes (read_from, read_binary_from)
+    * reader mode: a thread blocks on the port and pushes the bytes into a ring buffer,
+      the callers wait on a condition variable until their reply is there (wait_bytes, wait_frame)
+    The framed replies are extracted by a FrameDecoder in both cases.
     """
     ser = None
 
+    def __init__(self, buffer_size=4096):
+        self.ring = RingBuffer(buffer_size)
+        self.ring_condition = threading.Condition()
+        self.reader_thread = None
+        self.reader_running = False
+        # time.perf_counter_ns when the last bytes were read from the port
+        self.last_arrival_ns = 0
+        # the Metrics of the device, the writes are recorded in it when set
+        self.metrics = None
+
+    @property
+    def port_name(self):
+        """
+        The name of the serial port, None if it is not configured
+        """
+        return self.ser.port if self.ser is not None else None
+
+    @property
+    def is_reading(self):
+        return self.reader_running
+
     def configure_serial_port(self, serial_port=""):
         """
         @function configureSerialPort
@@ -70,6 +214,15 @@ class SerialComm:
             return False
         return True
 
+    def attach_serial(self, ser):
+        """
+        @function attach_serial
+        It uses an already open port instead of looking for one, e.g. the host side of a PtySerialPair
+        @param ser the serial.Serial to use
+        """
+        self.stop_reader()
+        self.ser = ser
+
     def open_comm(self):
         """
         @function openComm
@@ -114,6 +267,7 @@ class SerialComm:
         @return
         """
         try:
+            self.stop_reader()
             if self.ser is not None:
                 self.ser.close()
 
@@ -131,7 +285,10 @@ class SerialComm:
         """
         try:
             if self.ser is not None:
+                t_start = time.perf_counter_ns()
                 self.ser.write(serial.to_bytes(message))
+                if self.metrics is not None:
+                    self.metrics.record(Stage.write, time.perf_counter_ns() - t_start)
         except Exception as e:
             print(utils.get_exception_message(e))
             log.exception(str(e) + ' ' + log.get_debug_info())
@@ -144,10 +301,15 @@ class SerialComm:
         @return the message just read.
         """
         try:
+            if self.reader_running:
+                read_byte = self.__read_ring(num_bytes)
+                return binascii.hexlify(read_byte).decode('utf-8') if read_byte else None
+
             if self.ser is not None:
                 out = ''
                 while self.ser.in_waiting > 0:
                     read_byte = self.ser.read(num_bytes)
+                    self.last_arrival_ns = time.perf_counter_ns()
                     read_string = binascii.hexlify(read_byte).decode('utf-8')
                     out += read_string
                     if len(read_byte) == num_bytes:
@@ -170,10 +332,14 @@ class SerialComm:
         @return the message just read.
         """
         try:
+            if self.reader_running:
+                return self.__read_ring(num_bytes) or None
+
             if self.ser is not None:
                 read_byte = None
                 while self.ser.in_waiting > 0:
                     read_byte = self.ser.read(num_bytes)
+                    self.last_arrival_ns = time.perf_counter_ns()
                     if len(read_byte) == num_bytes:
                         break
                 return read_byte
@@ -193,6 +359,185 @@ class SerialComm:
                 self.ser.reset_input_buffer()
                 self.ser.reset_output_buffer()
 
+            with self.ring_condition:
+                self.ring.clear()
+
+        except Exception as e:
+            print(utils.get_exception_message(e))
+            log.exception(str(e) + ' ' + log.get_debug_info())
+
+    def start_reader(self):
+        """
+        @function start_reader
+        It starts the reader thread, from now on the bytes coming from the device are stored in the ring buffer
+        @return True if the thread is running
+        """
+        try:
+            if self.ser is None:
+                return False
+            if self.reader_running:
+                return True
+
+            with self.ring_condition:
+                self.ring.clear()
+
+            self.reader_running = True
+            self.reader_thread = threading.Thread(target=self.__reader, name=f"serial-reader-{self.ser.name}",
+                                                  daemon=True)
+            self.reader_thread.start()
+            return True
+
+        except Exception as e:
+            print(utils.get_exception_message(e))
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            self.reader_running = False
+            return False
+
+    def stop_reader(self):
+        """
+        @function stop_reader
+        It stops the reader thread and goes back to polling
+        """
+        self.reader_running = False
+        if self.reader_thread is not None and self.reader_thread is not threading.current_thread():
+            self.reader_thread.join()
+        self.reader_thread = None
+        with self.ring_condition:
+            self.ring_condition.notify_all()
+
+    def __reader(self):
+        """
+        @function __reader
+        Body of the reader thread: it blocks on the serial port (up to the port timeout) and moves the received
+        bytes into the ring buffer, waking up whoever is waiting for a reply
+        """
+        while self.reader_running:
+            try:
+                read_bytes = self.ser.read(1)
+                if not read_bytes:
+                    continue
+                waiting = self.ser.in_waiting
+                if waiting > 0:
+                    read_bytes += self.ser.read(waiting)
+                arrival_ns = time.perf_counter_ns()
+
+                with self.ring_condition:
+                    self.last_arrival_ns = arrival_ns
+                    self.ring.write(read_bytes, arrival_ns)
+                    self.ring_condition.notify_all()
+
+            except Exception as e:
+                if self.reader_running and self.ser.is_open:
+                    print(utils.get_exception_message(e))
+                    log.exception(str(e) + ' ' + log.get_debug_info())
+                self.reader_running = False
+
+        with self.ring_condition:
+            self.ring_condition.notify_all()
+
+    def __read_ring(self, num_bytes):
+        with self.ring_condition:
+            return self.ring.read(num_bytes)
+
+    def wait_bytes(self, num_bytes=1, timeout=0.4):
+        """
+        @function wait_bytes
+        Blocks until num_bytes are available in the ring buffer (reader mode only)
+        @param num_bytes the number of bytes to wait for
+        @param timeout max time waiting
+        @return the bytes read, None if the timeout expired
+        """
+        t_end = time.monotonic() + timeout
+        with self.ring_condition:
+            while len(self.ring) < num_bytes:
+                remaining = t_end - time.monotonic()
+                if remaining <= 0 or not self.reader_running:
+                    return None
+                self.ring_condition.wait(remaining)
+            return self.ring.read(num_bytes)
+
+    def wait_frame(self, decoder, timeout=0.4, stamped=False):
+        """
+        @function wait_frame
+        Blocks until the decoder gets a complete frame from the bytes in the ring buffer (reader mode only).
+        The bytes in the ring buffer are moved into the decoder one chunk at a time, up to the chunk that completes
+        the first frame: the frames after the first one stay in the decoder, the rest of the chunks in the ring.
+        @param decoder the FrameDecoder of the expected reply
+        @param timeout max time waiting
+        @param stamped if True the arrival time of the frame is returned too
+        @return the frame (a memoryview valid until the next use of the decoder), or (frame, arrival_ns) if stamped,
+        arrival_ns being the time.perf_counter_ns when the last byte of the frame was read from the port.
+        None if the timeout expired
+        """
+        t_end = time.monotonic() + timeout
+        with self.ring_condition:
+            while True:
+                # the frames already in the decoder were completed by the last chunk fed to it
+                frame = next(decoder.frames(), None)
+                while frame is None and len(self.ring) > 0:
+                    chunk, decoder.arrival_ns = self.ring.read_chunk()
+                    frame = next(decoder.feed(chunk), None)
+                if frame is not None:
+                    return (frame, decoder.arrival_ns) if stamped else frame
+
+                remaining = t_end - time.monotonic()
+                if remaining <= 0 or not self.reader_running:
+                    return None
+                self.ring_condition.wait(remaining)
+
+    def wait_available(self, timeout=0.1):
+        """
+        @function wait_available
+        Blocks until some bytes are received, then reads all the bytes received so far
+        @param timeout max time waiting
+        @return the bytes read, empty if nothing arrived before the timeout
+        """
+        try:
+            if self.reader_running:
+                with self.ring_condition:
+                    if len(self.ring) == 0:
+                        self.ring_condition.wait(timeout)
+                    return self.ring.read(len(self.ring))
+
+            if self.ser is not None:
+                port_timeout = self.ser.timeout
+                self.ser.timeout = timeout
+                try:
+                    received = self.ser.read(1)
+                finally:
+                    self.ser.timeout = port_timeout
+                if received and self.ser.in_waiting > 0:
+                    received += self.ser.read(self.ser.in_waiting)
+                if received:
+                    self.last_arrival_ns = time.perf_counter_ns()
+                return received
+            return b''
+
+        except Exception as e:
+            print(utils.get_exception_message(e))
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            return b''
+
+    def read_available(self):
+        """
+        @function read_available
+        Reads all the bytes received so far, without waiting
+        @return the bytes read, empty if there is nothing
+        """
+        try:
+            if self.reader_running:
+                with self.ring_condition:
+                    return self.ring.read(len(self.ring))
+
+            if self.ser is not None:
+                waiting = self.ser.in_waiting
+                if waiting > 0:
+                    received = self.ser.read(waiting)
+                    self.last_arrival_ns = time.perf_counter_ns()
+                    return received
+            return b''
+
         except Exception as e:
             print(utils.get_exception_message(e))
             log.exception(str(e) + ' ' + log.get_debug_info())
+            return b''
@@ -1,12 +1,31 @@
-import codecs
+import binascii
+import enum
 import time
 
+import numpy as np
+
+from icube.target_ref.src.device_commands import ReplyType
+from icube.target_ref.src.tactile.common import instrumentation
 from icube.target_ref.src.tactile.common import tactile_logging as log
 from icube.target_ref.src.tactile.common import utilities as utils
-from icube.target_ref.src.tactile.common.constants import Acceleration_limits as al
+from icube.target_ref.src.tactile.common.instrumentation import Stage
+from icube.target_ref.src.tactile.communication import reply_parser
+from icube.target_ref.src.tactile.communication.command_executor import CommandExecutor
+from icube.target_ref.src.tactile.communication.handshake import Handshake
 from icube.target_ref.src.tactile.communication.serial_comm import SerialComm
 
 
+class DeviceStatus(enum.Enum):
+    NOT_STARTED = 0,
+    READY = 1,  # connected, battery and firmware checked
+    PORT_ERROR = 2,  # the serial port cannot be opened
+    NOT_CONNECTED = 3,  # the port is open but the device does not answer the ping
+    LOW_BATTERY = 4,
+    WRONG_FIRMWARE = 5,
+    TIMEOUT = 6,  # the start up did not complete before the deadline
+    FAILED = 7
+
+
 class TactileDevice:
 
     def __init__(self):
@@ -16,47 +35,110 @@ class TactileDevice:
         """
         self.device_name = ''
         self.device_online = True
+        self.status = DeviceStatus.NOT_STARTED
         self.serial_communication = SerialComm()
+        # request / reply exchanges of the start up, with backoff and the reply times remembered for each port
+        self.handshake = Handshake(self.serial_communication)
+        # runs the commands of all the callers one at a time, see ICubeInterfaceV3
+        self.command_executor = CommandExecutor()
+        # decoders of the framed replies, by reply length
+        self.frame_decoders = {}
+        # counters and latencies of the device, see metrics
+        self.__metrics = None
         # define the process to communicate through yarp
         self.yarp_connection = None
 
-    def start_up(self, device_name, serial_port=""):
+    def start_up(self, device_name, serial_port="", timeout=10):
         """
         The method starts up the device. It initialises it and returns true if the initialisation was successful.
+        The outcome is also stored in self.status.
         @param device_name the name of the device. used for printing useful information
+        @param timeout max time waiting for the reply to the ping
         @return True if successful
         """
         try:
             self.device_name = device_name
+            self.serial_communication.metrics = self.metrics
 
             log.info(f"Opening the communication with the {self.device_name} ... ")
 
             if not self.open_communication(serial_port):
+                self.status = DeviceStatus.PORT_ERROR
                 return False
 
             self.serial_communication.empty_serial()
 
             log.info(f"The communication was open, trying to connect to the {self.device_name} ... ")
-            if not self.is_device_connected():
+            if not self.is_device_connected(timeout=timeout):
                 log.info(f"It seems the {self.device_name} is not connected. Check that the {self.device_name} "
                          f"is turned on and fully charged.")
                 self.device_online = False
+                self.status = DeviceStatus.NOT_CONNECTED
 
             else:  # the device is connected and ready to start
                 log.info(f"The {self.device_name} is connected and ready to start.")
 
             if self.device_online:
                 if not self.check_battery():
+                    self.status = DeviceStatus.LOW_BATTERY
                     return False
 
                 if not self.check_firmware():
+                    self.status = DeviceStatus.WRONG_FIRMWARE
                     return False
 
+                self.status = DeviceStatus.READY
+
             return True
 
         except Exception as e:
             print(utils.get_exception_message(e))
             log.exception(str(e) + ' ' + log.get_debug_info())
+            self.status = DeviceStatus.FAILED
+
+    @property
+    def metrics(self):
+        """
+        The Metrics of the device in the shared instrumentation, named after the device
+        """
+        name = self.device_name or "device"
+        if self.__metrics is None or self.__metrics.name != name:
+            self.__metrics = instrumentation.metrics(name)
+            self.serial_communication.metrics = self.__metrics
+        return self.__metrics
+
+    def _record_wait(self, t_start, reply):
+        """
+        It records the time waited for a reply, since t_start (time.perf_counter_ns), and counts the timeouts
+        @param reply the reply, None or empty if it did not arrive
+        @return the reply
+        """
+        metrics = self.metrics
+        metrics.record(Stage.wait_reply, time.perf_counter_ns() - t_start)
+        if not reply:
+            metrics.count("reply_timeouts")
+        return reply
+
+    def reconnect(self, timeout=2):
+        """
+        The method checks the connection again on the port already configured, e.g. after the battery of the
+        device was replaced. The port is opened again if it was closed.
+        @param timeout max time waiting for the reply to the ping
+        @return True if the device is connected
+        """
+        try:
+            ser = self.serial_communication.ser
+            if ser is not None and not ser.is_open:
+                self.serial_communication.open_comm()
+
+            self.device_online = self.is_device_connected(timeout=timeout)
+            self.status = DeviceStatus.READY if self.device_online else DeviceStatus.NOT_CONNECTED
+            return self.device_online
+
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            self.status = DeviceStatus.FAILED
+            return False
 
     def open_communication(self, serial_port=""):
         """
@@ -81,6 +163,82 @@ class TactileDevice:
             log.exception(str(e) + ' ' + log.get_debug_info())
             return False
 
+    def start_reader(self):
+        """
+        @fn start_reader
+        @brief It moves the serial communication to reader mode: a dedicated thread receives the bytes and the
+        get_* methods block until their reply is there, instead of polling the port.
+        @return True if the reader is running
+        """
+        return self.serial_communication.start_reader()
+
+    def stop_reader(self):
+        """
+        @fn stop_reader
+        @brief It moves the serial communication back to polling.
+        """
+        self.serial_communication.stop_reader()
+
+    def frame_decoder(self, length=None):
+        """
+        The method returns the decoder of the framed replies of the given length
+        @param length the length of the reply, None for variable length replies
+        @return the FrameDecoder
+        """
+        decoder = self.frame_decoders.get(length)
+        if decoder is None:
+            decoder = self.cmd.frame_decoder(length)
+            self.frame_decoders[length] = decoder
+        return decoder
+
+    def _read_frame(self, decoder, timeout=0.4):
+        """
+        The method waits for the next frame of a framed reply. The bytes are passed to the decoder as they come,
+        so a reply split among several reads is not lost.
+        @param decoder the FrameDecoder of the expected reply
+        @param timeout the waiting time for the reply.
+        @return the frame (a memoryview valid until the next read), None if nothing arrived before the timeout
+        """
+        if self.serial_communication.is_reading:
+            return self.serial_communication.wait_frame(decoder, timeout)
+
+        frame = next(decoder.frames(), None)
+        t_end = time.time() + timeout
+        while frame is None and time.time() < t_end:
+            time.sleep(0.01)
+            frame = next(decoder.feed(self.serial_communication.read_available()), None)
+        return frame
+
+    def _read_reply(self, num_bytes, timeout=0.4, framed=False):
+        """
+        The method waits for the reply of the device
+        @param num_bytes the length of the reply
+        @param timeout the waiting time for the reply.
+        @param framed True if the reply starts with start_reply and ends with stop_reply
+        @return the bytes of the reply, None if nothing arrived before the timeout
+        """
+        t_start = time.perf_counter_ns()
+        return self._record_wait(t_start, self.__wait_reply(num_bytes, timeout, framed))
+
+    def __wait_reply(self, num_bytes, timeout, framed):
+        if framed:
+            decoder = self.frame_decoder(num_bytes)
+            # the serial has just been emptied, what is left in the decoder belongs to old replies
+            decoder.reset()
+            return self._read_frame(decoder, timeout)
+
+        if self.serial_communication.is_reading:
+            return self.serial_communication.wait_bytes(num_bytes, timeout)
+
+        reply = None
+        t_end = time.time() + timeout
+        while time.time() < t_end:
+            time.sleep(0.01)
+            reply = self.serial_communication.read_binary_from(num_bytes=num_bytes)
+            if reply:
+                break
+        return reply
+
     def is_device_connected(self, timeout=10):
         """
         @fn is_device_connected
@@ -98,7 +256,9 @@ class TactileDevice:
 
     def send_ping_message(self, ping_message, length_reply_ping, cmd_reply_ping, timeout=10):
         """
-        The method sends the ping message to the serial port and waits for the reply
+        The method sends the ping message to the serial port and waits for the reply.
+        The ping is sent again, with an exponential backoff, until the device answers: there is no need to wait
+        for the device to boot after the port was opened.
         @param ping_message the ping message to send
         @param length_reply_ping the length of the reply to the ping message
         @param cmd_reply_ping the command which identifies the reply to the ping.
@@ -106,32 +266,18 @@ class TactileDevice:
         @return True is successfully connected, False otherwise.
         """
         try:
-            time.sleep(2)
-            timer_start = time.time()
-            time_passed = 0
-
-            while time_passed < timeout:
-
-                self.serial_communication.empty_serial()
-                time_passed = time.time() - timer_start
-                self.serial_communication.write_to(ping_message)
-                time.sleep(0.1)
-                output = self.serial_communication.read_from(num_bytes=length_reply_ping)
-                # output = self.serial_communication.read_from(num_bytes=64)
+            try:
+                hex_value = format(cmd_reply_ping, 'x')  # this converts to hexadecimal string without the 0x prefix.
+            except ValueError:
+                # It would be an ASCII value
+                hex_value = cmd_reply_ping
 
-                if not output:
-                    continue
+            def match(output):
+                return True if hex_value in binascii.hexlify(output).decode('utf-8') else None
 
-                try:
-                    hex_value = format(cmd_reply_ping, 'x')  # this converts to hexadecimal string without the 0x prefix.
-                except ValueError:
-                    # It would be an ASCII value
-                    hex_value = cmd_reply_ping
-
-                print(f"is {hex_value} in {output}?")
-                if hex_value in output:
-                    log.info(f"{self.device_name} connected")
-                    return True
+            if self.handshake.exchange("ping", ping_message, match, timeout):
+                log.info(f"{self.device_name} connected")
+                return True
 
             log.info(f"{self.device_name} not found")
             return False
@@ -165,40 +311,31 @@ class TactileDevice:
         @return True if it is charged, False otherwise
         """
         try:
-            timer_start = time.time()
-            time_passed = 0
-
-            while time_passed < timeout:
+            dec_value = int(cmd_reply_battery)  # this converts to hexadecimal string without the 0x prefix.
 
-                self.serial_communication.empty_serial()
-                time_passed = time.time() - timer_start
-
-                self.serial_communication.write_to(battery_message)
-                time.sleep(0.1)
-                # output = self.serial_communication.read_from(num_bytes=cmd.msg_length.reply_battery)
-                battery_rx = self.serial_communication.read_binary_from(num_bytes=length_reply_battery)
-                if battery_rx is not None:
-                    battery_rx = list(battery_rx)
-                else:
-                    continue
+            def match(battery_rx):
+                if dec_value not in battery_rx or len(battery_rx) < 4:
+                    return None
+                try:
+                    return float(f"{chr(battery_rx[1])}.{chr(battery_rx[3])}")
+                except ValueError:
+                    # partial or noisy reply
+                    return None
 
-                dec_value = int(cmd_reply_battery)  # this converts to hexadecimal string without the 0x prefix.
-                if dec_value in battery_rx:
-                    xx = chr(battery_rx[1])
-                    yy = chr(battery_rx[3])
+            voltage = self.handshake.exchange("battery", battery_message, match, timeout)
+            if voltage is None:
+                log.info(f"{self.device_name} not found")
+                return False
 
-                    voltage = float(f"{xx}.{yy}")
-                    log.info(f"current battery voltage = {voltage}")
+            log.info(f"current battery voltage = {voltage}")
 
-                    if voltage > 3.1:
-                        log.info("battery ok")
-                        return True
-                    else:
-                        log.info("the battery needs to be charged")
-                        return False
+            if voltage > 3.1:
+                log.info("battery ok")
+                return True
+            else:
+                log.info("the battery needs to be charged")
+                return False
 
-            log.info(f"{self.device_name} not found")
-            return False
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
             return False
@@ -226,25 +363,19 @@ class TactileDevice:
         @return the version of the firmware we were asking for
         """
         try:
-            timer_start = time.time()
-            time_passed = 0
-
-            while time_passed < timeout:
-
-                self.serial_communication.empty_serial()
-                time_passed = time.time() - timer_start
-
-                self.serial_communication.write_to(firmware_message)
-                time.sleep(0.1)
-                firmware_version = self.serial_communication.read_binary_from(num_bytes=length_reply_firmware)
-                if firmware_version is not None:
-                    firmware_version = list(firmware_version)
-                else:
-                    continue
-                return int(chr(firmware_version[1]))
+            def match(firmware_version):
+                if len(firmware_version) < 2:
+                    return None
+                try:
+                    return int(chr(firmware_version[1]))
+                except ValueError:
+                    # partial or noisy reply
+                    return None
 
-            log.info(f"{self.device_name} not found")
-            return None
+            firmware_version = self.handshake.exchange("firmware", firmware_message, match, timeout)
+            if firmware_version is None:
+                log.info(f"{self.device_name} not found")
+            return firmware_version
 
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
@@ -274,56 +405,32 @@ class TactileDevice:
         @return True if it is calibrated, false otherwise.
         """
         try:
-            timer_start = time.time()
-            time_passed = 0
-
-            while time_passed < timeout:
-
-                self.serial_communication.empty_serial()
-                time_passed = time.time() - timer_start
-
-                self.serial_communication.write_to(calibration_message)
-                time.sleep(0.1)
-                calibration_output = self.serial_communication.read_binary_from(
-                    num_bytes=length_calibration_reply)
-                if calibration_output is not None:
-                    calibration_string = str(calibration_output)
-
-                    ## Extracting the value for the calibration
-                    temp = "Sys: "
-                    if temp in calibration_string:
-                        sys = calibration_string[calibration_string.find(temp) + len(temp)]
-                    else:
-                        continue
-                    temp = "Gyro: "
-                    if temp in calibration_string:
-                        gyro = calibration_string[calibration_string.find(temp) + len(temp)]
-                    else:
-                        continue
-                    temp = "Accel: "
-                    if temp in calibration_string:
-                        accel = calibration_string[calibration_string.find(temp) + len(temp)]
-                    else:
-                        continue
-                    temp = "Mag: "
-                    if temp in calibration_string:
-                        mag = calibration_string[calibration_string.find(temp) + len(temp)]
-                    else:
-                        continue
-
-                    calibration_output_list = list(calibration_output)
-                else:
-                    continue
-                calibration_value = calibration_output_list[10:].count(51)
-                calibrated = calibration_value == 3
-
-                output_values = f"sys = {sys}, gyro = {gyro}, accel = {accel}, mag = {mag}"
-                if calibrated:
-                    log.info(f"the {self.device_name} is calibrated, {output_values}")
-                else:
-                    log.info(f"the {self.device_name} is NOT calibrated, {output_values}")
-
-                return calibrated
+            def match(calibration_output):
+                calibration_string = str(calibration_output)
+
+                ## Extracting the value for the calibration
+                values = []
+                for temp in ("Sys: ", "Gyro: ", "Accel: ", "Mag: "):
+                    position = calibration_string.find(temp) + len(temp)
+                    if position < len(temp) or position >= len(calibration_string):
+                        return None
+                    values.append(calibration_string[position])
+
+                calibration_value = list(calibration_output)[10:].count(51)
+                return calibration_value == 3, values
+
+            reply = self.handshake.exchange("calibration", calibration_message, match, timeout)
+            if reply is None:
+                return None
+
+            calibrated, (sys, gyro, accel, mag) = reply
+            output_values = f"sys = {sys}, gyro = {gyro}, accel = {accel}, mag = {mag}"
+            if calibrated:
+                log.info(f"the {self.device_name} is calibrated, {output_values}")
+            else:
+                log.info(f"the {self.device_name} is NOT calibrated, {output_values}")
+
+            return calibrated
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
             return False
@@ -344,29 +451,34 @@ class TactileDevice:
         The method sends the message to receive the quaternion messages and reads
         @param read_bno_message the message to ask for the quaternions
         @param length_reply_quaternions the length of the reply message
-        @return The string received from teh serial port.
+        @return The bytes received from the serial port.
         """
         try:
             self.serial_communication.empty_serial()
             self.serial_communication.write_to(read_bno_message)
+            t_start = time.perf_counter_ns()
 
-            q_string = None
+            if self.serial_communication.is_reading:
+                q_bytes = self.serial_communication.wait_bytes(num_bytes=length_reply_quaternions, timeout=timeout)
+                return self._record_wait(t_start, q_bytes)
+
+            q_bytes = None
 
             t_end = time.time() + timeout
             while time.time() < t_end:
                 time.sleep(0.01)
-                q_string = self.serial_communication.read_from(num_bytes=length_reply_quaternions)
-                if q_string:
+                q_bytes = self.serial_communication.read_binary_from(num_bytes=length_reply_quaternions)
+                if q_bytes:
                     break
-            return q_string
+            return self._record_wait(t_start, q_bytes)
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
-            return ''
+            return b''
 
     def parse_quaternion_string(self, quaternion_string):
         """
         The method takes the quaternion message in input and parses teh message to retrieve the four quaternions
-        @param quaternion_string the string with embedded the quaternions
+        @param quaternion_string the bytes of the reply (or the same bytes as a hex string)
         @return the list with the quaternions.
         """
         try:
@@ -376,23 +488,18 @@ class TactileDevice:
             if quaternion_string == 'NOK':
                 return []
 
-            ascii_code = str(codecs.decode(quaternion_string, "hex"))
-
-            if ascii_code[2] == 'W' and \
-                ascii_code[10] == 'X' and \
-                ascii_code[18] == 'Y' and \
-                ascii_code[26] == 'Z':
-
-                w = float(ascii_code[3:10])
-                x = float(ascii_code[11:18])
-                y = float(ascii_code[19:26])
-                z = float(ascii_code[27:34])
+            if isinstance(quaternion_string, str):
+                quaternion_string = binascii.unhexlify(quaternion_string)
 
-                return [w, x, y, z]
-            else:
+            with self.metrics.time(Stage.parse):
+                quaternions = reply_parser.parse_quaternions(quaternion_string, length=len(quaternion_string))
+            if len(quaternions) == 0 or np.isnan(quaternions[0]).any():
                 print("missed 1!!")
+                self.metrics.count("parse_errors")
                 return []
 
+            return quaternions[0].tolist()
+
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
             return []
@@ -427,14 +534,7 @@ class TactileDevice:
         try:
             self.serial_communication.empty_serial()
             self.serial_communication.write_to(touch_message)
-            touch_message_bytes = None
-
-            t_end = time.time() + timeout
-            while time.time() < t_end:
-                time.sleep(0.01)
-                touch_message_bytes = self.serial_communication.read_binary_from(num_bytes=length_reply_mpx)
-                if touch_message_bytes:
-                    break
+            touch_message_bytes = self._read_reply(length_reply_mpx, timeout, framed=True)
 
             if not touch_message_bytes:
                 # print("NOK!")
@@ -474,14 +574,7 @@ class TactileDevice:
         try:
             self.serial_communication.empty_serial()
             self.serial_communication.write_to(ask_message)
-            accelerometer_message_bytes = None
-
-            t_end = time.time() + timeout
-            while time.time() < t_end:
-                time.sleep(0.01)
-                accelerometer_message_bytes = self.serial_communication.read_binary_from(num_bytes=length_reply_accel)
-                if accelerometer_message_bytes:
-                    break
+            accelerometer_message_bytes = self._read_reply(length_reply_accel, timeout, framed=True)
 
             if not accelerometer_message_bytes:
                 # print("NOK!")
@@ -500,6 +593,94 @@ class TactileDevice:
             log.exception(str(e) + ' ' + log.get_debug_info())
             return []
 
+    def sensor_requests(self):
+        """
+        The requests of the quaternions, the touches and the accelerometer values, to be written back to back.
+        The devices with a reply_demultiplexer override it.
+        @return the list of the three messages, None if the replies cannot be demultiplexed
+        """
+        return None
+
+    def read_all(self, timeout=0.4):
+        """
+        The method returns the quaternions, the touches and the accelerometer values of the device.
+        They are requested all at once and demultiplexed when the device has sensor_requests, one after the other
+        otherwise.
+        @param timeout the waiting time for all the replies (for each reply when requested one after the other).
+        @return quaternions, touches, accelerometer
+        """
+        requests = self.sensor_requests()
+        if requests is None:
+            return self.read_quaternions(timeout=timeout), self.read_touch(timeout=timeout), \
+                self.read_accelerometer(timeout=timeout)
+
+        try:
+            replies = self.read_pipelined(requests, self.reply_demultiplexer, len(requests), timeout)
+
+            return self.parse_reply(ReplyType.QUATERNIONS, replies.get(ReplyType.QUATERNIONS)), \
+                self.parse_reply(ReplyType.TOUCHES, replies.get(ReplyType.TOUCHES)), \
+                self.parse_reply(ReplyType.ACCELEROMETER, replies.get(ReplyType.ACCELEROMETER))
+
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            return [], None, None
+
+    def parse_reply(self, reply_type, reply):
+        """
+        The method parses a reply recognised by the reply demultiplexer
+        @param reply_type the ReplyType of the reply
+        @param reply the bytes of the reply, None if it was not received
+        @return the quaternions (empty list if missing), the touches or the accelerometer values (None if missing)
+        """
+        if reply_type == ReplyType.QUATERNIONS:
+            if reply is None:
+                return []
+            return self.parse_quaternion_string(reply)
+
+        if reply is None:
+            return None
+        if reply_type == ReplyType.TOUCHES:
+            return self.parse_touch_message(list(reply))
+        return self.parse_accelerometer_message(list(reply))
+
+    def read_pipelined(self, requests, demultiplexer, num_replies, timeout=0.4):
+        """
+        The method writes all the requests back to back and collects the replies as they come, whatever their order.
+        One sample costs a single serial round trip instead of one for each request.
+        @param requests the list of messages to send
+        @param demultiplexer the ReplyDemultiplexer which recognises the replies
+        @param num_replies the number of different replies expected
+        @param timeout the waiting time for all the replies.
+        @return dictionary {reply kind: reply bytes} with the replies received before the timeout
+        """
+        try:
+            self.serial_communication.empty_serial()
+            demultiplexer.reset()
+            self.serial_communication.write_to([byte for request in requests for byte in request])
+            t_start = time.perf_counter_ns()
+
+            replies = {}
+            t_end = time.time() + timeout
+            while len(replies) < num_replies:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    break
+                reply = self._read_frame(demultiplexer, remaining)
+                if reply is None:
+                    break
+                kind, frame = reply
+                replies[kind] = bytes(frame)
+
+            metrics = self.metrics
+            metrics.record(Stage.wait_reply, time.perf_counter_ns() - t_start)
+            if len(replies) < num_replies:
+                metrics.count("reply_timeouts", num_replies - len(replies))
+            return replies
+
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            return {}
+
     def parse_accelerometer_message(self, accelerometer_message):
         """
         The method takes in input the accelerometer message, it parses it and returns a list of the accelerometer values
@@ -508,32 +689,18 @@ class TactileDevice:
         @return the list with the accelerometer values
         """
         try:
-            accelerations = []
-
-            x_pos = accelerometer_message.index(al.acc_x_digit)
-            y_pos = accelerometer_message.index(al.acc_y_digit)
-            z_pos = accelerometer_message.index(al.acc_z_digit)
-            end_pos = accelerometer_message.index(al.acc_end_digit)
-
-            x_value = accelerometer_message[x_pos+1:y_pos]
-            y_value = accelerometer_message[y_pos+1:z_pos]
-            z_value = accelerometer_message[z_pos+1:end_pos]
-
-            x_value_str = ''.join(chr(i) for i in x_value)
-            y_value_str = ''.join(chr(i) for i in y_value)
-            z_value_str = ''.join(chr(i) for i in z_value)
-
-            try:
-                accelerations.append(float(x_value_str))
-                accelerations.append(float(y_value_str))
-                accelerations.append(float(z_value_str))
+            if not accelerometer_message:
+                return []
 
-            except ValueError as v:
-                print(utils.get_exception_message(v))
-                log.exception(str(v) + ' ' + log.get_debug_info())
+            with self.metrics.time(Stage.parse):
+                accelerations = reply_parser.parse_accelerometer(accelerometer_message,
+                                                                 length=len(accelerometer_message))
+            if len(accelerations) == 0 or np.isnan(accelerations[0]).any():
+                log.error("Cannot parse the accelerometer message %s", accelerometer_message)
+                self.metrics.count("parse_errors")
                 return []
 
-            return accelerations
+            return accelerations[0].tolist()
 
         except Exception as e:
             log.exception(str(e) + ' ' + log.get_debug_info())
@@ -592,14 +759,7 @@ class TactileDeviceV4(TactileDevice):
         try:
             self.serial_communication.empty_serial()
             self.serial_communication.write_to(touch_message)
-            touch_message_bytes = None
-
-            t_end = time.time() + timeout
-            while time.time() < t_end:
-                time.sleep(0.01)
-                touch_message_bytes = self.serial_communication.read_binary_from(num_bytes=length_reply_mpx)
-                if touch_message_bytes:
-                    break
+            touch_message_bytes = self._read_reply(length_reply_mpx, timeout, framed=True)
 
             if not touch_message_bytes:
                 return None
@@ -622,14 +782,7 @@ class TactileDeviceV4(TactileDevice):
         try:
             self.serial_communication.empty_serial()
             self.serial_communication.write_to(touch_message)
-            touch_message_bytes = None
-
-            t_end = time.time() + timeout
-            while time.time() < t_end:
-                time.sleep(0.01)
-                touch_message_bytes = self.serial_communication.read_binary_from(num_bytes=length_reply_mpx)  #length_reply_mpx)
-                if touch_message_bytes:
-                    break
+            touch_message_bytes = self._read_reply(length_reply_mpx, timeout)
 
             if not touch_message_bytes:
                 return None
@@ -641,6 +794,54 @@ class TactileDeviceV4(TactileDevice):
             log.exception(str(e) + ' ' + log.get_debug_info())
             return []
 
+    def get_touch_frames(self, touch_message, num_frames, timeout=0.4):
+        """
+        The method calls the serial to read the facets touches, when each facet is sent in its own frame.
+        @param touch_message the message to send to the serial to be able to read the touch message.
+        @param num_frames the number of frames of the reply, one for each facet
+        @param timeout the waiting time for the whole reply.
+        @return the list of frames, each one as a list of bytes with the start and stop bytes. None if the reply
+        was not complete before the timeout.
+        """
+        try:
+            decoder = self.frame_decoder()
+            self.serial_communication.empty_serial()
+            decoder.reset()
+            self.serial_communication.write_to(touch_message)
+            t_start = time.perf_counter_ns()
+
+            frames = []
+            t_end = time.time() + timeout
+            while len(frames) < num_frames:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    return self._record_wait(t_start, None)
+                frame = self._read_frame(decoder, remaining)
+                if frame is None:
+                    return self._record_wait(t_start, None)
+                frames.append(list(frame))
+            return self._record_wait(t_start, frames)
+
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            return None
+
+    def send_actuator_messages(self, messages):
+        """
+        The method sends several actuator messages (vibration, audio) with a single write, without waiting.
+        @param messages the list of messages to send, in order
+        @return True if they were written
+        """
+        try:
+            if not messages:
+                return True
+            self.serial_communication.write_to([byte for message in messages for byte in message])
+            return True
+
+        except Exception as e:
+            log.exception(str(e) + ' ' + log.get_debug_info())
+            return False
+
     def send_vibromotor_message(self, send_msg, timeout=0.05):
         """
         The method sends the messaqge to to make the icube vibrate.
@@ -648,7 +849,6 @@ class TactileDeviceV4(TactileDevice):
         """
         try:
             time.sleep(timeout)
-            self.serial_communication.empty_serial()
             self.serial_communication.write_to(send_msg)
             return True
 
@@ -663,7 +863,6 @@ class TactileDeviceV4(TactileDevice):
         """
         try:
             time.sleep(timeout)
-            self.serial_communication.empty_serial()
             self.serial_communication.write_to(duration_msg)
             return True
 
@@ -678,7 +877,6 @@ class TactileDeviceV4(TactileDevice):
         """
         try:
             time.sleep(timeout)
-            self.serial_communication.empty_serial()
             self.serial_communication.write_to(duty_msg)
             return True
 
@@ -693,7 +891,6 @@ class TactileDeviceV4(TactileDevice):
         """
         try:
             time.sleep(timeout)
-            self.serial_communication.empty_serial()
             self.serial_communication.write_to(play_audio_msg)
             return True
 
@@ -708,7 +905,6 @@ class TactileDeviceV4(TactileDevice):
         """
         try:
             time.sleep(timeout)
-            self.serial_communication.empty_serial()
             self.serial_communication.write_to(set_volume_msg)
             return True
 